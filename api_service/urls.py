@@ -22,6 +22,7 @@ urlpatterns = [
 	path('vendor/grns', get_vendors_grns, name="get_vendors_grns"),
 	# Invoice endpoints
 	path('vendor/invoices', VendorInvoiceView.as_view(), name='vendor_invoice'),
+	path('vendor/invoices/<int:invoice_id>', VendorInvoiceView.as_view(), name='vendor_invoice_detail'),
 	# Misc endpoints
 	path('surcharges', get_surcharges, name='get_surcharges'),
 	
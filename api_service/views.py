@@ -175,10 +175,10 @@ def get_vendors_orders(request, po_id=None):
 	"""
 	try:
 		if po_id:
-			orders = PurchaseOrder.objects.get(po_id=po_id, vendor=request.user.vendor_profile)
+			orders = PurchaseOrderSerializer.setup_eager_loading(PurchaseOrder.objects.all()).get(po_id=po_id, vendor=request.user.vendor_profile)
 			serializer = PurchaseOrderSerializer(orders)
 		else:
-			orders = PurchaseOrder.objects.filter(vendor=request.user.vendor_profile)
+			orders = PurchaseOrderSerializer.setup_eager_loading(PurchaseOrder.objects.filter(vendor=request.user.vendor_profile))
 			serializer = PurchaseOrderSerializer(orders, many=True)
 		# If there are no orders, return an empty list
 		data = [] if not serializer.data else serializer.data
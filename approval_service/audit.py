@@ -0,0 +1,171 @@
+import os
+import json
+import logging
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from .models import Signature, hash_identity
+
+
+# Number of worker processes used to verify the digests of a chunk of signable objects (1 verifies in-process)
+AUDIT_WORKERS = int(os.getenv('SIGNABLE_AUDIT_WORKERS', 1))
+
+
+def find_tampered(model_label, pks):
+	'''
+		Returns the primary keys of the given signable objects that have not been sealed and of the ones whose identity
+		data does not hash to their digest, as (unsealed, tampered). The objects and the related records in their identity
+		are loaded here, so that the whole check (not only the hashing) runs in a worker process.
+	'''
+	signable_class = apps.get_model(model_label)
+	unsealed, tampered = [], []
+	for signable in signable_class.prefetch_identity(signable_class.objects.filter(pk__in=pks)):
+		if not signable.digest:
+			unsealed.append(signable.pk)
+			continue
+		signable.set_identity()
+		if hash_identity(signable.identity_data) != signable.digest:
+			tampered.append(signable.pk)
+	return unsealed, tampered
+
+
+def find_broken_chains(signatures):
+	'''
+		Returns the issues found in the predecessor chains of the given signatures, which must be ordered by signable
+		and by the order they were signed in: the first signature of a signable must have no predecessor and every
+		other signature must reference the signature before it.
+	'''
+	issues, previous = {}, {}
+	for signature in signatures:
+		signable_id = signature['signable_id']
+		expected = previous.get(signable_id)
+		if signature['predecessor_id'] != expected:
+			issues.setdefault(signable_id, []).append(
+				f"Signature {signature['id']} references predecessor {signature['predecessor_id']} instead of {expected}."
+			)
+		previous[signable_id] = signature['id']
+	return issues
+
+
+class SignableAudit:
+	'''
+		Audits the sealed digests and signature chains of a signable model, in chunks of objects ordered by primary key.
+		Every issue found is appended to a report (one JSON object per line) and the last audited primary key is saved to
+		a checkpoint after every chunk, so an interrupted audit can be resumed. Resuming an audit whose pass has completed
+		starts a new pass over all the objects, so that every run re-checks the existing objects too.
+		Relative report and checkpoint paths are resolved under settings.SIGNABLE_AUDIT_DIR.
+	'''
+	def __init__(self, signable_class, report_path, checkpoint_path, chunk_size=500, workers=None):
+		self.signable_class = signable_class
+		self.model_label = signable_class._meta.label
+		self.content_type = ContentType.objects.get_for_model(signable_class)
+		self.report_path = self.resolve_path(report_path)
+		self.checkpoint_path = self.resolve_path(checkpoint_path)
+		self.chunk_size = chunk_size
+		self.workers = workers or AUDIT_WORKERS
+	
+	@staticmethod
+	def resolve_path(path):
+		path = os.path.join(settings.SIGNABLE_AUDIT_DIR, path)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		return path
+	
+	def new_state(self):
+		return {'last_pk': 0, 'audited': 0, 'issues': 0, 'started_at': datetime.now().isoformat(), 'completed_at': None}
+	
+	def load_checkpoint(self):
+		if not os.path.exists(self.checkpoint_path):
+			return None
+		with open(self.checkpoint_path) as checkpoint:
+			return json.load(checkpoint)
+	
+	def save_checkpoint(self, state):
+		# Write to a temporary file first, so that an interruption never leaves a partial checkpoint behind
+		with open(f'{self.checkpoint_path}.tmp', 'w') as checkpoint:
+			json.dump(state, checkpoint)
+		os.replace(f'{self.checkpoint_path}.tmp', self.checkpoint_path)
+	
+	def audit_chunk(self, signables, executor=None):
+		'''
+			Returns the issues found in a chunk of signable objects, given as (pk, signature_count) rows, as {pk: [issues]}.
+		'''
+		issues = {}
+		pks = [pk for pk, _ in signables]
+		
+		# Verify the digests, split across the worker processes if any
+		if executor:
+			batches = [pks[start::self.workers] for start in range(self.workers)]
+			results = list(executor.map(find_tampered, [self.model_label] * len(batches), batches))
+		else:
+			results = [find_tampered(self.model_label, pks)]
+		for unsealed, tampered in results:
+			for pk in unsealed:
+				issues.setdefault(pk, []).append("The object has not been sealed.")
+			for pk in tampered:
+				issues.setdefault(pk, []).append("The digest does not match the sealed data.")
+		
+		# Walk the signature chains of the chunk
+		signatures = list(Signature.objects.filter(
+			signable_type=self.content_type, signable_id__in=pks
+		).order_by('signable_id', 'date_signed', 'id').values('id', 'signable_id', 'predecessor_id'))
+		for pk, chain_issues in find_broken_chains(signatures).items():
+			issues.setdefault(pk, []).extend(chain_issues)
+		# and check them against the stored workflow state
+		signature_counts = {}
+		for signature in signatures:
+			signature_counts[signature['signable_id']] = signature_counts.get(signature['signable_id'], 0) + 1
+		for pk, signature_count in signables:
+			if signature_count != signature_counts.get(pk, 0):
+				issues.setdefault(pk, []).append(
+					f"The stored signature count ({signature_count}) does not match the signatures "
+					f"({signature_counts.get(pk, 0)})."
+				)
+		return issues
+	
+	def create_executor(self):
+		# Workers are spawned (not forked), so that they do not share the database connections of this process
+		return ProcessPoolExecutor(
+			max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup
+		)
+	
+	def run(self, resume=False):
+		'''
+			Audits the signable objects (after the checkpoint, when resuming an unfinished pass) and returns the final
+			checkpoint state.
+		'''
+		state = self.load_checkpoint() if resume else None
+		resume = bool(state) and not state.get('completed_at')
+		state = state if resume else self.new_state()
+		queryset = self.signable_class.objects.order_by('pk')
+		executor = self.create_executor() if self.workers > 1 else None
+		try:
+			with open(self.report_path, 'a' if resume else 'w') as report:
+				while True:
+					signables = list(queryset.filter(pk__gt=state['last_pk']).values_list('pk', 'signature_count')[:self.chunk_size])
+					if not signables:
+						break
+					issues = self.audit_chunk(signables, executor)
+					for pk, messages in issues.items():
+						report.write(json.dumps({
+							'model': self.content_type.model, 'id': pk, 'issues': messages,
+							'audited_at': datetime.now().isoformat(),
+						}) + '\n')
+					report.flush()
+					state.update({
+						'last_pk': signables[-1][0],
+						'audited': state['audited'] + len(signables),
+						'issues': state['issues'] + len(issues),
+					})
+					self.save_checkpoint(state)
+					logging.info(f"Audited {state['audited']} {self.content_type.model}(s), {state['issues']} with issues.")
+			# The pass is complete, the next resumed run starts a new one
+			state['completed_at'] = datetime.now().isoformat()
+			self.save_checkpoint(state)
+		finally:
+			if executor:
+				executor.shutdown()
+		return state
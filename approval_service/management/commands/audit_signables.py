@@ -0,0 +1,29 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from approval_service.audit import SignableAudit
+
+
+class Command(BaseCommand):
+	help = 'Audits the sealed digests and signature chains of signable objects and writes a report of the issues found.'
+	
+	def add_arguments(self, parser):
+		parser.add_argument('--model', default='invoice_service.Invoice', help='The signable model to audit (app_label.Model).')
+		parser.add_argument('--report', help='The report file, one issue per line (relative to SIGNABLE_AUDIT_DIR).')
+		parser.add_argument('--checkpoint', help='The checkpoint file (relative to SIGNABLE_AUDIT_DIR).')
+		parser.add_argument('--resume', action='store_true', help='Resume the audit from the checkpoint.')
+		parser.add_argument('--chunk_size', type=int, default=500, help='Number of objects audited at a time.')
+		parser.add_argument('--workers', type=int, help='Number of worker processes used to recompute the digests.')
+	
+	def handle(self, *args, **options):
+		# Every model gets its own report and checkpoint by default
+		model_name = options['model'].lower()
+		audit = SignableAudit(
+			apps.get_model(options['model']),
+			options.get('report') or f'{model_name}_audit_report.jsonl',
+			options.get('checkpoint') or f'{model_name}_audit_checkpoint.json',
+			chunk_size=options['chunk_size'], workers=options.get('workers')
+		)
+		state = audit.run(resume=options['resume'])
+		self.stdout.write(self.style.SUCCESS(
+			f"Audited {state['audited']} object(s), {state['issues']} with issues. See {audit.report_path} for the report."
+		))
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 02:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('approval_service', '0004_signature_predecessor'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='signature',
+            index=models.Index(fields=['signable_type', 'signable_id', 'date_signed', 'id'], name='approval_se_signabl_40c8f7_idx'),
+        ),
+    ]
@@ -1,4 +1,7 @@
-from django.db import models
+import os
+import json
+from django.db import models, connections, transaction
+from django.db.models import Q, Exists, OuterRef
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth import get_user_model
@@ -8,10 +11,16 @@ from dataclasses import dataclass
 from django.core.exceptions import PermissionDenied, ValidationError
 from django.db.models.signals import post_delete
 from django.dispatch import receiver
+from django.core.cache import cache
 
 
 user = get_user_model()
 
+def hash_identity(identity_data: str) -> str:
+	# Hash the identity data of a signable object using SHA-256
+	return hashlib.sha256(identity_data.encode()).hexdigest()
+
+
 class AbstractModelMeta(ABCMeta, type(models.Model)):
 	'''
 		A metaclass for the AbstractModel class.
@@ -19,6 +28,50 @@ class AbstractModelMeta(ABCMeta, type(models.Model)):
 	'''
 	pass
 
+class SignableQuerySet(models.QuerySet):
+	'''
+		Filters signable objects by the state of their workflow in SQL, using the signatures recorded against them.
+	'''
+	def get_signatures(self):
+		# The signatures of the signable object in the outer query
+		content_type = ContentType.objects.get_for_model(self.model)
+		return Signature.objects.filter(signable_type=content_type, signable_id=OuterRef('pk'))
+	
+	def for_signatories(self, roles):
+		'''
+			Signable objects whose signatories include any of the given roles.
+		'''
+		if not roles:
+			return self.none()
+		# JSON containment is not available on every database backend, fall back to matching the quoted role
+		if connections[self.db].features.supports_json_field_contains:
+			condition = Q(*[Q(signatories__contains=role) for role in roles], _connector=Q.OR)
+		else:
+			condition = Q(*[Q(signatories__icontains=json.dumps(role)) for role in roles], _connector=Q.OR)
+		return self.filter(condition)
+	
+	def signed_by(self, roles, accepted=None):
+		'''
+			Signable objects signed by any of the given roles (with the given verdict, if any).
+		'''
+		signatures = self.get_signatures().filter(metadata__acting_as__in=roles)
+		if accepted is not None:
+			signatures = signatures.filter(accepted=accepted)
+		return self.filter(Exists(signatures))
+	
+	def pending_for(self, roles):
+		'''
+			Signable objects waiting on the signature of any of the given roles.
+		'''
+		return self.filter(current_pending_signatory__in=roles)
+	
+	def completed(self):
+		'''
+			Signable objects that have been signed by all their signatories or rejected.
+		'''
+		return self.filter(completed=True)
+
+
 class Signable(models.Model, metaclass=AbstractModelMeta):
 	'''
 		A signable object is an object that can be signed by an authorized user.
@@ -31,10 +84,24 @@ class Signable(models.Model, metaclass=AbstractModelMeta):
 	signatories = models.JSONField(blank=False, null=False, default=dict)
 	# Current pending signatory for signing the signable object.
 	current_pending_signatory = models.CharField(max_length=150, blank=True, null=True)
+	# The state of the workflow, kept up to date as signatures are recorded or deleted (see set_workflow_state)
+	signature_count = models.PositiveIntegerField(default=0)
+	last_verdict = models.BooleanField(blank=True, null=True)
+	completed = models.BooleanField(default=False, db_index=True)
+	rejected = models.BooleanField(default=False, db_index=True)
+	
+	objects = SignableQuerySet.as_manager()
+	
+	workflow_state_fields = ['signature_count', 'last_verdict', 'completed', 'rejected', 'current_pending_signatory']
+	
+	# Number of seconds the result of a hash verification is cached for
+	verification_ttl = int(os.getenv('SIGNABLE_VERIFICATION_TTL', 3600))
 	
 	@property
 	def is_valid(self):
-		# Property that states whether the hash of the object is valid
+		# Property that states whether the hash of the object is valid, verified on first access
+		if not hasattr(self, 'verified'):
+			self.verify_hash()
 		return self.verified
 	
 	@property
@@ -42,17 +109,14 @@ class Signable(models.Model, metaclass=AbstractModelMeta):
 		'''
 			Property that states whether the signable object is completely signed by all its signatories.
 		'''
-		return len(self.get_signatures()) == len(self.signatories) or self.is_rejected
+		return self.completed
 	
 	@property
 	def is_rejected(self):
 		'''
 			Property that states whether the signable object has been rejected by any of its signatories.
 		'''
-		last_signature = self.get_last_signature()
-		if last_signature:
-			return last_signature.accepted is False
-		return False
+		return self.rejected
 	
 	@property
 	def is_accepted(self):
@@ -88,32 +152,70 @@ class Signable(models.Model, metaclass=AbstractModelMeta):
 		"""
 		pass
 	
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
-		# Re-verify the hash before initializing the model instance
-		self.verify_hash() if self.digest else None
+	def get_identity_version(self):
+		"""
+			Method that can be implemented by child classes.
+			It should return a value that changes whenever the related records hashed by set_identity change, so that
+			verification results can be cached. Returning None disables the cache.
+		"""
+		return None
+	
+	@classmethod
+	def prefetch_identity(cls, queryset):
+		"""
+			Method that can be implemented by child classes.
+			It should prefetch the related records hashed by set_identity, for verifying a queryset in bulk.
+		"""
+		return queryset
 	
 	def calculate_digest(self, ):
-		identity_data = self.identity_data
-		# Hash the identity data using SHA-256 (you can use any hash algorithm)
-		hashed_string = hashlib.sha256(identity_data.encode()).hexdigest()
-		# Update the digest field with the calculated hash
-		return hashed_string
+		# Hash the identity data and update the digest field with the calculated hash
+		return hash_identity(self.identity_data)
 	
 	def update_digest(self, ) -> bool:
 		try:
 			self.digest = self.calculate_digest()
-			super().save(update_fields=['signatories', 'current_pending_signatory', 'digest'])
+			# The workflow state depends on the signatories
+			self.set_workflow_state(self.signature_count, self.last_verdict)
+			super().save(update_fields=['signatories', 'digest', *self.workflow_state_fields])
 		except Exception as e:
 			raise e
 		# Return True if the hash was updated successfully
 		return True
 	
-	def verify_hash(self, ):
-		# Call the set_identity method to populate the self.digest
-		self.set_identity()
-		# Recalculate the hash and check if the recalculated hash matches the stored hash, set the value of the verified property
-		self.verified = self.digest == self.calculate_digest()
+	def get_verification_cache_key(self):
+		version = self.get_identity_version()
+		if not self.digest or version is None:
+			return None
+		return f"signable-verification:{self._meta.label_lower}:{self.pk}:{self.digest}:{version}"
+	
+	def verify_hash(self, use_cache=True):
+		# Use the cached result of a previous verification of the same digest and version of the hashed records
+		cache_key = self.get_verification_cache_key() if use_cache else None
+		verified = cache.get(cache_key) if cache_key else None
+		if verified is None:
+			# Call the set_identity method to populate the self.digest
+			self.set_identity()
+			# Recalculate the hash and check if the recalculated hash matches the stored hash
+			verified = self.digest == self.calculate_digest()
+			cache.set(cache_key, verified, self.verification_ttl) if cache_key else None
+		# Set the value of the verified property
+		self.verified = verified
+		return verified
+	
+	@classmethod
+	def verify_all(cls, queryset=None, use_cache=False, chunk_size=500):
+		"""
+			Verifies the hash of every signable object in the queryset (all objects by default), with the hashed records
+			prefetched in chunks, and returns a dictionary of the verification results keyed by primary key.
+			Audits bypass the verification cache by default.
+		"""
+		queryset = cls.objects.all() if queryset is None else queryset
+		return {
+			signable.pk: signable.verify_hash(use_cache=use_cache)
+			for signable in cls.prefetch_identity(queryset.order_by('pk')).iterator(chunk_size=chunk_size)
+		}
+	
 	
 	def get_signatures(self):
 		"""
@@ -131,7 +233,7 @@ class Signable(models.Model, metaclass=AbstractModelMeta):
 		"""
 		signatories = self.signatories
 		# The number of signatures made
-		number_of_signatures_made = len(self.get_signatures()) or 0
+		number_of_signatures_made = self.signature_count
 		# If no signatories are set or the signable object has been rejected, return None
 		if not signatories or self.is_rejected:
 			return None
@@ -147,13 +249,37 @@ class Signable(models.Model, metaclass=AbstractModelMeta):
 		signature = Signature.objects.filter(signable_type=content_type, signable_id=self.id).last()
 		return signature
 	
-	def reset_current_pending_signatory(self, ) -> bool:
+	def set_workflow_state(self, signature_count, last_verdict):
 		"""
-			Method to reset the current pending signatory for the signable object.
-			This method clears the current_pending_signatory field.
+			Method to set the stored workflow state (and the current pending signatory) from the number of signatures
+			made and the verdict of the last one.
 		"""
+		self.signature_count = signature_count
+		self.last_verdict = last_verdict
+		self.rejected = last_verdict is False
+		self.completed = self.rejected or signature_count == len(self.signatories)
 		self.current_pending_signatory = self.get_current_pending_signatory()
-		super().save(update_fields=['current_pending_signatory'])
+	
+	def lock_workflow_state(self):
+		"""
+			Method to lock the row of the signable object for the rest of the transaction and reload its workflow state.
+		"""
+		state = type(self).objects.select_for_update().filter(pk=self.pk).values(*self.workflow_state_fields).get()
+		for field, value in state.items():
+			setattr(self, field, value)
+	
+	def reset_current_pending_signatory(self, ) -> bool:
+		"""
+			Method to reset the current pending signatory (and the rest of the workflow state) for the signable object
+			from the signatures recorded against it.
+		"""
+		with transaction.atomic():
+			self.lock_workflow_state()
+			signatures = self.get_signatures()
+			self.set_workflow_state(
+				signatures.count(), signatures.order_by('-id').values_list('accepted', flat=True).first()
+			)
+			super().save(update_fields=self.workflow_state_fields)
 	
 	def sign(self, request: object) -> bool:
 		"""
@@ -163,41 +289,45 @@ class Signable(models.Model, metaclass=AbstractModelMeta):
 				- That the object has not been completely signed yet
 				- If the user has the necessary permissions to sign the object, and then creates a new signature.
 		"""
-		# Check that this object has not been rejected
-		if self.is_rejected:
-			raise ValidationError("This object has been rejected.")
-		# Check that this object has not been completely signed yet
-		if self.is_completely_signed:
-			raise ValidationError("This object has been completely signed.")
-		# Check that the user attempting to sign is the (has the role) current pending signatory
-		required_permission = f"{self._meta.app_label}.{self.get_current_pending_signatory()}"
-		if not request.user.has_perm(required_permission):
-			raise PermissionDenied("You do not have permission to sign this object.")
-		
-		try:
-			# Get the content type of the signable object
-			content_type = ContentType.objects.get_for_model(self)
-			# Create a new signature object and populate its fields
-			new_signature = Signature()
-			# Fields of the signature class
-			new_signature.signer = request.user
-			new_signature.signature = request.headers.get('Authorization').split(' ')[1] # TODO: Make the signature cryptographically reference the digest of the signable object
-			new_signature.accepted = request.data.get('approved')
-			new_signature.comment = request.data.get('comment')
-			new_signature.signable_type = content_type
-			new_signature.signable_id = self.id
-			new_signature.metadata = {
-				"acting_as": self.current_pending_signatory
-			}
-			# Save the new signature object to the database and update the signable object accordingly
-			new_signature.save()
-			# Update the current pending signatory of the signable
-			self.current_pending_signatory = self.get_current_pending_signatory()
-			# Use the super class to effect the update because we placed restrictions on the "save"
-			# method of this class to prevent modifications to the signable object.
-			super().save(update_fields=['current_pending_signatory'])
-		except Exception as e:
-			raise Exception("Unable to sign the object: ", str(e))
+		with transaction.atomic():
+			# Lock the signable object, so that concurrent signatures are recorded one after the other
+			self.lock_workflow_state()
+			# Check that this object has not been rejected
+			if self.is_rejected:
+				raise ValidationError("This object has been rejected.")
+			# Check that this object has not been completely signed yet
+			if self.is_completely_signed:
+				raise ValidationError("This object has been completely signed.")
+			# Check that the user attempting to sign is the (has the role) current pending signatory
+			required_permission = f"{self._meta.app_label}.{self.get_current_pending_signatory()}"
+			if not request.user.has_perm(required_permission):
+				raise PermissionDenied("You do not have permission to sign this object.")
+			
+			try:
+				# Get the content type of the signable object
+				content_type = ContentType.objects.get_for_model(self)
+				# Create a new signature object and populate its fields
+				new_signature = Signature()
+				# Fields of the signature class
+				new_signature.signer = request.user
+				new_signature.signature = request.headers.get('Authorization').split(' ')[1] # TODO: Make the signature cryptographically reference the digest of the signable object
+				new_signature.accepted = request.data.get('approved')
+				new_signature.comment = request.data.get('comment')
+				new_signature.signable_type = content_type
+				new_signature.signable_id = self.id
+				new_signature.metadata = {
+					"acting_as": self.current_pending_signatory
+				}
+				# Save the new signature object to the database and update the signable object accordingly
+				new_signature.save()
+				# Update the workflow state (and the current pending signatory) of the signable
+				accepted = Signature._meta.get_field('accepted').to_python(new_signature.accepted)
+				self.set_workflow_state(self.signature_count + 1, accepted)
+				# Use the super class to effect the update because we placed restrictions on the "save"
+				# method of this class to prevent modifications to the signable object.
+				super().save(update_fields=self.workflow_state_fields)
+			except Exception as e:
+				raise Exception("Unable to sign the object: ", str(e))
 		# If no exceptions were raised, the signature was successfully created and saved
 		return True
 	
@@ -231,6 +361,9 @@ class Signature(models.Model):
 	# Define a predecessor field to store reference to the previous signature
 	predecessor = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='successors')
 	
+	class Meta:
+		indexes = [models.Index(fields=['signable_type', 'signable_id', 'date_signed', 'id'])]
+	
 	@property
 	def role(self) -> str:
 		return self.metadata.get('acting_as', '')
@@ -256,7 +389,7 @@ class Signature(models.Model):
 	
 @receiver(post_delete, sender=Signature)
 def delete_signature_hook(sender, instance, using, **kwargs):
-	# Reset the current pending signatory of the signable object
+	# Reset the workflow state and the current pending signatory of the signable object
 	try:
 		instance.signable.reset_current_pending_signatory()
 	except Exception as e:
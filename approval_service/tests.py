@@ -1,3 +1,188 @@
-from django.test import TestCase
+import io
+import os
+import json
+import tempfile
+from unittest import mock
+from django.contrib.auth.models import Permission
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.management import call_command
+from django.test import override_settings
+from rest_framework.test import APIClient
+from core_service.models import CustomUser
+from invoice_service.models import Invoice
+from invoice_service.tests import InvoiceTestCase
+from .audit import SignableAudit
 
-# Create your tests here.
+
+# Permissions are granted through the model backend; ADFS only authenticates tokens
+@override_settings(AUTHENTICATION_BACKENDS=['django.contrib.auth.backends.ModelBackend'])
+class SignableTestCase(InvoiceTestCase):
+	'''
+		Base test case with two sealed invoices (one per GRN line item) and a user for each of the first signatory roles.
+	'''
+
+	def setUp(self):
+		super().setUp()
+		self.invoices = [self.create_invoice([grn_line_item]) for grn_line_item in self.grn_line_items]
+		self.accounts_payable = self.create_signatory('accounts_payable')
+		self.line_manager = self.create_signatory('line_manager')
+
+	def create_signatory(self, role):
+		signatory = CustomUser.objects.create(username=role)
+		signatory.user_permissions.add(Permission.objects.get(content_type__app_label='invoice_service', codename=role))
+		return signatory
+
+	def sign(self, invoice, signatory, approved=True):
+		request = mock.Mock(user=signatory, headers={'Authorization': 'Bearer token'},
+		                    data={'approved': approved, 'comment': 'Reviewed.'})
+		return Invoice.objects.get(pk=invoice.pk).sign(request)
+
+
+class SignableInboxTest(SignableTestCase):
+
+	def inbox(self, signatory, status_filter, **params):
+		client = APIClient()
+		client.force_authenticate(signatory)
+		response = client.get(f'/approvals/v1/get/invoice/{status_filter}', params)
+		self.assertEqual(response.status_code, 200)
+		return sorted(invoice['id'] for invoice in response.data['data']['results'])
+
+	def test_pending_invoices_are_filtered_by_role(self):
+		first, second = self.invoices
+		self.assertEqual(self.inbox(self.accounts_payable, 'pending'), [first.id, second.id])
+		self.assertEqual(self.inbox(self.line_manager, 'pending'), [])
+
+		self.sign(first, self.accounts_payable)
+		self.assertEqual(self.inbox(self.accounts_payable, 'pending'), [second.id])
+		self.assertEqual(self.inbox(self.line_manager, 'pending'), [first.id])
+
+	def test_invoices_are_filtered_by_verdict(self):
+		first, second = self.invoices
+		self.sign(first, self.accounts_payable)
+		self.sign(second, self.accounts_payable, approved=False)
+		self.assertEqual(self.inbox(self.accounts_payable, 'all', approved=1), [first.id])
+		self.assertEqual(self.inbox(self.accounts_payable, 'all', approved=0), [second.id])
+		# Only the rejected invoice has completed its workflow
+		self.assertEqual(self.inbox(self.accounts_payable, 'completed'), [second.id])
+
+
+class SignableWorkflowStateTest(SignableTestCase):
+
+	def workflow_state(self, invoice):
+		return Invoice.objects.filter(pk=invoice.pk).values_list(*Invoice.workflow_state_fields).get()
+
+	def test_signing_stores_the_workflow_state(self):
+		invoice = self.invoices[0]
+		self.assertEqual(self.workflow_state(invoice), (0, None, False, False, 'accounts_payable'))
+		self.sign(invoice, self.accounts_payable)
+		self.assertEqual(self.workflow_state(invoice), (1, True, False, False, 'line_manager'))
+		self.assertEqual(list(Invoice.objects.pending_for(['line_manager'])), [invoice])
+
+	def test_a_rejection_completes_the_workflow(self):
+		invoice = self.invoices[0]
+		self.sign(invoice, self.accounts_payable, approved=False)
+		self.assertEqual(self.workflow_state(invoice), (1, False, True, True, None))
+		with self.assertRaises(ValidationError):
+			self.sign(invoice, self.line_manager)
+
+	def test_only_the_pending_signatory_can_sign(self):
+		invoice = self.invoices[0]
+		with self.assertRaises(PermissionDenied):
+			self.sign(invoice, self.line_manager)
+		self.assertEqual(self.workflow_state(invoice), (0, None, False, False, 'accounts_payable'))
+
+	def test_deleting_a_signature_resets_the_workflow_state(self):
+		invoice = self.invoices[0]
+		self.sign(invoice, self.accounts_payable)
+		self.sign(invoice, self.line_manager, approved=False)
+		Invoice.objects.get(pk=invoice.pk).get_last_signature().delete()
+		self.assertEqual(self.workflow_state(invoice), (1, True, False, False, 'line_manager'))
+
+
+class SignableVerificationTest(SignableTestCase):
+
+	def test_the_hash_is_verified_on_first_access(self):
+		invoice = Invoice.objects.get(pk=self.invoices[0].pk)
+		self.assertFalse(hasattr(invoice, 'verified'))
+		with mock.patch.object(Invoice, 'verify_hash', autospec=True, side_effect=Invoice.verify_hash) as verify_hash:
+			self.assertTrue(invoice.is_valid)
+			self.assertTrue(invoice.is_valid)
+		verify_hash.assert_called_once()
+
+	def test_a_tampered_invoice_fails_verification(self):
+		first, second = self.invoices
+		self.assertTrue(Invoice.objects.get(pk=first.pk).verify_hash())
+		Invoice.objects.filter(pk=first.pk).update(description='Tampered')
+		self.assertFalse(Invoice.objects.get(pk=first.pk).verify_hash(use_cache=False))
+		self.assertEqual(Invoice.verify_all(chunk_size=1), {first.pk: False, second.pk: True})
+
+	def test_verify_all_prefetches_the_hashed_records(self):
+		# The invoices and their line items, whatever the number of invoices
+		with self.assertNumQueries(2):
+			self.assertEqual(set(Invoice.verify_all().values()), {True})
+
+
+class SignableAuditTest(SignableTestCase):
+
+	def setUp(self):
+		super().setUp()
+		audit_dir = tempfile.TemporaryDirectory()
+		self.addCleanup(audit_dir.cleanup)
+		audit_settings = override_settings(SIGNABLE_AUDIT_DIR=audit_dir.name)
+		audit_settings.enable()
+		self.addCleanup(audit_settings.disable)
+		self.report_path = os.path.join(audit_dir.name, 'invoice_service.invoice_audit_report.jsonl')
+		self.checkpoint_path = os.path.join(audit_dir.name, 'invoice_service.invoice_audit_checkpoint.json')
+		# The second invoice has been tampered with
+		Invoice.objects.filter(pk=self.invoices[1].pk).update(description='Tampered')
+
+	def audit(self, **options):
+		call_command('audit_signables', chunk_size=1, stdout=io.StringIO(), **options)
+		with open(self.checkpoint_path) as checkpoint:
+			return json.load(checkpoint)
+
+	def report(self):
+		with open(self.report_path) as report:
+			return [json.loads(line) for line in report]
+
+	def interrupted_audit(self):
+		# Interrupt the audit after the first chunk has been checkpointed
+		audit_chunk = SignableAudit.audit_chunk
+		chunks = []
+		def interrupt(audit, signables, executor=None):
+			if chunks:
+				raise KeyboardInterrupt
+			chunks.append(signables)
+			return audit_chunk(audit, signables, executor)
+		with mock.patch.object(SignableAudit, 'audit_chunk', interrupt), self.assertRaises(KeyboardInterrupt):
+			self.audit()
+
+	def test_issues_are_reported(self):
+		state = self.audit()
+		self.assertEqual((state['audited'], state['issues']), (2, 1))
+		self.assertTrue(state['completed_at'])
+		self.assertEqual([(line['id'], line['issues']) for line in self.report()],
+		                 [(self.invoices[1].pk, ["The digest does not match the sealed data."])])
+
+	def test_an_interrupted_audit_is_resumed_from_the_checkpoint(self):
+		Invoice.objects.filter(pk=self.invoices[0].pk).update(description='Tampered')
+		self.interrupted_audit()
+		with open(self.checkpoint_path) as checkpoint:
+			state = json.load(checkpoint)
+		self.assertEqual((state['last_pk'], state['audited'], state['completed_at']), (self.invoices[0].pk, 1, None))
+
+		with mock.patch.object(SignableAudit, 'audit_chunk', autospec=True, side_effect=SignableAudit.audit_chunk) as audit_chunk:
+			state = self.audit(resume=True)
+		# Only the invoice after the checkpoint is audited, and its issues are appended to the report
+		self.assertEqual([[pk for pk, _ in call.args[1]] for call in audit_chunk.call_args_list], [[self.invoices[1].pk]])
+		self.assertEqual((state['audited'], state['issues']), (2, 2))
+		self.assertTrue(state['completed_at'])
+		self.assertEqual([line['id'] for line in self.report()], [invoice.pk for invoice in self.invoices])
+
+	def test_resuming_a_completed_audit_starts_a_new_pass(self):
+		first = self.audit()
+		state = self.audit(resume=True)
+		self.assertEqual((state['audited'], state['issues']), (2, 1))
+		self.assertNotEqual(state['started_at'], first['started_at'])
+		# The report of the new pass replaces the previous one
+		self.assertEqual(len(self.report()), 1)
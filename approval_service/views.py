@@ -1,18 +1,17 @@
 from django.contrib.contenttypes.models import ContentType
 from django_auth_adfs.rest_framework import AdfsAccessTokenAuthentication
-from rest_framework import status
+from rest_framework import serializers, status
 from rest_framework.decorators import permission_classes, authentication_classes, api_view
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
-from invoice_service.serializers import InvoiceSerializer
+from invoice_service.serializers import InvoiceSerializer, InvoiceListSerializer
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from .models import Keystore, Signature
 from .serializers import SignatureSerializer
 from invoice_service.models import Invoice
-from overrides.rest_framework import APIResponse, CustomPagination
+from overrides.rest_framework import APIResponse, CustomPagination, expand_requested
 from django_q.tasks import async_task
 
-paginator = CustomPagination()
 
 def get_signable_class(target_class: str) -> object:
 	# Map signable classes to their corresponding Django models and app labels.
@@ -21,6 +20,7 @@ def get_signable_class(target_class: str) -> object:
 			"class": Invoice,
 			"app_label": "invoice_service",
 			"serializer": InvoiceSerializer,
+			"list_serializer": InvoiceListSerializer,
 			"order_by": "-date_created"
 		}
 	}
@@ -115,38 +115,31 @@ def get_user_signable_view(request, target_class, status_filter="all"):
 			[x.split('.') for x in request.user.get_all_permissions()]
 		)]
 		try:
-			# Get all signable objects.
-			signables = signable_class.objects.all().order_by(target.get("order_by"))
 			# This user's signables based on the Signatories.
-			signables = [obj for obj in signables if any(item in obj.signatories for item in relevant_permissions)]
+			signables = user_signables = signable_class.objects.for_signatories(relevant_permissions)
 			# Get signables where roles of the authenticated user has signed
-			signed_by_user_role = [obj for obj in signables if any(
-				role in (
-					(lambda x: map(lambda i: i.role, x))(obj.get_signatures())
-				) for role in relevant_permissions
-			)]
+			signed_by_user_role = user_signables.signed_by(relevant_permissions)
 			# Filter for signable objects that are pending signature from the role of the authenticated user.
-			signables = list(filter(lambda s: s.current_pending_signatory in relevant_permissions, signables)) if status_filter == "pending" else signables
+			signables = signables.pending_for(relevant_permissions) if status_filter == "pending" else signables
 			# Filter the signable objects by the ones that have been completed.
-			signables = list(filter(lambda s: s.is_completely_signed, signed_by_user_role)) if status_filter == "completed" else signables
+			signables = signed_by_user_role.completed() if status_filter == "completed" else signables
 			# Filter the signable objects for objects that have been accepted or rejected for the particular role, if the approved param is provided in the request.
 			verdict_filter = bool(int(request.GET.get("approved"))) if request.GET.get("approved") else None
 			if verdict_filter is not None:
-				signables = []
-				for signable in signed_by_user_role:
-					# Filter the signatures for the particular verdict (True for accepted, False for rejected) AND for the particular user's role
-					filtered_signatures = filter(
-						lambda i: (i.accepted == verdict_filter) and (i.role in relevant_permissions),
-						signable.get_signatures()
-					)
-					# Add the signable to the signables list.
-					signables.append(signable) if signable.id in [item.signable_id for item in filtered_signatures] else None
-			# Paginate the queryset.
-			paginated = paginator.paginate_queryset(signables, request)
+				# Signables with a signature of the particular verdict (True for accepted, False for rejected) AND for the particular user's role
+				signables = user_signables.signed_by(relevant_permissions, accepted=verdict_filter)
+			# List the compact representation of the signables, unless the full representation is requested
+			list_serializer = signable_serializer if expand_requested(request) else target.get("list_serializer")
+			signables = list_serializer.setup_eager_loading(signables)
+			# Paginate the queryset, with a paginator per request as it holds the state of the page.
+			paginator = CustomPagination()
+			paginated = paginator.paginate_queryset(signables, request, order_by=target.get("order_by"))
 			# Serialize the paginated signables.
-			serialized_signables = signable_serializer(paginated, many=True).data
+			serialized_signables = list_serializer(paginated, many=True).data
 			# Return the paginated response with the serialized signables.
 			paginated_data = paginator.get_paginated_response(serialized_signables).data
+		except serializers.ValidationError as e:
+			return APIResponse("Invalid pagination parameters.", status=status.HTTP_400_BAD_REQUEST, data=e.detail)
 		except Exception as e:
 			return APIResponse(f"Internal Error: {e}", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 		# Return the paginated response with the serialized signables.
@@ -176,20 +169,26 @@ def get_signable_view(request, target_class, status_filter="all"):
 		)]
 		try:
 			# Get all signable objects.
-			signables = signable_class.objects.all().order_by(target.get("order_by"))
+			signables = signable_class.objects.all()
 			# Filter for signable objects that are pending signature from the role of the authenticated user.
-			signables = list(filter(lambda s: not s.is_completely_signed, signables)) if status_filter == "pending" else signables
+			signables = signables.filter(completed=False) if status_filter == "pending" else signables
 			# Filter the signable objects by the ones that have been completed.
-			signables = list(filter(lambda s: s.is_completely_signed, signables)) if status_filter == "completed" else signables
+			signables = signables.filter(completed=True) if status_filter == "completed" else signables
 			# Filter the signable objects by accepted or rejected, if the approved param is provided in the request.
 			verdict_filter = bool(int(request.GET.get("approved"))) if request.GET.get("approved") else None
-			signables = list(filter(lambda s: s.is_accepted == verdict_filter, signables)) if verdict_filter else signables
-			# Paginate the queryset.
-			paginated = paginator.paginate_queryset(signables, request)
+			signables = signables.filter(completed=True, rejected=False) if verdict_filter else signables
+			# List the compact representation of the signables, unless the full representation is requested
+			list_serializer = signable_serializer if expand_requested(request) else target.get("list_serializer")
+			signables = list_serializer.setup_eager_loading(signables)
+			# Paginate the queryset, with a paginator per request as it holds the state of the page.
+			paginator = CustomPagination()
+			paginated = paginator.paginate_queryset(signables, request, order_by=target.get("order_by"))
 			# Serialize the paginated signables.
-			serialized_signables = signable_serializer(paginated, many=True).data
+			serialized_signables = list_serializer(paginated, many=True).data
 			# Return the paginated response with the serialized signables.
 			paginated_data = paginator.get_paginated_response(serialized_signables).data
+		except serializers.ValidationError as e:
+			return APIResponse("Invalid pagination parameters.", status=status.HTTP_400_BAD_REQUEST, data=e.detail)
 		except Exception as e:
 			return APIResponse(f"Internal Error: {e}", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 		# Return the paginated response with the serialized signables.
@@ -217,8 +216,9 @@ def track_signable_view(request, target_class, object_id):
 			content_type = ContentType.objects.get_for_model(signable_class)
 			# Get all signatures for the signable object.
 			signatures = Signature.objects.filter(signable_type=content_type, signable_id=object_id)
-			# Paginate the queryset.
-			paginated = paginator.paginate_queryset(signatures, request, order_by='-date_signed')
+			# Paginate the queryset, with a paginator per request as it holds the state of the page.
+			paginator = CustomPagination()
+			paginated = paginator.paginate_queryset(signatures, request, order_by='-date_signed', keyset=('-date_signed', '-id'))
 			# Serialize the paginated signatures.
 			serialized_signatures = SignatureSerializer(paginated, many=True).data
 			# Return the paginated response with the serialized signatures.
@@ -226,6 +226,8 @@ def track_signable_view(request, target_class, object_id):
 			return APIResponse("Data retrieved.", status=status.HTTP_200_OK, data=paginated_data)
 		except ObjectDoesNotExist:
 			return APIResponse(f"No signatures found for {target_class} {object_id}.", status=status.HTTP_404_NOT_FOUND)
+		except serializers.ValidationError as e:
+			return APIResponse("Invalid pagination parameters.", status=status.HTTP_400_BAD_REQUEST, data=e.detail)
 		except Exception as e:
 			return APIResponse(f"Internal Error: {e}", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 	# Return a 400 if the signable class does not exist
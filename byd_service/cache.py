@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import inspect
+import threading
+from copy import deepcopy
+from functools import wraps
+from collections import OrderedDict
+from django.core.cache import cache
+from core_service.helpers import SingleFlight
+
+
+class ResponseCache:
+	'''
+		TTL cache of ByD responses, backed by Django's cache framework ("django", shared between processes) or by an
+		in-process LRU of up to SAP_CACHE_MAX_ENTRIES responses ("local"), as configured by SAP_CACHE_BACKEND.
+		Concurrent misses on the same key are collapsed into a single request to ByD.
+	'''
+	backend = os.getenv('SAP_CACHE_BACKEND', 'local')
+	max_entries = int(os.getenv('SAP_CACHE_MAX_ENTRIES', 1000))
+	key_prefix = 'byd_service.response'
+
+	def __init__(self, backend=None, max_entries=None):
+		self.backend = backend or self.backend
+		self.max_entries = max_entries or self.max_entries
+		self.lock = threading.Lock()
+		self.entries = OrderedDict()
+		self.fetches = SingleFlight()
+		# The fetches in flight on the event loops, for the async clients
+		self.async_fetches = {}
+		self.hits = self.misses = 0
+
+	def make_key(self, name, *args, **kwargs):
+		# Hash the arguments, so that any argument (e.g. an email address) makes a valid cache key
+		arguments = json.dumps([args, kwargs], sort_keys=True, default=str)
+		return f"{self.key_prefix}:{name}:{hashlib.sha1(arguments.encode()).hexdigest()}"
+
+	def count(self, found):
+		# Lookups come from many threads at once (e.g. the batch lookups)
+		with self.lock:
+			if found:
+				self.hits += 1
+			else:
+				self.misses += 1
+	
+	def get(self, key):
+		'''
+			Returns (True, response) for a cached response or (False, None) for a miss. Responses are returned as
+			copies, so that callers can modify them.
+		'''
+		if self.backend == 'django':
+			found = cache.get(key, self)
+			return (False, None) if found is self else (True, found)
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None or entry[1] <= time.monotonic():
+				self.entries.pop(key, None)
+				return False, None
+			self.entries.move_to_end(key)
+		return True, deepcopy(entry[0])
+
+	def set(self, key, response, ttl):
+		if self.backend == 'django':
+			cache.set(key, response, ttl)
+			return
+		with self.lock:
+			self.entries[key] = (deepcopy(response), time.monotonic() + ttl)
+			self.entries.move_to_end(key)
+			# Evict the least recently used responses
+			while len(self.entries) > self.max_entries:
+				self.entries.popitem(last=False)
+
+	def invalidate(self, key=None):
+		'''
+			Removes the given key (or every response, if no key is given) from the cache.
+		'''
+		if self.backend == 'django':
+			cache.delete(key) if key else None
+			return
+		with self.lock:
+			self.entries.pop(key, None) if key else self.entries.clear()
+
+	def get_or_fetch(self, key, ttl, function, *args, **kwargs):
+		'''
+			Returns the cached response for the key, or calls the function (once for all the concurrent callers) and
+			caches its response for ttl seconds. Falsy responses (i.e. not found or failed requests) are not cached.
+		'''
+		found, response = self.get(key)
+		self.count(found)
+		if found:
+			return response
+
+		def fetch():
+			# Another thread may have cached the response while this one was waiting
+			found, response = self.get(key)
+			if found:
+				return response
+			response = function(*args, **kwargs)
+			if response and ttl > 0:
+				self.set(key, response, ttl)
+			return response
+
+		# Every caller gets its own copy of a shared response
+		return deepcopy(self.fetches.do(key, fetch))
+
+	async def aget(self, key):
+		if self.backend == 'django':
+			found = await cache.aget(key, self)
+			return (False, None) if found is self else (True, found)
+		return self.get(key)
+
+	async def aset(self, key, response, ttl):
+		if self.backend == 'django':
+			await cache.aset(key, response, ttl)
+			return
+		self.set(key, response, ttl)
+
+	async def aget_or_fetch(self, key, ttl, function, *args, **kwargs):
+		'''
+			Async variant of get_or_fetch, for coroutine functions. Concurrent misses on the same key (and event loop)
+			await a single fetch.
+		'''
+		found, response = await self.aget(key)
+		self.count(found)
+		if found:
+			return response
+
+		async def fetch():
+			response = await function(*args, **kwargs)
+			if response and ttl > 0:
+				await self.aset(key, response, ttl)
+			return response
+
+		flight = (id(asyncio.get_running_loop()), key)
+		task = self.async_fetches.get(flight)
+		if task is None:
+			task = self.async_fetches[flight] = asyncio.ensure_future(fetch())
+			task.add_done_callback(lambda _: self.async_fetches.pop(flight, None))
+		# Shield the fetch, so that a cancelled caller does not cancel it for the other callers
+		return deepcopy(await asyncio.shield(task))
+
+	def metrics(self):
+		return {'backend': self.backend, 'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+
+def cached_response(method):
+	'''
+		Caches the responses of a RESTServices method for the TTL configured for it in RESTServices.cache_ttls (a TTL
+		of 0 disables the cache). Pass use_cache=False to bypass the cache for a call and refresh the cached response.
+		Works on the coroutine methods of the async client too. The cache key is built from the bound arguments of the
+		call, so that positional and keyword arguments (and omitted defaults) hit the same response.
+	'''
+	signature = inspect.signature(method)
+	
+	def make_key(self, args, kwargs):
+		arguments = signature.bind(self, *args, **kwargs)
+		arguments.apply_defaults()
+		return self.response_cache.make_key(method.__name__, **dict(list(arguments.arguments.items())[1:]))
+	
+	if inspect.iscoroutinefunction(method):
+		@wraps(method)
+		async def async_wrapper(self, *args, use_cache=True, **kwargs):
+			ttl = self.cache_ttls.get(method.__name__, 0)
+			if ttl <= 0:
+				return await method(self, *args, **kwargs)
+			key = make_key(self, args, kwargs)
+			if not use_cache:
+				self.response_cache.invalidate(key)
+			return await self.response_cache.aget_or_fetch(key, ttl, method, self, *args, **kwargs)
+		return async_wrapper
+
+	@wraps(method)
+	def wrapper(self, *args, use_cache=True, **kwargs):
+		ttl = self.cache_ttls.get(method.__name__, 0)
+		if ttl <= 0:
+			return method(self, *args, **kwargs)
+		key = make_key(self, args, kwargs)
+		if not use_cache:
+			self.response_cache.invalidate(key)
+		return self.response_cache.get_or_fetch(key, ttl, method, self, *args, **kwargs)
+	return wrapper
+
+
+# The process-wide cache of ByD responses
+response_cache = ResponseCache()
@@ -1,8 +1,17 @@
 import os
 import json
-from requests import get
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException, HTTPError
+from urllib3.util.retry import Retry
 from pathlib import Path
 from dotenv import load_dotenv
+from .cache import response_cache, cached_response
 
 dotenv_path = os.path.join(Path(__file__).resolve().parent.parent, '.env')
 load_dotenv(dotenv_path)
@@ -13,23 +22,121 @@ class RESTServices:
 	    RESTful API for interacting with SAP's ByD system
 	'''
 	endpoint = os.getenv('SAP_URL')
+	# Connections kept alive to ByD (per process), retries of failed reads and the (connect, read) timeouts in seconds
+	pool_size = int(os.getenv('SAP_POOL_SIZE', 10))
+	max_retries = int(os.getenv('SAP_MAX_RETRIES', 3))
+	retry_backoff = float(os.getenv('SAP_RETRY_BACKOFF', 0.5))
+	timeout = (float(os.getenv('SAP_CONNECT_TIMEOUT', 5)), float(os.getenv('SAP_READ_TIMEOUT', 60)))
+	# Results requested per page of an OData collection, see iter_collection()
+	page_size = int(os.getenv('SAP_PAGE_SIZE', 100))
+	# Requests sent to ByD at the same time by the batch lookups, see get_purchase_orders_by_id()
+	batch_concurrency = int(os.getenv('SAP_BATCH_CONCURRENCY', 4))
+	
+	# The session shared by all the instances in this process, see get_session()
+	session = None
+	session_pid = None
+	session_lock = threading.Lock()
+	metrics = {'requests': 0, 'errors': 0, 'retries': 0, 'elapsed': 0.0}
+	
+	# Seconds the responses of each lookup are cached for (0 disables the cache), see byd_service.cache
+	response_cache = response_cache
+	cache_ttls = {
+		'get_vendor_by_id': int(os.getenv('SAP_VENDOR_CACHE_TTL', 300)),
+		'get_vendor_purchase_orders': int(os.getenv('SAP_VENDOR_ORDERS_CACHE_TTL', 60)),
+		'get_purchase_order_by_id': int(os.getenv('SAP_PURCHASE_ORDER_CACHE_TTL', 60)),
+	}
 	
 	def __init__(self, ):
 		from .authenticate import HTTPAuth
 		
 		self.auth = HTTPAuth()
+	
+	@classmethod
+	def create_session(cls):
+		'''
+			Returns a session that keeps up to pool_size connections to ByD alive, and retries idempotent requests that
+			fail to connect or are throttled / rejected by a gateway, backing off exponentially between attempts.
+		'''
+		retry = Retry(
+			total=cls.max_retries, backoff_factor=cls.retry_backoff, status_forcelist=(429, 502, 503, 504),
+			allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']), respect_retry_after_header=True,
+			# Return the last response once the retries are exhausted, the callers handle the status code
+			raise_on_status=False,
+		)
+		adapter = HTTPAdapter(pool_connections=1, pool_maxsize=cls.pool_size, max_retries=retry)
+		session = Session()
+		session.mount('https://', adapter)
+		session.mount('http://', adapter)
+		return session
+	
+	@classmethod
+	def get_session(cls):
+		# Sockets can not be shared with forked processes (e.g. the django_q workers), so each process gets its own session
+		if cls.session is None or cls.session_pid != os.getpid():
+			with cls.session_lock:
+				if cls.session is None or cls.session_pid != os.getpid():
+					cls.session, cls.session_pid = cls.create_session(), os.getpid()
+					cls.metrics = {'requests': 0, 'errors': 0, 'retries': 0, 'elapsed': 0.0}
+		return cls.session
+	
+	@classmethod
+	def pool_metrics(cls):
+		'''
+			Returns the request counters of this process and the state of its connection pools: the connections opened
+			(i.e. TLS handshakes) against the requests sent over them, and the connections currently idle in the pools.
+		'''
+		metrics = dict(cls.metrics)
+		metrics['cache'] = cls.response_cache.metrics()
+		metrics['average_elapsed'] = metrics['elapsed'] / metrics['requests'] if metrics['requests'] else 0
+		metrics['connections_opened'] = metrics['connection_requests'] = metrics['idle_connections'] = 0
+		if cls.session is not None and cls.session_pid == os.getpid():
+			pools = cls.session.get_adapter(cls.endpoint or 'https://').poolmanager.pools
+			for key in pools.keys():
+				pool = pools.get(key)
+				if pool is None:
+					continue
+				metrics['connections_opened'] += pool.num_connections
+				metrics['connection_requests'] += pool.num_requests
+				# The pool queue holds None for the slots no connection has been opened in yet
+				metrics['idle_connections'] += len([connection for connection in list(pool.pool.queue) if connection]) if pool.pool else 0
+		return metrics
+	
+	def get(self, url, timeout=None, **kwargs):
+		'''
+			Sends a GET request to ByD over the shared session, with HTTP Basic Authentication and the default timeouts.
+		'''
+		started = time.monotonic()
+		try:
+			response = self.get_session().get(url, auth=self.auth, timeout=timeout or self.timeout, **kwargs)
+		except RequestException as e:
+			with self.session_lock:
+				self.metrics['errors'] += 1
+			raise e
+		finally:
+			elapsed = time.monotonic() - started
+			with self.session_lock:
+				self.metrics['requests'] += 1
+				self.metrics['elapsed'] += elapsed
+		# The retries urllib3 made before this response
+		retries = getattr(getattr(response.raw, 'retries', None), 'history', ())
+		if retries:
+			with self.session_lock:
+				self.metrics['retries'] += len(retries)
+		logging.debug(f"ByD GET {url} returned {response.status_code} in {elapsed:.3f}s after {len(retries)} retries")
+		return response
 
-	def get_vendor_by_id(self, vendor_id, id_type='email'):
+	def get_vendor_by_id_url(self, vendor_id, id_type='email'):
 		action_url = f"{self.endpoint}/sap/byd/odata/cust/v1/khbusinesspartner/CurrentDefaultAddressInformationCollection?$format=json&$expand=EMail,BusinessPartner,ConventionalPhone,MobilePhone&$select=EMail,BusinessPartner,ConventionalPhone,MobilePhone&$top=10"
 		query_url = f"{action_url}&$filter=EMail/URI eq '{vendor_id}'"
 
 		if id_type == 'phone':
 			vendor_id = vendor_id.strip()[-10:]
 			query_url = f"{action_url}&$filter=substringof('{vendor_id}',ConventionalPhone/NormalisedNumberDescription)"
+		return query_url
 
-		# Make a request with HTTP Basic Authentication
-		response = get(query_url, auth=self.auth)
-
+	@staticmethod
+	def parse_vendor(response):
+		# Returns the active vendor in the response, or False
 		if response.status_code == 200:
 			try:
 				response_json = json.loads(response.text)
@@ -46,32 +153,80 @@ class RESTServices:
 
 		return False
 
-	def get_vendor_purchase_orders(self, internal_id):
-		action_url = f"{self.endpoint}/sap/byd/odata/cust/v1/khpurchaseorder/PurchaseOrderCollection?$format=json&$expand=Supplier,Item&$filter=Supplier/PartyID eq '{internal_id}'"
-
+	@cached_response
+	def get_vendor_by_id(self, vendor_id, id_type='email'):
 		# Make a request with HTTP Basic Authentication
-		response = get(action_url, auth=self.auth)
+		response = self.get(self.get_vendor_by_id_url(vendor_id, id_type))
+		return self.parse_vendor(response)
 
-		if response.status_code == 200:
-			try:
-				response_json = json.loads(response.text)
-				results = response_json["d"]["results"]
+	def get_page_url(self, action_url, page_size, skip, count=False):
+		return f"{action_url}&$top={page_size}&$skip={skip}" + ("&$inlinecount=allpages" if count else "")
 
-				# Keys to unset
-				keys_to_unset = ['AttachmentFolder', 'Notes', 'PaymentTerms', 'BuyerParty', 'BillToParty',
-								 'EmployeeResponsible', 'PurchasingUnit', 'Supplier', '__metadata']
-				for result in results:
-					# Unset keys from the dictionary
-					for key in keys_to_unset:
-						if key in result:
-							del result[key]
-				return results
-			except Exception as e:
-				raise e
+	@staticmethod
+	def parse_page(response):
+		# Returns the "d" object of a page of an OData collection, with its "results" and "__next" link / "__count"
+		if response.status_code != 200:
+			raise HTTPError(f"ByD returned {response.status_code} for {response.url}", response=response)
+		return json.loads(response.text)["d"]
 
-		return False
+	def iter_collection(self, action_url, page_size=None):
+		'''
+			Iterates over the results of an OData collection query, one page of results in memory at a time. Follows the
+			"__next" link of each page when ByD returns one (server-side paging), otherwise requests the next page with
+			$top/$skip. Raises an HTTPError if ByD fails to return a page.
+		'''
+		page_size = page_size or self.page_size
+		skip = 0
+		url = self.get_page_url(action_url, page_size, skip)
+		while url:
+			page = self.parse_page(self.get(url))
+			results = page["results"]
+			yield from results
+			
+			if page.get("__next"):
+				url = page["__next"]
+			elif len(results) < page_size:
+				url = None
+			else:
+				skip += page_size
+				url = self.get_page_url(action_url, page_size, skip)
+	
+	def get_vendor_purchase_orders_url(self, internal_id, select=None, expand=None):
+		action_url = (f"{self.endpoint}/sap/byd/odata/cust/v1/khpurchaseorder/PurchaseOrderCollection?$format=json"
+		              f"&$filter=Supplier/PartyID eq '{internal_id}'&$orderby=ObjectID")
+		if expand:
+			action_url += f"&$expand={expand}"
+		if select:
+			action_url += f"&$select={','.join(select)}"
+		return action_url
+	
+	def iter_vendor_purchase_orders(self, internal_id, select=None, expand=None, page_size=None):
+		'''
+			Iterates over the purchase orders of a supplier, a page at a time (see iter_collection), projected to the
+			given properties ($select) and expanded with the given navigation properties ($expand), if any.
+		'''
+		return self.iter_collection(self.get_vendor_purchase_orders_url(internal_id, select, expand), page_size)
+	
+	@staticmethod
+	def strip_purchase_order(result):
+		# Keys to unset
+		keys_to_unset = ['AttachmentFolder', 'Notes', 'PaymentTerms', 'BuyerParty', 'BillToParty',
+						 'EmployeeResponsible', 'PurchasingUnit', 'Supplier', '__metadata']
+		# Unset keys from the dictionary
+		for key in keys_to_unset:
+			if key in result:
+				del result[key]
+		return result
+	
+	@cached_response
+	def get_vendor_purchase_orders(self, internal_id):
+		try:
+			results = list(self.iter_vendor_purchase_orders(internal_id, expand='Supplier,Item'))
+		except HTTPError:
+			return False
+		return [self.strip_purchase_order(result) for result in results]
 
-	def get_purchase_order_by_id(self, PurchaseOrderID):
+	def get_purchase_order_by_id_url(self, PurchaseOrderID):
 		action_url: str = (f"{self.endpoint}/sap/byd/odata/cust/v1/khpurchaseorder/PurchaseOrderCollection?$format=json"
 						   f"&$expand=Supplier/SupplierName,Supplier/SupplierFormattedAddress,"
 						   f"BuyerParty,BuyerParty/BuyerPartyName,"
@@ -79,10 +234,11 @@ class RESTServices:
 						   f"ApproverParty/ApproverPartyName,"
 						   f"Item/ItemShipToLocation/DeliveryAddress/DeliveryPostalAddress&$filter=ID eq '"
 						   f"{PurchaseOrderID}'")
+		return action_url
 
-		# Make a request with HTTP Basic Authentication
-		response = get(action_url, auth=self.auth)
-
+	@staticmethod
+	def parse_purchase_order(response):
+		# Returns the purchase order in the response, or False
 		if response.status_code == 200:
 			try:
 				response_json = json.loads(response.text)
@@ -92,6 +248,190 @@ class RESTServices:
 				raise e
 
 		return False
+
+	@cached_response
+	def get_purchase_order_by_id(self, PurchaseOrderID):
+		# Make a request with HTTP Basic Authentication
+		response = self.get(self.get_purchase_order_by_id_url(PurchaseOrderID))
+		return self.parse_purchase_order(response)
+	
+	def get_purchase_orders_by_id(self, purchase_order_ids, concurrency=None):
+		'''
+			Fetches many purchase orders, with up to `concurrency` requests in flight over the shared session (and
+			through the response cache of get_purchase_order_by_id). Returns (results, errors): the purchase orders
+			keyed by the given IDs (False for the ones ByD does not have), and the errors of the lookups that failed,
+			keyed by ID, so that a failed lookup does not fail the rest of the batch.
+		'''
+		purchase_order_ids = list(dict.fromkeys(purchase_order_ids))
+		results, errors = {}, {}
+		if not purchase_order_ids:
+			return results, errors
+		
+		def fetch(purchase_order_id):
+			try:
+				return purchase_order_id, self.get_purchase_order_by_id(purchase_order_id), None
+			except Exception as e:
+				return purchase_order_id, None, e
+		
+		concurrency = min(concurrency or self.batch_concurrency, self.pool_size, len(purchase_order_ids))
+		with ThreadPoolExecutor(max_workers=concurrency) as executor:
+			for purchase_order_id, purchase_order, error in executor.map(fetch, purchase_order_ids):
+				if error:
+					logging.error(f"Error fetching purchase order {purchase_order_id} from ByD: {error}")
+					errors[purchase_order_id] = str(error)
+				else:
+					results[purchase_order_id] = purchase_order
+		return results, errors
 	
 	def create_order_receipt(self, ):
 		...
+
+
+class AsyncRESTServices(RESTServices):
+	'''
+		Asyncio variant of RESTServices, for the async views (i.e. under ASGI): the same lookups, URLs and parsing, sent
+		over an httpx.AsyncClient shared by every instance on the running event loop, so that many requests to ByD can be
+		in flight at once without a thread each.
+	'''
+	retry_statuses = (429, 502, 503, 504)
+	
+	def get_client(self):
+		import httpx
+		from core_service.helpers import get_async_client
+		
+		# Fetched per call (not kept on the instance), as the client belongs to the event loop it was created on
+		return get_async_client(
+			'byd', auth=(self.auth.username or '', self.auth.password or ''),
+			timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+			limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+			# Retries the requests that fail to connect
+			transport=httpx.AsyncHTTPTransport(retries=self.max_retries),
+		)
+	
+	async def get(self, url, timeout=None, **kwargs):
+		'''
+			Sends a GET request to ByD over the shared client, retrying the throttled / rejected requests (like the
+			session's Retry) and backing off exponentially between attempts without blocking the event loop.
+		'''
+		import httpx
+		
+		client = self.get_client()
+		started = time.monotonic()
+		attempt = 0
+		try:
+			while True:
+				response = await client.get(url, timeout=timeout or httpx.USE_CLIENT_DEFAULT, **kwargs)
+				if response.status_code not in self.retry_statuses or attempt >= self.max_retries:
+					break
+				attempt += 1
+				await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1))
+		except httpx.HTTPError as e:
+			with self.session_lock:
+				self.metrics['errors'] += 1
+			raise e
+		finally:
+			elapsed = time.monotonic() - started
+			# The counters are shared with the threads of the sync client
+			with self.session_lock:
+				self.metrics['requests'] += 1
+				self.metrics['elapsed'] += elapsed
+				self.metrics['retries'] += attempt
+		logging.debug(f"ByD GET {url} returned {response.status_code} in {elapsed:.3f}s after {attempt} retries")
+		return response
+	
+	@cached_response
+	async def get_vendor_by_id(self, vendor_id, id_type='email'):
+		response = await self.get(self.get_vendor_by_id_url(vendor_id, id_type))
+		return self.parse_vendor(response)
+	
+	async def get_first_page(self, action_url, page_size=None):
+		'''
+			Returns the first page of an OData collection query, with the size of the collection ($inlinecount).
+		'''
+		return self.parse_page(await self.get(self.get_page_url(action_url, page_size or self.page_size, 0, count=True)))
+	
+	async def iter_collection(self, action_url, page_size=None, first_page=None):
+		'''
+			Async variant of RESTServices.iter_collection. The first page asks ByD for the size of the collection
+			($inlinecount), so that the remaining pages can be requested batch_concurrency at a time; results are still
+			yielded in order. Falls back to following the "__next" links when ByD pages the collection itself.
+			The first page can be fetched beforehand (see get_first_page), e.g. to fail before a response starts: unlike
+			a started async generator, it can be handed over to another event loop.
+		'''
+		page_size = page_size or self.page_size
+		page = first_page or await self.get_first_page(action_url, page_size)
+		for result in page["results"]:
+			yield result
+		
+		if page.get("__next"):
+			url = page["__next"]
+			while url:
+				page = self.parse_page(await self.get(url))
+				for result in page["results"]:
+					yield result
+				url = page.get("__next")
+			return
+		
+		if "__count" in page:
+			skips = list(range(page_size, int(page["__count"]), page_size))
+		elif len(page["results"]) < page_size:
+			skips = []
+		else:
+			# Without a count, request the pages one at a time until a short page
+			skip = page_size
+			while True:
+				page = self.parse_page(await self.get(self.get_page_url(action_url, page_size, skip)))
+				for result in page["results"]:
+					yield result
+				if len(page["results"]) < page_size:
+					return
+				skip += page_size
+		
+		for start in range(0, len(skips), self.batch_concurrency):
+			responses = await asyncio.gather(*[
+				self.get(self.get_page_url(action_url, page_size, skip)) for skip in skips[start:start + self.batch_concurrency]
+			])
+			for response in responses:
+				for result in self.parse_page(response)["results"]:
+					yield result
+	
+	def iter_vendor_purchase_orders(self, internal_id, select=None, expand=None, page_size=None):
+		return self.iter_collection(self.get_vendor_purchase_orders_url(internal_id, select, expand), page_size)
+	
+	@cached_response
+	async def get_vendor_purchase_orders(self, internal_id):
+		try:
+			results = [result async for result in self.iter_vendor_purchase_orders(internal_id, expand='Supplier,Item')]
+		except HTTPError:
+			return False
+		return [self.strip_purchase_order(result) for result in results]
+	
+	@cached_response
+	async def get_purchase_order_by_id(self, PurchaseOrderID):
+		response = await self.get(self.get_purchase_order_by_id_url(PurchaseOrderID))
+		return self.parse_purchase_order(response)
+	
+	async def get_purchase_orders_by_id(self, purchase_order_ids, concurrency=None):
+		'''
+			Async variant of RESTServices.get_purchase_orders_by_id, with up to `concurrency` lookups in flight on the
+			event loop. Returns (results, errors), keyed by the given IDs.
+		'''
+		purchase_order_ids = list(dict.fromkeys(purchase_order_ids))
+		results, errors = {}, {}
+		if not purchase_order_ids:
+			return results, errors
+		
+		semaphore = asyncio.Semaphore(min(concurrency or self.batch_concurrency, self.pool_size))
+		
+		async def fetch(purchase_order_id):
+			async with semaphore:
+				return await self.get_purchase_order_by_id(purchase_order_id)
+		
+		responses = await asyncio.gather(*[fetch(i) for i in purchase_order_ids], return_exceptions=True)
+		for purchase_order_id, response in zip(purchase_order_ids, responses):
+			if isinstance(response, Exception):
+				logging.error(f"Error fetching purchase order {purchase_order_id} from ByD: {response}")
+				errors[purchase_order_id] = str(response)
+			else:
+				results[purchase_order_id] = response
+		return results, errors
@@ -1,7 +1,12 @@
 # Import necessary modules for testing
+import json
+import asyncio
+from unittest import mock
+from requests.exceptions import ConnectionError
 from django.test import TestCase
 from django.urls import reverse
-from .rest import RESTServices
+from .rest import RESTServices, AsyncRESTServices
+from .cache import ResponseCache
 
 # Define your test case class
 class RESTServicesTest(TestCase):
@@ -17,4 +22,190 @@ class RESTServicesTest(TestCase):
 
 	# Define teardown method if needed
 	def tearDown(self):
-		pass
\ No newline at end of file
+		pass
+
+
+class ByDTestCase(TestCase):
+	'''
+		Base test case for the ByD client, with the requests to ByD mocked and a fresh response cache and counters.
+	'''
+
+	def setUp(self):
+		self.main_model = RESTServices()
+		for attribute, value in (('response_cache', ResponseCache('local')),
+		                         ('metrics', {'requests': 0, 'errors': 0, 'retries': 0, 'elapsed': 0.0})):
+			patcher = mock.patch.object(RESTServices, attribute, value)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	@staticmethod
+	def response(data=None, status_code=200):
+		return mock.Mock(status_code=status_code, text=json.dumps({'d': data}), url='https://byd/url')
+
+
+class SharedSessionTest(ByDTestCase):
+
+	def test_the_session_is_shared_within_a_process(self):
+		with mock.patch.multiple(RESTServices, session=None, session_pid=None):
+			session = RESTServices().get_session()
+			self.assertIs(self.main_model.get_session(), session)
+			adapter = session.get_adapter('https://')
+			self.assertEqual((adapter._pool_maxsize, adapter.max_retries.total),
+			                 (RESTServices.pool_size, RESTServices.max_retries))
+			# A forked process gets its own session
+			with mock.patch('byd_service.rest.os.getpid', return_value=-1):
+				self.assertIsNot(self.main_model.get_session(), session)
+
+	def test_requests_are_counted(self):
+		session = mock.Mock()
+		session.get.return_value = mock.Mock(status_code=200, raw=mock.Mock(retries=mock.Mock(history=[1, 2])))
+		with mock.patch.object(RESTServices, 'get_session', return_value=session):
+			self.main_model.get('https://byd/url')
+			session.get.side_effect = ConnectionError
+			with self.assertRaises(ConnectionError):
+				self.main_model.get('https://byd/url')
+		metrics = RESTServices.pool_metrics()
+		self.assertEqual((metrics['requests'], metrics['errors'], metrics['retries']), (2, 1, 2))
+		self.assertEqual(session.get.call_args.kwargs['timeout'], RESTServices.timeout)
+
+
+class ResponseCacheTest(ByDTestCase):
+
+	def setUp(self):
+		super().setUp()
+		vendor = {'BusinessPartner': {'LifeCycleStatusCode': '2', 'InternalID': 'V1'}}
+		patcher = mock.patch.object(RESTServices, 'get', return_value=self.response({'results': [vendor]}))
+		self.get = patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_calls_with_the_same_arguments_share_a_response(self):
+		vendor = self.main_model.get_vendor_by_id('vendor@example.com')
+		vendor['BusinessPartner']['InternalID'] = 'Modified'
+		self.assertEqual(self.main_model.get_vendor_by_id('vendor@example.com', id_type='email')['BusinessPartner']['InternalID'], 'V1')
+		self.assertEqual(RESTServices().get_vendor_by_id(vendor_id='vendor@example.com')['BusinessPartner']['InternalID'], 'V1')
+		self.get.assert_called_once()
+		self.main_model.get_vendor_by_id('vendor@example.com', 'phone')
+		self.assertEqual(self.get.call_count, 2)
+
+	def test_the_cache_can_be_bypassed(self):
+		self.main_model.get_vendor_by_id('vendor@example.com')
+		self.main_model.get_vendor_by_id('vendor@example.com', use_cache=False)
+		self.main_model.get_vendor_by_id('vendor@example.com')
+		self.assertEqual(self.get.call_count, 2)
+
+	def test_failed_lookups_are_not_cached(self):
+		self.get.return_value = self.response(status_code=404)
+		self.assertFalse(self.main_model.get_vendor_by_id('vendor@example.com'))
+		self.assertFalse(self.main_model.get_vendor_by_id('vendor@example.com'))
+		self.assertEqual(self.get.call_count, 2)
+
+	def test_the_least_recently_used_responses_are_evicted(self):
+		response_cache = ResponseCache('local', max_entries=2)
+		for key in ('a', 'b'):
+			response_cache.set(key, {'key': key}, 60)
+		response_cache.get('a')
+		response_cache.set('c', {'key': 'c'}, 60)
+		self.assertEqual([response_cache.get(key)[0] for key in ('a', 'b', 'c')], [True, False, True])
+		response_cache.set('d', {'key': 'd'}, 0)
+		self.assertEqual(response_cache.get('d'), (False, None))
+
+
+class CollectionPagingTest(ByDTestCase):
+
+	def setUp(self):
+		super().setUp()
+		patcher = mock.patch.object(RESTServices, 'get')
+		self.get = patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_pages_are_requested_until_a_short_page(self):
+		self.get.side_effect = [self.response({'results': [1, 2]}), self.response({'results': [3]})]
+		self.assertEqual(list(self.main_model.iter_collection('https://byd/collection?$format=json', page_size=2)), [1, 2, 3])
+		self.assertEqual([call.args[0] for call in self.get.call_args_list], [
+			'https://byd/collection?$format=json&$top=2&$skip=0', 'https://byd/collection?$format=json&$top=2&$skip=2',
+		])
+
+	def test_the_next_links_are_followed(self):
+		self.get.side_effect = [self.response({'results': [1, 2], '__next': 'https://byd/next'}), self.response({'results': []})]
+		self.assertEqual(list(self.main_model.iter_collection('https://byd/collection?$format=json', page_size=2)), [1, 2])
+		self.assertEqual(self.get.call_args.args[0], 'https://byd/next')
+
+	def test_vendor_purchase_orders_are_stripped(self):
+		self.get.return_value = self.response({'results': [{'ID': '1001', 'Supplier': {}, 'Notes': '', 'Item': []}]})
+		self.assertEqual(self.main_model.get_vendor_purchase_orders('V1'), [{'ID': '1001', 'Item': []}])
+		self.assertIn("Supplier/PartyID eq 'V1'", self.get.call_args.args[0])
+
+	def test_a_failed_page_fails_the_lookup(self):
+		self.get.side_effect = [self.response({'results': [1] * RESTServices.page_size}), self.response(status_code=500)]
+		self.assertIs(self.main_model.get_vendor_purchase_orders('V1'), False)
+
+
+class PurchaseOrderBatchTest(ByDTestCase):
+
+	def test_each_purchase_order_is_fetched_once_and_failures_are_reported_per_id(self):
+		def get_purchase_order_by_id(purchase_order_id):
+			if purchase_order_id == 1003:
+				raise ConnectionError('Connection refused')
+			return {'ID': str(purchase_order_id)} if purchase_order_id == 1001 else False
+
+		with mock.patch.object(self.main_model, 'get_purchase_order_by_id', side_effect=get_purchase_order_by_id) as fetch:
+			results, errors = self.main_model.get_purchase_orders_by_id([1001, 1002, 1001, 1003])
+		self.assertEqual(results, {1001: {'ID': '1001'}, 1002: False})
+		self.assertEqual(errors, {1003: 'Connection refused'})
+		self.assertEqual(sorted(call.args[0] for call in fetch.call_args_list), [1001, 1002, 1003])
+
+	def test_an_empty_batch_sends_no_request(self):
+		with mock.patch.object(RESTServices, 'get') as get:
+			self.assertEqual(self.main_model.get_purchase_orders_by_id([]), ({}, {}))
+		get.assert_not_called()
+
+
+class AsyncClientTest(ByDTestCase):
+
+	def setUp(self):
+		super().setUp()
+		self.async_model = AsyncRESTServices()
+		patcher = mock.patch.object(AsyncRESTServices, 'get', new_callable=mock.AsyncMock)
+		self.get = patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_the_remaining_pages_are_requested_concurrently_and_yielded_in_order(self):
+		pages = {0: ([1, 2], 5), 2: ([3, 4], None), 4: ([5], None)}
+
+		async def get(url):
+			results, count = pages[int(url.split('$skip=')[1].split('&')[0])]
+			# Later pages respond first
+			await asyncio.sleep(0.01 * len(results))
+			return self.response({'results': results, **({'__count': str(count)} if count else {})})
+
+		self.get.side_effect = get
+
+		async def collect():
+			return [result async for result in self.async_model.iter_collection('https://byd/collection?$format=json', page_size=2)]
+
+		self.assertEqual(asyncio.run(collect()), [1, 2, 3, 4, 5])
+		self.assertIn('$inlinecount=allpages', self.get.call_args_list[0].args[0])
+		self.assertEqual(self.get.await_count, 3)
+
+	def test_concurrent_lookups_share_a_request(self):
+		async def get(url):
+			await asyncio.sleep(0.01)
+			return self.response({'results': [{'ID': '1001'}]})
+
+		self.get.side_effect = get
+
+		async def lookup():
+			return await asyncio.gather(*[self.async_model.get_purchase_order_by_id('1001') for _ in range(3)])
+
+		self.assertEqual(asyncio.run(lookup()), [{'ID': '1001'}] * 3)
+		self.assertEqual(self.get.await_count, 1)
+
+	def test_batch_failures_are_reported_per_id(self):
+		async def get(url):
+			if "'1002'" in url:
+				raise ConnectionError('Connection refused')
+			return self.response({'results': [{'ID': '1001'}]})
+
+		self.get.side_effect = get
+		results, errors = asyncio.run(self.async_model.get_purchase_orders_by_id(['1001', '1002']))
+		self.assertEqual((results, errors), ({'1001': {'ID': '1001'}}, {'1002': 'Connection refused'}))
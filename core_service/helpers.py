@@ -1,5 +1,9 @@
 # Miscellaneous methods to be used throughout the app
 import os
+import asyncio
+import threading
+import weakref
+from contextlib import asynccontextmanager
 
 
 # Convert base64 string to image and save to given path
@@ -19,3 +23,91 @@ def base64_to_image(base64_string, path, name):
 		return fullpath
 	except Exception as e:
 		raise Exception(f"Error decoding base64 string or identifying image: {e}")
+
+
+class SingleFlight:
+	'''
+		Collapses concurrent calls for the same key into a single call: the first caller runs the function and every
+		caller that arrives while it is running waits for, and receives, its result (or exception).
+	'''
+	class Call:
+		def __init__(self):
+			self.done = threading.Event()
+			self.result = None
+			self.error = None
+	
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.calls = {}
+	
+	def do(self, key, function, *args, **kwargs):
+		with self.lock:
+			call = self.calls.get(key)
+			leader = call is None
+			if leader:
+				call = self.calls[key] = self.Call()
+		# Wait for the caller that is already running the function for this key
+		if not leader:
+			call.done.wait()
+			if call.error:
+				raise call.error
+			return call.result
+		try:
+			call.result = function(*args, **kwargs)
+		except Exception as e:
+			call.error = e
+			raise e
+		finally:
+			with self.lock:
+				del self.calls[key]
+			call.done.set()
+		return call.result
+
+
+# The shared httpx.AsyncClient instances of each event loop, see get_async_client()
+async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client(name, **options):
+	'''
+		Returns the httpx.AsyncClient shared by the async integration with the given name on the running event loop,
+		creating it with the given options on first use, so that the integration reuses the client's connection pool.
+		Clients can not be shared between event loops, so every loop gets its own, see async_client_scope().
+	'''
+	import httpx
+	clients = async_clients.setdefault(asyncio.get_running_loop(), {})
+	client = clients.get(name)
+	if client is None or client.is_closed:
+		client = clients[name] = httpx.AsyncClient(**options)
+	return client
+
+
+async def close_async_clients():
+	'''
+		Closes (and forgets) the clients of the running event loop.
+	'''
+	for client in async_clients.pop(asyncio.get_running_loop(), {}).values():
+		await client.aclose()
+
+
+def is_asgi_request(request):
+	'''
+		Returns whether the request is being served under ASGI, i.e. on the server's event loop.
+	'''
+	from django.core.handlers.asgi import ASGIRequest
+	return isinstance(request, ASGIRequest)
+
+
+@asynccontextmanager
+async def async_client_scope(request):
+	'''
+		Scopes the clients of the running event loop to the handling of a request. Under ASGI the server's event loop
+		outlives the request, so its clients are kept and the following requests reuse their connections. Under WSGI
+		every async view (and async streaming response) runs on an event loop created for the call, so the clients are
+		closed at the end of the block instead of being left open until the loop is garbage collected.
+	'''
+	try:
+		yield
+	finally:
+		if not is_asgi_request(request):
+			await close_async_clients()
@@ -1,4 +1,5 @@
 import os, sys
+import logging
 from pprint import pprint
 import requests
 from bs4 import BeautifulSoup
@@ -68,4 +69,71 @@ def send_sms(number_list, sender_name, message):
 
 	session.close()
 	
-	return False
\ No newline at end of file
+	return False
+
+
+async def send_sms_async(number_list, sender_name, message):
+	'''
+		Async variant of send_sms. The SMS portal is driven through a login, so every call gets its own client (and
+		cookies) rather than a shared one.
+	'''
+	import httpx
+	host = os.getenv("SMS_HOST")
+	url = f'https://{host}/'
+	username = os.getenv("SMS_USERNAME")
+	password = os.getenv("SMS_PASSWORD")
+
+	headers = {
+		"Host": host,
+		"Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
+		"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
+	}
+
+	async with httpx.AsyncClient(headers=headers) as session:
+		get_cookies = await session.get(url)
+		response = await session.get(url)
+
+		if response.status_code != 200:
+			logging.error(f"Failed to open the SMS portal: {response.status_code}")
+			return False
+
+		token = BeautifulSoup(response.text, 'html.parser').find(attrs={"name": "captcha"})
+		token = token["value"]
+
+		login_data = {
+			"username": username,
+			"password": password,
+			"captcha": token
+		}
+
+		session.cookies = (await session.post(url, data=login_data, follow_redirects=False)).cookies
+
+		sms_page = await session.get(f"{url}bulksms/")
+
+		token = BeautifulSoup(sms_page.text, 'html.parser').find(attrs={"name": "browser_reload"})
+		token = token["value"]
+
+		sms_form_data = {
+			'autofocus': '#mobiles',
+			'action': '',
+			'schedule': '',
+			'browser_reload': token,
+			'mobile-list': 'mobile-text',
+			'mobiles': "\r\n".join(number_list),
+			'sender': sender_name,
+			'message': message,
+			'date': '',
+			'time': '',
+			'send-btn': '@',
+		}
+
+		sms_form_data = {key: (None, str(value)) for key, value in sms_form_data.items()}
+
+		do_send = await session.post(f"{url}bulksms/", files=sms_form_data)
+
+		if do_send.status_code == 200:
+			logging.info(f"SMS sent to {', '.join(number_list)}")
+			return True
+		logging.error(f"Error sending SMS: {do_send.status_code}")
+
+	return False
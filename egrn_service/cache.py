@@ -0,0 +1,258 @@
+import os
+import time
+import threading
+from abc import ABC, abstractmethod
+from copy import deepcopy
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max
+from django.forms.models import model_to_dict
+from core_service.helpers import SingleFlight
+
+
+class StoreDirectory:
+	'''
+		In-process cache of Store records, keyed by byd_cost_center_code and icg_warehouse_code.
+		Entries expire after STORE_CACHE_TTL seconds and are invalidated whenever a Store is saved or deleted. Lookups
+		that find no store are cached too (as None), so that unknown keys do not query the database on every lookup.
+	'''
+	ttl = int(os.getenv('STORE_CACHE_TTL', 300))
+	keys = ('byd_cost_center_code', 'icg_warehouse_code')
+	
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.entries = {}
+		self.middleware_fetches = SingleFlight()
+	
+	def _get_cached(self, key, value):
+		# Returns whether the key is cached and the cached store (None for a cached miss)
+		with self.lock:
+			entry = self.entries.get((key, value))
+			if entry and entry[1] > time.monotonic():
+				return True, entry[0]
+		return False, None
+	
+	def _set(self, cache_keys, store):
+		# Cache the store once the current transaction (if any) commits, so that the directory, which every thread
+		# reads, never holds a row that may still be rolled back
+		def set_entries():
+			expires_at = time.monotonic() + self.ttl
+			with self.lock:
+				for cache_key in cache_keys:
+					self.entries[cache_key] = (store, expires_at)
+		transaction.on_commit(set_entries)
+	
+	def _set_missing(self, cache_keys):
+		# Cache a lookup that found no store, unless the store has been cached since (e.g. by the transaction that
+		# created it committing while the lookup was running)
+		expires_at = time.monotonic() + self.ttl
+		with self.lock:
+			for cache_key in cache_keys:
+				entry = self.entries.get(cache_key)
+				if not (entry and entry[0] is not None and entry[1] > time.monotonic()):
+					self.entries[cache_key] = (None, expires_at)
+	
+	def add(self, store):
+		'''
+			Adds a store to the directory under all its keys.
+		'''
+		self._set([(key, getattr(store, key)) for key in self.keys], store)
+		return store
+	
+	def invalidate(self, store=None):
+		'''
+			Removes the given store (or every store, if none is given) from the directory, along with the cached misses.
+		'''
+		with self.lock:
+			if store is None:
+				self.entries.clear()
+				return
+			store_keys = [(key, getattr(store, key)) for key in self.keys]
+			for cache_key, (cached_store, _) in list(self.entries.items()):
+				if cached_store is None or cached_store.pk == store.pk or cache_key in store_keys:
+					del self.entries[cache_key]
+			self.entries.pop(('default', None), None)
+	
+	def preload(self, key, values):
+		'''
+			Loads the stores matching the given values of the key (e.g. byd_cost_center_code) that are not already
+			cached, in a single query.
+		'''
+		from .models import Store
+		missing = {value for value in values if value and not self._get_cached(key, value)[0]}
+		if missing:
+			for store in Store.objects.filter(**{f'{key}__in': missing}):
+				self.add(store)
+				missing.discard(getattr(store, key))
+			self._set_missing([(key, value) for value in missing])
+	
+	def get(self, key, value):
+		'''
+			Returns the store with the given value of the key (e.g. byd_cost_center_code) or None if it does not exist.
+		'''
+		from .models import Store
+		cached, store = self._get_cached(key, value)
+		if not cached:
+			store = Store.objects.filter(**{key: value}).first()
+			self.add(store) if store else self._set_missing([(key, value)])
+		return store
+	
+	def get_default_store(self):
+		'''
+			Returns the default store record, which is always the first record in the database.
+		'''
+		from .models import Store
+		store = self._get_cached('default', None)[1]
+		if store is None:
+			store = Store.objects.first()
+			if store:
+				self._set([('default', None)], store)
+		return store
+	
+	def resolve(self, byd_cost_center_code):
+		'''
+			Returns the store with the given ByD cost center code. If it is not known locally, the store is fetched
+			from the middleware (once, no matter how many lookups miss on the same code at the same time) and created,
+			falling back to the default store if the middleware does not know it either.
+		'''
+		store = self.get('byd_cost_center_code', byd_cost_center_code)
+		if store is None:
+			if self._get_cached('middleware', byd_cost_center_code)[0]:
+				# The middleware did not know the store either when it was last asked
+				return self.get_default_store()
+			# Only the middleware request is shared between the lookups: every lookup creates (or reads) the store in its
+			# own transaction, so that none is handed a row that another lookup's transaction may still roll back
+			store_data = self.middleware_fetches.do(byd_cost_center_code, self._fetch_store, byd_cost_center_code)
+			store = self._create_store(byd_cost_center_code, store_data)
+		return store
+	
+	def _fetch_store(self, byd_cost_center_code):
+		from .services import Middleware
+		middleware = Middleware()
+		return middleware.get_store(byd_cost_center_code=byd_cost_center_code)
+	
+	def _create_store(self, byd_cost_center_code, store_data):
+		from .models import Store
+		# If the store is not found, create a new store or use the default store
+		if not store_data:
+			self._set_missing([('middleware', byd_cost_center_code)])
+			return self.get_default_store()
+		try:
+			with transaction.atomic():
+				store = Store().create_store(store_data[0])
+		except IntegrityError:
+			# Another lookup created the store (and committed it) first
+			store = Store.objects.filter(byd_cost_center_code=byd_cost_center_code).first()
+			if store is None:
+				raise
+		return self.add(store)
+
+
+
+class VersionedIndex(ABC):
+	'''
+		Base class for in-memory indexes of small, rarely changing tables. The index is versioned by a cheap aggregate
+		of its source tables (see get_version), which every process checks at most every INDEX_VERSION_CHECK_INTERVAL
+		seconds: a change made by any process (e.g. in the admin) is picked up by the others within that interval, and
+		immediately by the process that made it (see invalidate).
+	'''
+	check_interval = float(os.getenv('INDEX_VERSION_CHECK_INTERVAL', 30))
+	
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.index = None
+		self.version = None
+		self.checked_at = 0
+	
+	@abstractmethod
+	def build(self):
+		'''
+			Builds and returns the index.
+		'''
+	
+	@abstractmethod
+	def get_version(self):
+		'''
+			Returns a value that changes whenever the indexed tables change, computed in the database, e.g. the row count
+			and latest modification time of the tables.
+		'''
+	
+	def get_index(self):
+		with self.lock:
+			if self.index is None or time.monotonic() - self.checked_at >= self.check_interval:
+				version = self.get_version()
+				if self.index is None or self.version != version:
+					self.index, self.version = self.build(), version
+				self.checked_at = time.monotonic()
+			return self.index
+	
+	def invalidate(self):
+		'''
+			Discards the index of this process, so that it is rebuilt on the next lookup.
+		'''
+		with self.lock:
+			self.index = None
+
+
+class SurchargeIndex(VersionedIndex):
+	'''
+		In-memory index of the Surcharge table by rate.
+	'''
+	def get_version(self):
+		from .models import Surcharge
+		return tuple(Surcharge.objects.aggregate(count=Count('id'), last_id=Max('id'), last_modified=Max('last_modified')).values())
+	
+	def build(self):
+		from .models import Surcharge
+		rates = {}
+		for surcharge in Surcharge.objects.all():
+			rates.setdefault(float(surcharge.rate), []).append(model_to_dict(surcharge))
+		return rates
+	
+	def get(self, rate):
+		'''
+			Returns the surcharges (as dicts) with the given rate.
+		'''
+		return deepcopy(self.get_index().get(float(rate), []))
+	
+	@staticmethod
+	def total_rate(tax_rates):
+		'''
+			Returns the total percentage of the given tax rates (as stored on PurchaseOrderLineItem.tax_rates).
+		'''
+		return sum([rate['rate'] for rate in tax_rates])
+
+
+class ProductConversionIndex(VersionedIndex):
+	'''
+		In-memory map of product IDs to the conversion configured for them in ProductConfiguration.
+	'''
+	def get_version(self):
+		from .models import Conversion, ProductConfiguration
+		return tuple(
+			value for model in (Conversion, ProductConfiguration)
+			for value in model.objects.aggregate(
+				count=Count('id'), last_id=Max('id'), last_modified=Max('last_modified')
+			).values()
+		)
+	
+	def build(self):
+		from .models import ProductConfiguration
+		configurations = ProductConfiguration.objects.select_related('conversion').filter(conversion__isnull=False)
+		return {
+			configuration.product_id: {
+				"conversion_method": configuration.conversion.conversion_method,
+				"conversion_field": configuration.conversion.conversion_field,
+			} for configuration in configurations
+		}
+	
+	def get(self, product_id):
+		'''
+			Returns the conversion method name and conversion fields configured for the product, or None.
+		'''
+		return self.get_index().get(product_id)
+
+
+# The process-wide store directory and indexes
+store_directory = StoreDirectory()
+surcharge_index = SurchargeIndex()
+product_conversions = ProductConversionIndex()
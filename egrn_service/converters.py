@@ -4,36 +4,90 @@
 	TODO: Document the rules.
 	
 	1. Always return "quantity_received"
+	2. Register the function with the @register decorator, declaring the input fields it expects. A Conversion's
+	   conversion_field uses the same schema.
 '''
+from django.core.exceptions import ValidationError
 
+# The registered conversion functions, by name
+registry = {}
 
+
+def register(input_schema):
+	'''
+		Registers a conversion function along with the schema of the input fields it expects.
+	'''
+	def decorator(function):
+		function.input_schema = input_schema
+		registry[function.__name__] = function
+		return function
+	return decorator
+
+
+def get_converter(name):
+	'''
+		Returns the registered conversion function with the given name, or None.
+	'''
+	return registry.get(name)
+
+
+def validate_inputs(input_fields, schema):
+	'''
+		Validates the input fields of a conversion against a conversion_field schema, raises a ValidationError
+		listing every invalid field.
+	'''
+	input_fields = input_fields or {}
+	errors = []
+	for field in schema or []:
+		name = field.get('name')
+		properties = field.get('properties', {})
+		value = input_fields.get(name)
+		if value is None or value == '':
+			errors.append(f"'{name}' is required.") if properties.get('required') else None
+			continue
+		if field.get('type') == 'number':
+			try:
+				value = float(value)
+			except (TypeError, ValueError):
+				errors.append(f"'{name}' must be a number.")
+				continue
+			if properties.get('min') is not None and value < float(properties['min']):
+				errors.append(f"'{name}' must be greater than or equal to {properties['min']}.")
+		elif field.get('type') == 'select':
+			options = [str(option.get('value')) for option in properties.get('options', [])]
+			if options and str(value) not in options:
+				errors.append(f"'{name}' must be one of {', '.join(options)}.")
+	if errors:
+		raise ValidationError(errors)
+	return True
+
+
+@register(input_schema=[
+	{
+		"name": "packets_per_bag",
+		"type": "number",
+		"properties": {
+			"placeholder": "The number of packets in a bag.",
+			"min": 1,
+			"required": True
+		}
+	},
+	{
+		"name": "number_of_bags",
+		"type": "number",
+		"properties": {
+			"placeholder": "The number bags supplied.",
+			"min": 1,
+			"required": True
+		}
+	},
+])
 def chicken_conversion(*args, **kwargs):
 	"""
 		Converts KG chicken to pieces.
 		Inputs:
 			- packets_per_bag
 			- number_of_bags
-			
-		[
-		  {
-		    "name": "packets_per_bag",
-		    "type": "number",
-		    "properties": {
-		      "placeholder": "The number of packets in a bag.",
-		      "min": 1,
-		      "required": true
-		    }
-		  },
-		  {
-		    "name": "number_of_bags",
-		    "type": "number",
-		    "properties": {
-		      "placeholder": "The number bags supplied.",
-		      "min": 1,
-		      "required": true
-		    }
-		  },
-		]
 	"""
 	inputs = kwargs.get('input_fields')
 	
@@ -55,6 +109,35 @@ def chicken_conversion(*args, **kwargs):
 	}
 
 
+@register(input_schema=[
+	{
+		"name": "number_of_bags",
+		"type": "number",
+		"properties": {
+			"placeholder": "The number bags supplied.",
+			"min": 1,
+			"required": True
+		}
+	},
+	{
+		"name": "packets_per_bag",
+		"type": "number",
+		"properties": {
+			"placeholder": "The number of packets in a bag.",
+			"min": 1,
+			"required": True
+		}
+	},
+	{
+		"name": "pieces_per_packet",
+		"type": "number",
+		"properties": {
+			"placeholder": "The number of pieces in a packet.",
+			"min": 1,
+			"required": True
+		}
+	}
+])
 def cut9_conversion(*args, **kwargs):
 	"""
 		Number of bags x No of Packets per bag x Pieces per packet
@@ -62,36 +145,6 @@ def cut9_conversion(*args, **kwargs):
 			- number_of_bags
 			- packets_per_bag
 			- pieces_per_packet
-			
-		[
-		  {
-		    "name": "number_of_bags",
-		    "type": "number",
-		    "properties": {
-		      "placeholder": "The number bags supplied.",
-		      "min": 1,
-		      "required": true
-		    }
-		  },
-		  {
-		    "name": "packets_per_bag",
-		    "type": "number",
-		    "properties": {
-		      "placeholder": "The number of packets in a bag.",
-		      "min": 1,
-		      "required": true
-		    }
-		  },
-		  {
-            "name": "pieces_per_packet",
-            "type": "number",
-            "properties": {
-              "placeholder": "The number of pieces in a packet.",,
-		      "min": 1,
-		      "required": true
-            }
-          }
-		]
 	"""
 	inputs = kwargs.get('input_fields')
 	
@@ -104,6 +157,39 @@ def cut9_conversion(*args, **kwargs):
 	}
 
 
+@register(input_schema=[
+	{
+		"name": "number_of_packs_received",
+		"type": "number",
+		"properties": {
+			"placeholder": "The total number of packs received.",
+			"min": 1,
+			"required": True
+		}
+	},
+	{
+		"name": "number_per_pack",
+		"type": "number",
+		"properties": {
+			"placeholder": "The number products in a complete pack.",
+			"min": 1,
+			"required": True
+		}
+	},
+	{
+		"name": "product_volume",
+		"type": "select",
+		"properties": {
+			"placeholder": "The volume of this product, as stated on the product's container.",
+			"required": True,
+			"options": [
+				{"name": "35cl", "value": "35"},
+				{"name": "50cl", "value": "50"},
+				{"name": "1L", "value": "100"},
+			]
+		}
+	}
+])
 def nbc_products_volume_conversion(*args, **kwargs):
 	'''
 		Volume of NBC product received e.g 35cl, 50CL, 1Litre.
@@ -112,38 +198,6 @@ def nbc_products_volume_conversion(*args, **kwargs):
 		Upon inputting these required details, The system should do the following :
 			Calculate the extended volume received. This is realized with the formular:
 				Volume of Product received × Number in a pack × Number of packs received
-		
-		[
-			{
-				"name":"number_of_packs_received",
-				"type":"number",
-				"properties":{
-					"placeholder":"The total number of packs received.",
-					"min":1,
-					"required":true
-				}
-			},
-			{
-				"name":"number_per_pack",
-				"type":"number",
-				"properties":{
-				"placeholder":"The number products in a complete pack.",
-				"min":1,
-				"required":true
-			}},
-			{
-				"name":"product_volume",
-				"type":"select",
-				"properties":{
-					"placeholder":"The volume of this product, as stated on the product's container.",
-					"required":true,
-					"options":[
-						{"name":"35cl","value":"35"},
-						{"name":"50cl","value":"50"},
-						{"name":"1L","value":"100"},
-					]
-			}}
-		]
 	'''
 	inputs = kwargs.get('input_fields')
 	
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from egrn_service.models import PurchaseOrderLineItem
+
+
+class Command(BaseCommand):
+	help = 'Rebuilds the stored delivered quantity and delivery status of purchase order line items from the GRN tables.'
+	
+	def add_arguments(self, parser):
+		parser.add_argument('--po_id', nargs='+', type=int, help='Only rebuild the line items of these purchase orders.')
+	
+	def handle(self, *args, **options):
+		line_items = PurchaseOrderLineItem.objects.all()
+		# Restrict the rebuild to the given purchase orders, if any
+		if options.get('po_id'):
+			line_items = line_items.filter(purchase_order__po_id__in=options['po_id'])
+		updated = PurchaseOrderLineItem.rebuild_delivery_status(line_items)
+		self.stdout.write(self.style.SUCCESS(f'Rebuilt the delivery status of {updated} purchase order line item(s).'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from egrn_service.models import WeightedAverageCost
+
+
+class Command(BaseCommand):
+	help = 'Rebuilds the weighted average cost ledger of products by revaluing their GRN line items.'
+	
+	def add_arguments(self, parser):
+		parser.add_argument('--product_id', nargs='+', type=str, help='Only rebuild the ledgers of these products.')
+		parser.add_argument('--chunk_size', type=int, default=500, help='Number of products revalued (and written) at a time.')
+		parser.add_argument('--workers', type=int, help='Number of worker processes used to revalue a chunk of products.')
+	
+	def handle(self, *args, **options):
+		rebuilt = WeightedAverageCost.rebuild(
+			options.get('product_id'), chunk_size=options['chunk_size'], workers=options.get('workers')
+		)
+		self.stdout.write(self.style.SUCCESS(f'Rebuilt the weighted average cost ledger of {rebuilt} product(s).'))
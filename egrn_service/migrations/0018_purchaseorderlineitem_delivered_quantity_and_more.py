@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-18 02:29
+
+from django.db import migrations, models
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+def backfill_delivery_status(apps, schema_editor):
+    PurchaseOrderLineItem = apps.get_model('egrn_service', 'PurchaseOrderLineItem')
+    GoodsReceivedLineItem = apps.get_model('egrn_service', 'GoodsReceivedLineItem')
+    received = GoodsReceivedLineItem.objects.filter(purchase_order_line_item=OuterRef('pk')).order_by()
+    received = received.values('purchase_order_line_item').annotate(total_received=Sum('quantity_received'))
+    PurchaseOrderLineItem.objects.update(delivered_quantity=Coalesce(
+        Subquery(received.values('total_received')[:1]), Value(0),
+        output_field=DecimalField(max_digits=15, decimal_places=3)
+    ))
+    PurchaseOrderLineItem.objects.update(delivery_status_code=Case(
+        When(delivered_quantity__lte=0, then=Value('1')),
+        When(delivered_quantity__lt=F('quantity'), then=Value('2')),
+        default=Value('3'),
+        output_field=models.CharField(max_length=1)
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('egrn_service', '0017_alter_productconfiguration_conversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchaseorderlineitem',
+            name='delivered_quantity',
+            field=models.DecimalField(decimal_places=3, default=0.0, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='purchaseorderlineitem',
+            name='delivery_status_code',
+            field=models.CharField(choices=[('1', 'Not Delivered'), ('2', 'Partially Delivered'), ('3', 'Completely Delivered')], default='1', max_length=1),
+        ),
+        migrations.RunPython(backfill_delivery_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2 on 2026-10-18 02:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('egrn_service', '0018_purchaseorderlineitem_delivered_quantity_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GoodsReceivedNoteSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_value', models.PositiveIntegerField(default=0)),
+                ('purchase_order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='grn_sequence', to='egrn_service.purchaseorder')),
+            ],
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 4.2 on 2026-10-18 02:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+from decimal import Decimal
+
+
+def backfill_ledger(apps, schema_editor):
+    GoodsReceivedLineItem = apps.get_model('egrn_service', 'GoodsReceivedLineItem')
+    ProductConfiguration = apps.get_model('egrn_service', 'ProductConfiguration')
+    WeightedAverageCost = apps.get_model('egrn_service', 'WeightedAverageCost')
+    WeightedAverageCostEntry = apps.get_model('egrn_service', 'WeightedAverageCostEntry')
+    metadata = dict(ProductConfiguration.objects.values_list('product_id', 'metadata'))
+    # Replay the existing receipts per product, in the order they were received (as WeightedAverageCost.rebuild does)
+    rows = GoodsReceivedLineItem.objects.order_by(
+        'purchase_order_line_item__product_id', 'date_received', 'id'
+    ).values_list(
+        'id', 'purchase_order_line_item__product_id', 'purchase_order_line_item__product_name',
+        'purchase_order_line_item__delivery_store_id', 'date_received', 'quantity_received',
+        'purchase_order_line_item__unit_price'
+    )
+    ledger, entries = None, []
+    for line_item_id, product_id, product_name, store_id, date_received, quantity, unit_price in rows.iterator():
+        if ledger is None or ledger.product_id != product_id:
+            if ledger is not None:
+                ledger.save()
+            product_metadata = metadata.get(product_id) or {}
+            starting_quantity = Decimal(str(product_metadata.get('inital_quantity', 0)))
+            starting_cost = Decimal(str(product_metadata.get('initial_cost', 0))) * starting_quantity
+            ledger = WeightedAverageCost.objects.create(
+                product_id=product_id, product_name=product_name, starting_quantity=starting_quantity,
+                starting_cost=starting_cost / starting_quantity if starting_quantity > 0 else 0,
+                cumulative_quantity=starting_quantity, cumulative_cost=starting_cost,
+            )
+        purchase_cost = quantity * unit_price
+        ledger.cumulative_quantity += quantity
+        ledger.cumulative_cost += purchase_cost
+        ledger.wac = round(ledger.cumulative_cost / ledger.cumulative_quantity, 2) if ledger.cumulative_quantity else 0
+        entries.append(WeightedAverageCostEntry(
+            ledger=ledger, grn_line_item_id=line_item_id, store_id=store_id, date=date_received,
+            purchase_quantity=quantity, purchase_cost=purchase_cost, cumulative_quantity=ledger.cumulative_quantity,
+            cumulative_cost=ledger.cumulative_cost, wac=ledger.wac,
+        ))
+        if len(entries) >= 1000:
+            WeightedAverageCostEntry.objects.bulk_create(entries)
+            entries = []
+    if ledger is not None:
+        ledger.save()
+    WeightedAverageCostEntry.objects.bulk_create(entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('egrn_service', '0019_goodsreceivednotesequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeightedAverageCost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.CharField(max_length=32, unique=True)),
+                ('product_name', models.CharField(blank=True, max_length=100, null=True)),
+                ('starting_quantity', models.DecimalField(decimal_places=3, default=0, max_digits=20)),
+                ('starting_cost', models.DecimalField(decimal_places=3, default=0, max_digits=20)),
+                ('cumulative_quantity', models.DecimalField(decimal_places=3, default=0, max_digits=20)),
+                ('cumulative_cost', models.DecimalField(decimal_places=3, default=0, max_digits=20)),
+                ('wac', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WeightedAverageCostEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('purchase_quantity', models.DecimalField(decimal_places=3, max_digits=15)),
+                ('purchase_cost', models.DecimalField(decimal_places=3, max_digits=20)),
+                ('cumulative_quantity', models.DecimalField(decimal_places=3, max_digits=20)),
+                ('cumulative_cost', models.DecimalField(decimal_places=3, max_digits=20)),
+                ('wac', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('grn_line_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='wac_entry', to='egrn_service.goodsreceivedlineitem')),
+                ('ledger', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='history', to='egrn_service.weightedaveragecost')),
+                ('store', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='egrn_service.store')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='weightedaveragecostentry',
+            index=models.Index(fields=['ledger', 'date', 'grn_line_item'], name='egrn_servic_ledger__ccb74e_idx'),
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
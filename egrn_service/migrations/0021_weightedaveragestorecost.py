@@ -0,0 +1,80 @@
+# Generated by Django 4.2 on 2026-10-18 02:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_store_costs(apps, schema_editor):
+    WeightedAverageCostEntry = apps.get_model('egrn_service', 'WeightedAverageCostEntry')
+    WeightedAverageStoreCost = apps.get_model('egrn_service', 'WeightedAverageStoreCost')
+    # Replay the existing ledger entries per product and store
+    running, entries = {}, []
+    for entry in WeightedAverageCostEntry.objects.order_by('ledger_id', 'date', 'grn_line_item_id').iterator():
+        store_cost = running.setdefault(
+            (entry.ledger_id, entry.store_id),
+            WeightedAverageStoreCost(ledger_id=entry.ledger_id, store_id=entry.store_id)
+        )
+        store_cost.cumulative_quantity += entry.purchase_quantity
+        store_cost.cumulative_cost += entry.purchase_cost
+        store_cost.wac = round(store_cost.cumulative_cost / store_cost.cumulative_quantity, 2) if store_cost.cumulative_quantity else 0
+        entry.store_cumulative_quantity = store_cost.cumulative_quantity
+        entry.store_cumulative_cost = store_cost.cumulative_cost
+        entry.store_wac = store_cost.wac
+        entries.append(entry)
+    WeightedAverageCostEntry.objects.bulk_update(
+        entries, ['store_cumulative_quantity', 'store_cumulative_cost', 'store_wac'], batch_size=1000
+    )
+    WeightedAverageStoreCost.objects.bulk_create(running.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('egrn_service', '0020_weightedaveragecost'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeightedAverageStoreCost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cumulative_quantity', models.DecimalField(decimal_places=3, default=0, max_digits=20)),
+                ('cumulative_cost', models.DecimalField(decimal_places=3, default=0, max_digits=20)),
+                ('wac', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='weightedaveragecostentry',
+            name='store_cumulative_cost',
+            field=models.DecimalField(decimal_places=3, default=0, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='weightedaveragecostentry',
+            name='store_cumulative_quantity',
+            field=models.DecimalField(decimal_places=3, default=0, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='weightedaveragecostentry',
+            name='store_wac',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20),
+        ),
+        migrations.AddIndex(
+            model_name='weightedaveragecostentry',
+            index=models.Index(fields=['ledger', 'store', 'date', 'grn_line_item'], name='egrn_servic_ledger__8654b1_idx'),
+        ),
+        migrations.AddField(
+            model_name='weightedaveragestorecost',
+            name='ledger',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stores', to='egrn_service.weightedaveragecost'),
+        ),
+        migrations.AddField(
+            model_name='weightedaveragestorecost',
+            name='store',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='egrn_service.store'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='weightedaveragestorecost',
+            unique_together={('ledger', 'store')},
+        ),
+        migrations.RunPython(backfill_store_costs, migrations.RunPython.noop),
+    ]
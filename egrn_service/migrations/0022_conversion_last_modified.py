@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 03:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('egrn_service', '0021_weightedaveragestorecost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversion',
+            name='last_modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='productconfiguration',
+            name='last_modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -1,23 +1,25 @@
 import logging
-import inspect
-from . import converters
-from .services import Middleware
-from django.db import models
+from decimal import Decimal
+from . import converters, valuation
+from .cache import store_directory, surcharge_index, product_conversions
+from django.db import models, transaction
 from django.db.utils import IntegrityError
 from core_service.models import VendorProfile
 from byd_service.rest import RESTServices
 from byd_service.util import to_python_time
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from django.db.models import Sum
-from django.forms.models import model_to_dict
+from django.db.models import Sum, Count, Q, OuterRef, Subquery, Exists, DecimalField, Value, F, Case, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 from django_q.tasks import async_task
 
 # Initialize REST services
 byd_rest_services = RESTServices()
 
 def get_conversion_methods():
-	methods = inspect.getmembers(converters, inspect.isfunction)
-	return [(name, name) for name, func in methods]
+	return [(name, name) for name in converters.registry]
 
 
 # Create your models here.
@@ -33,6 +35,13 @@ class Surcharge(models.Model):
 		return f'{self.code} - {self.description}'
 
 
+@receiver(post_save, sender=Surcharge)
+@receiver(post_delete, sender=Surcharge)
+def invalidate_surcharge_index_hook(sender, instance, **kwargs):
+	# Discard the in-memory surcharge index so that it is rebuilt on the next lookup
+	surcharge_index.invalidate()
+
+
 class ProductSurcharge(models.Model):
 	'''
 		Associates a product with a surcharge.
@@ -84,6 +93,57 @@ class Store(models.Model):
 		return f"{self.store_name.upper()} | {self.icg_warehouse_name.upper()}"
 
 
+@receiver(post_save, sender=Store)
+@receiver(post_delete, sender=Store)
+def invalidate_store_directory_hook(sender, instance, **kwargs):
+	# Remove the store from the in-process store directory so that it is reloaded on the next lookup
+	store_directory.invalidate(instance)
+
+
+class PurchaseOrderQuerySet(models.QuerySet):
+	'''
+		Custom queryset for the PurchaseOrder model.
+	'''
+	
+	def with_delivery_status(self):
+		'''
+			Annotates each purchase order with its delivery status code (as "annotated_delivery_status"), computed from
+			the stored delivery status codes of its line items in a single SQL statement.
+		'''
+		codes = PurchaseOrder.delivery_status_code
+		return self.annotate(
+			line_items_count=Count('line_items', distinct=True),
+			line_items_delivered=Count('line_items', filter=Q(line_items__delivery_status_code=codes[2][0]), distinct=True),
+			line_items_started=Count('line_items', filter=~Q(line_items__delivery_status_code=codes[0][0]), distinct=True),
+		).annotate(
+			annotated_delivery_status=Case(
+				When(line_items_delivered=F('line_items_count'), then=Value(codes[2][0])),
+				When(line_items_started__gt=0, then=Value(codes[1][0])),
+				default=Value(codes[0][0]),
+				output_field=models.CharField(max_length=1)
+			)
+		)
+
+
+class PurchaseOrderLineItemQuerySet(models.QuerySet):
+	'''
+		Custom queryset for the PurchaseOrderLineItem model.
+	'''
+	
+	def with_extra_fields(self):
+		'''
+			Annotates each line item with the conversion fields of its product configuration (as
+			"annotated_extra_fields"), so that reading PurchaseOrderLineItem.extra_fields does not query the database.
+		'''
+		conversion_fields = ProductConfiguration.objects.filter(product_id=OuterRef('product_id'))
+		return self.annotate(
+			annotated_extra_fields=Subquery(
+				conversion_fields.values('conversion__conversion_field')[:1],
+				output_field=models.JSONField()
+			)
+		)
+
+
 class PurchaseOrder(models.Model):
 	vendor = models.ForeignKey(VendorProfile, on_delete=models.CASCADE)
 	object_id = models.CharField(max_length=32, blank=False, null=False, unique=True)
@@ -94,8 +154,15 @@ class PurchaseOrder(models.Model):
 	
 	delivery_status_code = [('1', 'Not Delivered'), ('2', 'Partially Delivered'), ('3', 'Completely Delivered')]
 	
+	objects = PurchaseOrderQuerySet.as_manager()
+	
 	@property
 	def delivery_status(self, ):
+		# Use the status annotated by PurchaseOrder.objects.with_delivery_status(), if available
+		annotated_status = getattr(self, 'annotated_delivery_status', None)
+		if annotated_status:
+			return annotated_status, dict(self.delivery_status_code).get(annotated_status)
+		
 		status = self.delivery_status_code[0]
 		# Retrieve all related PurchaseOrderLineItems
 		order_items = self.line_items.all()
@@ -110,6 +177,25 @@ class PurchaseOrder(models.Model):
 		return status
   
 	
+	@classmethod
+	def fetch_missing(cls, po_ids):
+		'''
+			Creates the given purchase orders that are not in the database yet from ByD, fetching them all in one batch,
+			and returns the ones created keyed by PO ID. A purchase order that can not be fetched or created is skipped.
+		'''
+		po_ids = {str(po_id) for po_id in po_ids if str(po_id).isdigit()}
+		missing = po_ids - {str(po_id) for po_id in cls.objects.filter(po_id__in=po_ids).values_list('po_id', flat=True)}
+		results, errors = byd_rest_services.get_purchase_orders_by_id(sorted(missing))
+		created = {}
+		for po_id, po_data in results.items():
+			if not po_data:
+				continue
+			try:
+				created[po_id] = cls().create_purchase_order(po_data)
+			except Exception as e:
+				logging.error(f"Error creating purchase order {po_id}: {e}")
+		return created
+	
 	def create_purchase_order(self, po):
 		# Get the vendor's profile (if they've completed their onboarding), or create a profile that will be attached
 		# to the vendor whenever they complete their onboarding.
@@ -127,6 +213,10 @@ class PurchaseOrder(models.Model):
 		po_items = po.pop("Item")
 		self.metadata = po
 		self.save()
+		# Load the delivery stores of all the line items into the store directory in one query
+		store_directory.preload('byd_cost_center_code', [
+			item.get('ItemShipToLocation', {}).get('LocationID') for item in po_items
+		])
 		
 		try:
 			for line_item in po_items:
@@ -166,32 +256,87 @@ class PurchaseOrderLineItem(models.Model):
 	tax_rates = models.JSONField(default=list)
 	unit_of_measurement = models.CharField(max_length=32, blank=False, null=False)
 	metadata = models.JSONField(default=dict)
+	# Materialized from the related GoodsReceivedLineItem rows, kept up to date by the GRN line item signals below.
+	delivered_quantity = models.DecimalField(max_digits=15, decimal_places=3, default=0.000)
+	delivery_status_code = models.CharField(max_length=1, choices=PurchaseOrder.delivery_status_code, default='1')
+	
+	objects = PurchaseOrderLineItemQuerySet.as_manager()
 	
 	@property
 	def delivery_status(self):
-		if self.delivered_quantity == 0:
-			return self.purchase_order.delivery_status_code[0]
-		elif (self.delivered_quantity > 0) and (self.delivered_quantity < self.quantity):
-			return self.purchase_order.delivery_status_code[1]
-		elif self.delivered_quantity == self.quantity:
-			return self.purchase_order.delivery_status_code[2]
+		status_text = dict(PurchaseOrder.delivery_status_code).get(self.delivery_status_code)
+		return (self.delivery_status_code, status_text)
 	
-	@property
-	def delivered_quantity(self, ):
-		# Access related GoodsReceivedLineItem instances and calculate total received quantity
-		delivered_quantity = self.grn_line_item.aggregate(total_received=Sum('quantity_received'))['total_received']
-		return delivered_quantity or 0.0000
+	@staticmethod
+	def get_delivery_status_code(delivered_quantity, quantity):
+		'''
+			Returns the delivery status code for the given delivered and ordered quantities.
+		'''
+		if not delivered_quantity or float(delivered_quantity) <= 0:
+			return PurchaseOrder.delivery_status_code[0][0]
+		elif float(delivered_quantity) < float(quantity):
+			return PurchaseOrder.delivery_status_code[1][0]
+		return PurchaseOrder.delivery_status_code[2][0]
+	
+	@classmethod
+	def delivered_quantity_subquery(cls):
+		'''
+			Subquery returning the total quantity received (across all GRNs) for the outer PurchaseOrderLineItem.
+		'''
+		received = GoodsReceivedLineItem.objects.filter(purchase_order_line_item=OuterRef('pk')).order_by()
+		received = received.values('purchase_order_line_item').annotate(total_received=Sum('quantity_received'))
+		return Coalesce(
+			Subquery(received.values('total_received')[:1]),
+			Value(0),
+			output_field=DecimalField(max_digits=15, decimal_places=3)
+		)
+	
+	@classmethod
+	def delivery_status_case(cls, delivered_quantity='delivered_quantity'):
+		'''
+			Conditional expression that maps the delivered quantity of a line item to its delivery status code.
+		'''
+		codes = PurchaseOrder.delivery_status_code
+		return Case(
+			When(**{f'{delivered_quantity}__lte': 0}, then=Value(codes[0][0])),
+			When(**{f'{delivered_quantity}__lt': F('quantity')}, then=Value(codes[1][0])),
+			default=Value(codes[2][0]),
+			output_field=models.CharField(max_length=1)
+		)
+	
+	@classmethod
+	def rebuild_delivery_status(cls, queryset=None):
+		'''
+			Rebuilds the materialized delivered quantity and delivery status code from the GRN tables in two UPDATE
+			statements. Returns the number of line items updated.
+		'''
+		queryset = cls.objects.all() if queryset is None else queryset
+		updated = queryset.update(delivered_quantity=cls.delivered_quantity_subquery())
+		queryset.update(delivery_status_code=cls.delivery_status_case())
+		return updated
+	
+	def refresh_delivery_status(self):
+		'''
+			Recalculates the delivered quantity and delivery status code from the GRN line items and stores them.
+			The row is updated directly so that the save() side effects (tax rates, delivery store lookup) are not re-run.
+		'''
+		delivered_quantity = self.grn_line_item.aggregate(total_received=Sum('quantity_received'))['total_received'] or 0
+		self.delivered_quantity = delivered_quantity
+		self.delivery_status_code = self.get_delivery_status_code(delivered_quantity, self.quantity)
+		PurchaseOrderLineItem.objects.filter(pk=self.pk).update(
+			delivered_quantity=self.delivered_quantity,
+			delivery_status_code=self.delivery_status_code
+		)
+		return self.delivery_status_code
 	
 	@property
 	def extra_fields(self, ):
+		# Use the conversion fields annotated by PurchaseOrderLineItem.objects.with_extra_fields(), if available
+		if hasattr(self, 'annotated_extra_fields'):
+			return self.annotated_extra_fields or []
 		# If the product ID is defined in the ProductConversion model, return the conversion fields
-		try:
-			product_conversion = ProductConfiguration.objects.get(product_id=self.metadata["ProductID"])
-			return product_conversion.conversion.conversion_field
-		except ObjectDoesNotExist:
-			return []
-		except AttributeError:
-			return []
+		conversion = product_conversions.get(self.metadata.get("ProductID"))
+		return conversion['conversion_field'] if conversion else []
 	
 	def __get_tax_rate__(self,):
 		# Calculate the gross amount and tax rate based on the metadata['NetAmount'] and metadata['TaxAmount'] keys.
@@ -207,22 +352,14 @@ class PurchaseOrderLineItem(models.Model):
 			Retrieve the delivery store details from the metadata['DeliveryStoreDetails'] key.
 		'''
 	
-		store = Store
 		delivery_store_id = self.metadata['ItemShipToLocation']['LocationID']
-		try:
-			delivery_store = store.objects.get(byd_cost_center_code=delivery_store_id)
-		except ObjectDoesNotExist:
-			middleware = Middleware()
-			store_data = middleware.get_store(byd_cost_center_code=delivery_store_id)
-			# If the store is not found, create a new store or use the default store
-			delivery_store = store().create_store(store_data[0]) if store_data else store().default_store
-		return delivery_store
+		# Resolve the store from the store directory (cache, then database, then the middleware service)
+		return store_directory.resolve(delivery_store_id)
 	
 	def save(self, ):
 		try:
-			# Get the surcharge with the tax rate
-			surcharge = Surcharge.objects.filter(rate=self.__get_tax_rate__())
-			self.tax_rates = [model_to_dict(i) for i in surcharge]
+			# Get the surcharges with the tax rate from the surcharge index
+			self.tax_rates = surcharge_index.get(self.__get_tax_rate__())
 			self.delivery_store = self.__get_delivery_store_details__()
 		except ObjectDoesNotExist:
 			# If the surcharge percent is not found, create a new surcharge with the tax rate
@@ -284,12 +421,16 @@ class GoodsReceivedNote(models.Model):
 	
 	def save(self, *args, **kwargs):
 		grn_data = kwargs.pop('grn_data')
+		# The purchase order, if it has already been looked up by the caller
+		purchase_order = kwargs.pop('purchase_order', None)
+		# Whether to enqueue the ICG and email tasks for this GRN (callers creating many GRNs enqueue them in batches)
+		enqueue_tasks = kwargs.pop('enqueue_tasks', True)
 		po_id = grn_data['po_id']
 		# Set the store where this GRN is being received
-		self.store = Store.objects.all()[0]
+		self.store = store_directory.get_default_store()
 		try:
 			# Try to retrieve an object by a specific field if the object is found, you can work with it here
-			self.purchase_order = PurchaseOrder.objects.get(po_id=po_id)
+			self.purchase_order = purchase_order or PurchaseOrder.objects.get(po_id=po_id)
 		except ObjectDoesNotExist:
 			# Create the Purchase Order
 			po_data = byd_rest_services.get_purchase_order_by_id(po_id)
@@ -298,59 +439,150 @@ class GoodsReceivedNote(models.Model):
 		except Exception as e:
 			raise e
 		
-		# Create the GRN Number by appending a number to the end of the PO ID
-		self.grn_number = int(str(po_id) + '1')
-		# Progressively increment the GRN number until it is unique
-		saved_as_grn = False # Boolean to control the loop
-		while not saved_as_grn:
-			try:
-				super().save(*args, **kwargs)
-				saved_as_grn = True
-			except IntegrityError:
-				self.grn_number = int(self.grn_number) + 1
-			except Exception as e:
-				logging.error(e)
-				raise e
-		# Delete the GRN if none of the line items were created (meaning there was an error with all the line items)
-		try:
+		# Allocate the GRN number, save the GRN and create its line items in one transaction, so that a failed receipt
+		# rolls back the GRN sequence as well and does not use up a GRN number
+		with transaction.atomic():
+			# Allocate the GRN Number (the PO ID with a sequence number appended to the end) from the PO's GRN sequence
+			saved_as_grn = False # Boolean to control the loop
+			while not saved_as_grn:
+				self.grn_number = GoodsReceivedNoteSequence.next_grn_number(self.purchase_order)
+				try:
+					with transaction.atomic():
+						super().save(*args, **kwargs)
+					saved_as_grn = True
+				except IntegrityError:
+					# The sequence has run into the GRN numbers of another purchase order, allocate the next number
+					logging.warning(f"GRN number {self.grn_number} is already in use, allocating the next number.")
+				except Exception as e:
+					logging.error(e)
+					raise e
 			self.__create_line_items__(grn_data.get("recievedGoods"))
-		except Exception as e:
-			self.delete()
-			raise e
 		# Perform asynchronous tasks after the GRN and it's corresponding line items have been created
-		async_task('vimp.tasks.post_to_icg', self, q_options={
-			'task_name': f'Post-GRN-{self.grn_number}-To-ICG-Inventory',
-		})
-		async_task('vimp.tasks.send_grn_to_email', self, q_options={
-			'task_name': f'Email-GRN-{self.grn_number}-To-Vendor',
-		})
+		if enqueue_tasks:
+			async_task('vimp.tasks.post_to_icg', self, q_options={
+				'task_name': f'Post-GRN-{self.grn_number}-To-ICG-Inventory',
+			})
+			async_task('vimp.tasks.send_grn_to_email', self, q_options={
+				'task_name': f'Email-GRN-{self.grn_number}-To-Vendor',
+			})
 		# Return the created Goods Received Note
 		return self
 	
 	def __create_line_items__(self, line_items):
-		# An object to hold the status of line items that were created
-		created_line_items = {}
-		for line_item in line_items:
-			try:
-				grn_line_item = GoodsReceivedLineItem()
-				# Get the purchase order line item that corresponds to this line item from the purchase order of this Goods Received Note
-				grn_line_item.purchase_order_line_item = PurchaseOrderLineItem.objects.get(purchase_order=self.purchase_order,
-																 object_id=line_item["itemObjectID"])
-				grn_line_item.grn = self
-				grn_line_item.quantity_received = round(float(line_item.get("quantityReceived") or 0),3)
-				grn_line_item.save(data=line_item)
-				created_line_items[line_item['itemObjectID']] = True
-			except Exception as e:
-				logging.error(f"{line_item['itemObjectID']}: {e}")
-				created_line_items[line_item['itemObjectID']] = False
-				raise e
+		'''
+			Creates the GRN line items in a single batch: the referenced PO line items and product configurations are
+			loaded up front, quantities are validated against one grouped aggregate and the line items are written with
+			bulk_create, all inside one transaction.
+		'''
+		with transaction.atomic():
+			object_ids = [line_item["itemObjectID"] for line_item in line_items]
+			# Load (and lock, to serialize concurrent receipts) the purchase order line items being received
+			po_line_items = {
+				item.object_id: item for item in PurchaseOrderLineItem.objects.select_for_update().filter(
+					purchase_order=self.purchase_order, object_id__in=object_ids
+				)
+			}
+			# The quantity already received for each of the purchase order line items
+			total_received = dict(
+				GoodsReceivedLineItem.objects.filter(purchase_order_line_item__in=po_line_items.values()).order_by()
+				.values('purchase_order_line_item').annotate(total_sum=Sum('quantity_received'))
+				.values_list('purchase_order_line_item', 'total_sum')
+			)
+			
+			grn_line_items = []
+			for line_item in line_items:
+				try:
+					# Get the purchase order line item that corresponds to this line item from the purchase order of this Goods Received Note
+					po_line_item = po_line_items.get(line_item["itemObjectID"])
+					if not po_line_item:
+						raise PurchaseOrderLineItem.DoesNotExist("PurchaseOrderLineItem matching query does not exist.")
+					grn_line_item = GoodsReceivedLineItem()
+					grn_line_item.purchase_order_line_item = po_line_item
+					grn_line_item.grn = self
+					grn_line_item.quantity_received = round(float(line_item.get("quantityReceived") or 0),3)
+					# Convert the product, if a conversion is configured for it
+					try:
+						grn_line_item.convert_product(data=line_item)
+					except ValidationError as e:
+						raise e
+					except Exception as e:
+						logging.error(f"Error converting product: {e}")
+					grn_line_item.set_received_values()
+					grn_line_item.clean(total_received=total_received.get(po_line_item.id, 0))
+					# Account for the same PO line item being received more than once in this GRN
+					total_received[po_line_item.id] = float(total_received.get(po_line_item.id) or 0) + float(grn_line_item.quantity_received)
+					grn_line_items.append(grn_line_item)
+				except Exception as e:
+					logging.error(f"{line_item['itemObjectID']}: {e}")
+					raise e
+			
+			GoodsReceivedLineItem.objects.bulk_create(grn_line_items)
+			# bulk_create does not send post_save signals, so refresh the delivery status of the received PO line items here
+			PurchaseOrderLineItem.rebuild_delivery_status(
+				PurchaseOrderLineItem.objects.filter(id__in=[item.purchase_order_line_item_id for item in grn_line_items])
+			)
+			# and post the receipts to the WAC ledger (read back, as bulk_create does not set primary keys on every backend)
+			WeightedAverageCost.record_receipts(self.line_items.select_related('purchase_order_line_item'))
 		# If any of the line items were created, return True.
-		return any(created_line_items.values())
+		return bool(grn_line_items)
 	
 	def __str__(self):
 		return f"e-GRN #{self.grn_number}"
 
 
+class GoodsReceivedNoteSequence(models.Model):
+	'''
+		Holds the last GRN sequence number allocated for a purchase order, GRN numbers are the PO ID with the sequence
+		number appended to the end (e.g. 10011, 10012, ... for PO 1001).
+	'''
+	purchase_order = models.OneToOneField(PurchaseOrder, on_delete=models.CASCADE, related_name='grn_sequence')
+	last_value = models.PositiveIntegerField(default=0)
+	
+	@staticmethod
+	def first_grn_number(purchase_order):
+		return int(str(purchase_order.po_id) + '1')
+	
+	@classmethod
+	def next_grn_number(cls, purchase_order):
+		'''
+			Atomically allocates and returns the next GRN number for the given purchase order. Call it inside the
+			transaction that saves the GRN, so that the number is given back if the GRN is not created.
+		'''
+		with transaction.atomic():
+			# Increment the sequence in a single UPDATE statement, this locks the row until the transaction is committed
+			updated = cls.objects.filter(purchase_order=purchase_order).update(last_value=F('last_value') + 1)
+			if not updated:
+				try:
+					with transaction.atomic():
+						# Start the sequence after any GRNs created for this purchase order before the sequence existed
+						last_grn_number = GoodsReceivedNote.objects.filter(purchase_order=purchase_order).aggregate(
+							last_grn_number=models.Max('grn_number'))['last_grn_number']
+						last_value = last_grn_number - cls.first_grn_number(purchase_order) + 1 if last_grn_number else 0
+						cls.objects.create(purchase_order=purchase_order, last_value=last_value + 1)
+				except IntegrityError:
+					# The sequence was created by a concurrent receipt
+					cls.objects.filter(purchase_order=purchase_order).update(last_value=F('last_value') + 1)
+			last_value = cls.objects.filter(purchase_order=purchase_order).values_list('last_value', flat=True).get()
+		return cls.first_grn_number(purchase_order) + last_value - 1
+
+
+class GoodsReceivedLineItemQuerySet(models.QuerySet):
+	'''
+		Custom queryset for the GoodsReceivedLineItem model.
+	'''
+	
+	def with_invoiced_quantity(self):
+		'''
+			Annotates each line item with the total quantity invoiced against it (as "annotated_invoiced_quantity").
+		'''
+		return self.annotate(
+			annotated_invoiced_quantity=Coalesce(
+				Sum('invoice_items__quantity'), Value(0),
+				output_field=DecimalField(max_digits=15, decimal_places=3)
+			)
+		)
+
+
 class GoodsReceivedLineItem(models.Model):
 	grn = models.ForeignKey(GoodsReceivedNote, on_delete=models.CASCADE, related_name='line_items')
 	purchase_order_line_item = models.ForeignKey(PurchaseOrderLineItem, on_delete=models.CASCADE,
@@ -361,8 +593,13 @@ class GoodsReceivedLineItem(models.Model):
 	metadata = models.JSONField(default=dict, blank=True, null=True)
 	date_received = models.DateField(auto_now=True)
 	
+	objects = GoodsReceivedLineItemQuerySet.as_manager()
+	
 	@property
 	def invoiced_quantity(self):
+		# Use the quantity annotated by GoodsReceivedLineItem.objects.with_invoiced_quantity(), if available
+		if hasattr(self, 'annotated_invoiced_quantity'):
+			return self.annotated_invoiced_quantity
 		invoiced_quantity = self.invoice_items.aggregate(total_quantity=Sum('quantity'))['total_quantity'] or 0.0000
 		return invoiced_quantity
 	
@@ -378,7 +615,7 @@ class GoodsReceivedLineItem(models.Model):
 			Calculate the tax amount by getting the tax percentages from the purchase_order_line_item.tax_rates,
 			and adding it to the net value received.
 		'''
-		tax_rates = sum([rate['rate'] for rate in self.purchase_order_line_item.tax_rates])
+		tax_rates = surcharge_index.total_rate(self.purchase_order_line_item.tax_rates)
 		tax_amount = self.net_value() * (tax_rates / 100)
 		return round(tax_amount, 3)
 	
@@ -389,11 +626,12 @@ class GoodsReceivedLineItem(models.Model):
 		'''
 		...
 	
-	def clean(self):
+	def clean(self, total_received=None):
 		# Get the sum of the quantity received for this item by adding up the quantity received
-		# of all GRN line items for this particular PO line item.
-		grns_raised_for_this = self.get_grn_for_po_line(self.purchase_order_line_item.object_id)
-		total_received = grns_raised_for_this.aggregate(total_sum=Sum('quantity_received'))['total_sum']
+		# of all GRN line items for this particular PO line item (unless it has already been computed by the caller).
+		if total_received is None:
+			grns_raised_for_this = self.get_grn_for_po_line(self.purchase_order_line_item.object_id)
+			total_received = grns_raised_for_this.aggregate(total_sum=Sum('quantity_received'))['total_sum']
 		total_received = total_received or 0.0000
 		# Get the quantity that is being received for this item.
 		quantity_to_receive = self.quantity_received
@@ -415,21 +653,19 @@ class GoodsReceivedLineItem(models.Model):
 	def convert_product(self, data):
 		# Get the product_id of the product being saved from the po line item metadata`
 		product_id = self.purchase_order_line_item.metadata.get('ProductID')
-		try:
-			# Get conversion methods defined for this product
-			conversion_method = ProductConfiguration.objects.get(product_id=product_id).conversion.conversion_method
-		except ObjectDoesNotExist:
+		# Get the conversion defined for this product
+		conversion = product_conversions.get(product_id)
+		if not conversion:
 			return False
-		# Get the conversion method name from the instance
-		method_name = conversion_method
-		# Get all the functions from the conversion_methods module
-		methods = dict(inspect.getmembers(converters, inspect.isfunction))
-		# Get the specific method to call
-		method_to_call = methods.get(method_name)
+		# Get the conversion method name and the registered function to call
+		method_name = conversion['conversion_method']
+		method_to_call = converters.get_converter(method_name)
 	
 		if method_to_call:
+			input_fields = (data or {}).get('extra_fields')
+			# Validate the inputs against the conversion fields (or the inputs declared by the function) before converting
+			converters.validate_inputs(input_fields, conversion['conversion_field'] or method_to_call.input_schema)
 			try:
-				input_fields = data.get('extra_fields')
 				# Call the conversion method with the Product instance
 				result = method_to_call(input_fields=input_fields)
 				# If any items in the result dict is an attribute of this class, remove it from the result dict and set it to the instance
@@ -450,17 +686,24 @@ class GoodsReceivedLineItem(models.Model):
 		"""
 		try:
 			self.convert_product(data=kwargs.get('data'))
+		except ValidationError as e:
+			raise e
 		except Exception as e:
 			logging.error(f"Error converting product: {e}")
 			
-		# Calculate the net and gross value received
-		self.net_value_received = self.net_value()
-		self.gross_value_received = self.net_value_received + self.calculate_tax_amount()
+		self.set_received_values()
 		
 		self.clean()
 		
 		return super().save()
 	
+	def set_received_values(self):
+		"""
+			Calculates and sets the net and gross value received.
+		"""
+		self.net_value_received = self.net_value()
+		self.gross_value_received = self.net_value_received + self.calculate_tax_amount()
+	
 	def get_grn_for_po_line(self, object_id):
 		"""
 			Returns the Goods Received Note for this line item.
@@ -472,6 +715,19 @@ class GoodsReceivedLineItem(models.Model):
 		return f"GRN Entry for '{self.purchase_order_line_item.product_name}'"
 
 
+@receiver(post_save, sender=GoodsReceivedLineItem)
+@receiver(post_delete, sender=GoodsReceivedLineItem)
+def refresh_po_line_delivery_hook(sender, instance, **kwargs):
+	# Keep the materialized delivered quantity and delivery status of the PO line item up to date
+	try:
+		instance.purchase_order_line_item.refresh_delivery_status()
+	except ObjectDoesNotExist:
+		# The PO line item is being deleted along with its GRN line items
+		return False
+	
+	return True
+
+
 class Conversion(models.Model):
 	'''
 		Defines how a product can be converted to another unit of measurement.
@@ -480,6 +736,7 @@ class Conversion(models.Model):
 	conversion_field = models.JSONField(default=dict, blank=False) # The fields that define the conversion.
 	conversion_method = models.CharField(max_length=100, choices=get_conversion_methods()) #
 	created_on = models.DateTimeField(auto_now_add=True)
+	last_modified = models.DateTimeField(auto_now=True)
 	
 	def __str__(self):
 		return f"{self.name}"
@@ -493,6 +750,7 @@ class ProductConfiguration(models.Model):
 	conversion = models.ForeignKey(Conversion, blank=True, null=True, on_delete=models.CASCADE, related_name='product_conversion')
 	metadata = models.JSONField(default=dict, blank=True, null=True) # Additional metadata for the product.
 	created_on = models.DateTimeField(auto_now_add=True)
+	last_modified = models.DateTimeField(auto_now=True)
 	
 	@property
 	def product_name(self):
@@ -502,3 +760,377 @@ class ProductConfiguration(models.Model):
 	def __str__(self):
 		return f"'{self.product_id} ({self.product_name})'"
 	
+
+
+@receiver(post_save, sender=Conversion)
+@receiver(post_delete, sender=Conversion)
+@receiver(post_save, sender=ProductConfiguration)
+@receiver(post_delete, sender=ProductConfiguration)
+def invalidate_product_conversions_hook(sender, instance, **kwargs):
+	# Discard the in-memory product conversion index so that it is rebuilt on the next lookup
+	product_conversions.invalidate()
+
+
+class WeightedAverageCostQuerySet(models.QuerySet):
+	def as_of(self, date=None, store=None):
+		'''
+			Annotates the running quantity, cost and WAC of each product at the end of the given date (and at the
+			given store) from its latest ledger entry on or before that date, and drops the products that had not been
+			received (at the store) by then. Each value is a single indexed lookup into the ledger history.
+		'''
+		entries = WeightedAverageCostEntry.objects.filter(ledger=OuterRef('pk'))
+		if date:
+			entries = entries.filter(date__lte=date)
+		if store is not None:
+			# Stores carry no opening stock; their running values start from the first receipt at the store
+			entries = entries.filter(store=store)
+			fields = ('store_cumulative_quantity', 'store_cumulative_cost', 'store_wac')
+			defaults = (Value(0), Value(0), Value(0))
+		else:
+			fields = ('cumulative_quantity', 'cumulative_cost', 'wac')
+			defaults = (F('starting_quantity'), F('starting_quantity') * F('starting_cost'), F('starting_cost'))
+		entries = entries.order_by('-date', '-grn_line_item_id')
+		
+		queryset = self.filter(Exists(entries)) if date or store is not None else self
+		return queryset.annotate(**{
+			f'annotated_{name}': Coalesce(
+				Subquery(entries.values(field)[:1]), default, output_field=DecimalField(max_digits=20, decimal_places=3)
+			) for name, field, default in zip(('cumulative_quantity', 'cumulative_cost', 'wac'), fields, defaults)
+		})
+
+
+class WeightedAverageCost(models.Model):
+	'''
+		The weighted average cost ledger of a product: the running quantity, cost and WAC of every product received,
+		updated incrementally as GRN line items are created so that reading it does not replay the purchase history.
+		The running values are also kept for every store (WeightedAverageStoreCost) and recorded on every history
+		entry, so the WAC of a product at a store on a past date is a lookup of the latest entry on or before it.
+	'''
+	product_id = models.CharField(max_length=32, blank=False, null=False, unique=True) # The ByD Product ID
+	product_name = models.CharField(max_length=100, blank=True, null=True)
+	starting_quantity = models.DecimalField(max_digits=20, decimal_places=3, default=0)
+	starting_cost = models.DecimalField(max_digits=20, decimal_places=3, default=0) # Cost per unit of the starting quantity
+	cumulative_quantity = models.DecimalField(max_digits=20, decimal_places=3, default=0)
+	cumulative_cost = models.DecimalField(max_digits=20, decimal_places=3, default=0)
+	wac = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+	last_updated = models.DateTimeField(auto_now=True)
+	
+	objects = WeightedAverageCostQuerySet.as_manager()
+	
+	@classmethod
+	def get_wac(cls, product_id, store=None, date=None):
+		'''
+			Returns the WAC of a product (at a store, if given) at the end of the given date, or None if the product
+			had not been received (at the store) by then.
+		'''
+		return cls.objects.filter(product_id=product_id).as_of(date=date, store=store).values_list(
+			'annotated_wac', flat=True
+		).first()
+	
+	@staticmethod
+	def get_starting_values(metadata):
+		'''
+			Returns the starting quantity and total starting cost of a product, from its ProductConfiguration metadata.
+		'''
+		starting_quantity, starting_cost = Decimal(0), Decimal(0)
+		if metadata:
+			starting_quantity = Decimal(str(metadata.get('inital_quantity', 0)))
+			starting_cost = Decimal(str(metadata.get('initial_cost', 0))) * starting_quantity
+		return starting_quantity, starting_cost
+	
+	@classmethod
+	def open_ledgers(cls, product_ids, metadata=None):
+		'''
+			Returns the (unsaved, empty) ledgers of the given products, seeded with their starting values
+			(from the given ProductConfiguration metadata by product_id, or loaded from the database).
+		'''
+		if metadata is None:
+			metadata = dict(
+				ProductConfiguration.objects.filter(product_id__in=product_ids).values_list('product_id', 'metadata')
+			)
+		ledgers = []
+		for product_id in product_ids:
+			starting_quantity, starting_cost = cls.get_starting_values(metadata.get(product_id))
+			ledgers.append(cls(
+				product_id=product_id,
+				starting_quantity=starting_quantity,
+				starting_cost=starting_cost / starting_quantity if starting_quantity > 0 else 0,
+				cumulative_quantity=starting_quantity,
+				cumulative_cost=starting_cost,
+			))
+		return ledgers
+	
+	def post_receipt(self, line_item):
+		'''
+			Adds a GRN line item to the running totals of this ledger and returns its (unsaved) history entry.
+		'''
+		purchase_order_line_item = line_item.purchase_order_line_item
+		purchase_quantity = line_item.quantity_received
+		purchase_cost = purchase_quantity * purchase_order_line_item.unit_price
+		# Update cumulative values with new purchase, for the product and for the store it was delivered to
+		store_id = purchase_order_line_item.delivery_store_id
+		if store_id not in self.store_costs:
+			self.store_costs[store_id] = WeightedAverageStoreCost(ledger=self, store_id=store_id)
+		for running in (self, self.store_costs[store_id]):
+			running.cumulative_quantity += purchase_quantity
+			running.cumulative_cost += purchase_cost
+			# Calculate new WAC
+			running.wac = round(running.cumulative_cost / running.cumulative_quantity, 2) if running.cumulative_quantity else 0
+		self.product_name = self.product_name or purchase_order_line_item.product_name
+		
+		return WeightedAverageCostEntry(
+			ledger=self,
+			grn_line_item=line_item,
+			store_id=store_id,
+			date=line_item.date_received,
+			purchase_quantity=purchase_quantity,
+			purchase_cost=purchase_cost,
+			cumulative_quantity=self.cumulative_quantity,
+			cumulative_cost=self.cumulative_cost,
+			wac=self.wac,
+			store_cumulative_quantity=self.store_costs[store_id].cumulative_quantity,
+			store_cumulative_cost=self.store_costs[store_id].cumulative_cost,
+			store_wac=self.store_costs[store_id].wac,
+		)
+	
+	@property
+	def store_costs(self):
+		# The running values of this product per store id, loaded by record_receipts() or filled by rebuild()
+		if not hasattr(self, '_store_costs'):
+			self._store_costs = {}
+		return self._store_costs
+	
+	@classmethod
+	def save_store_costs(cls, ledgers):
+		'''
+			Writes the per-store running values of the given ledgers.
+		'''
+		store_costs = [store_cost for ledger in ledgers for store_cost in ledger.store_costs.values()]
+		WeightedAverageStoreCost.objects.bulk_create([store_cost for store_cost in store_costs if not store_cost.pk])
+		WeightedAverageStoreCost.objects.bulk_update(
+			[store_cost for store_cost in store_costs if store_cost.pk], ['cumulative_quantity', 'cumulative_cost', 'wac']
+		)
+	
+	@classmethod
+	def record_receipts(cls, line_items):
+		'''
+			Posts newly received GRN line items to the ledgers of their products. The ledgers are locked for the duration
+			of the update, so concurrent receipts of the same product are applied one after the other.
+		'''
+		line_items = [item for item in line_items if item.pk]
+		if not line_items:
+			return 0
+		
+		with transaction.atomic():
+			product_ids = {item.purchase_order_line_item.product_id for item in line_items}
+			# Open the ledgers of products received for the first time (a concurrent receipt may have just opened them)
+			missing = product_ids - set(cls.objects.filter(product_id__in=product_ids).values_list('product_id', flat=True))
+			if missing:
+				cls.objects.bulk_create(cls.open_ledgers(missing), ignore_conflicts=True)
+			ledgers = {
+				ledger.product_id: ledger for ledger in cls.objects.select_for_update().filter(product_id__in=product_ids)
+			}
+			# The store running values are only written under the lock of their product ledger
+			ledgers_by_id = {ledger.id: ledger for ledger in ledgers.values()}
+			for store_cost in WeightedAverageStoreCost.objects.filter(ledger__in=ledgers_by_id):
+				ledgers_by_id[store_cost.ledger_id].store_costs[store_cost.store_id] = store_cost
+			entries = []
+			# Receipts are posted in the order they were received
+			for line_item in sorted(line_items, key=lambda item: (item.date_received, item.pk)):
+				entries.append(ledgers[line_item.purchase_order_line_item.product_id].post_receipt(line_item))
+			
+			WeightedAverageCostEntry.objects.bulk_create(entries)
+			# bulk_update does not apply auto_now
+			for ledger in ledgers.values():
+				ledger.last_updated = timezone.now()
+			cls.objects.bulk_update(
+				ledgers.values(), ['product_name', 'cumulative_quantity', 'cumulative_cost', 'wac', 'last_updated']
+			)
+			cls.save_store_costs(ledgers.values())
+		return len(entries)
+	
+	@classmethod
+	def rebuild(cls, product_ids=None, chunk_size=500, workers=None):
+		'''
+			Rebuilds the ledgers (of the given products, or all products) by revaluing their GRN line items in chunks
+			of products. Used to backfill the ledger, after a received quantity is corrected or deleted and after the
+			starting quantity or cost of a product changes.
+		'''
+		if product_ids is None:
+			product_ids = set(GoodsReceivedLineItem.objects.values_list(
+				'purchase_order_line_item__product_id', flat=True
+			).distinct()) | set(cls.objects.values_list('product_id', flat=True))
+		product_ids = sorted(set(product_ids))
+		
+		rebuilt = 0
+		for start in range(0, len(product_ids), chunk_size):
+			rebuilt += cls.revalue(product_ids[start:start + chunk_size], workers=workers)
+		return rebuilt
+	
+	@classmethod
+	def revalue(cls, product_ids, workers=None):
+		'''
+			Recomputes the ledgers of the given products from their GRN line items, loaded as columns in one query,
+			and writes the ledgers, their store values and their history back in bulk.
+		'''
+		with transaction.atomic():
+			metadata = dict(
+				ProductConfiguration.objects.filter(product_id__in=product_ids).values_list('product_id', 'metadata')
+			)
+			# Open the missing ledgers, so that every ledger being revalued can be locked against concurrent receipts
+			missing = set(product_ids) - set(cls.objects.filter(product_id__in=product_ids).values_list('product_id', flat=True))
+			if missing:
+				cls.objects.bulk_create(cls.open_ledgers(missing, metadata), ignore_conflicts=True)
+			ledgers = {
+				ledger.product_id: ledger for ledger in cls.objects.select_for_update().filter(product_id__in=product_ids)
+			}
+			
+			# Load the receipts of the products as columns, in the order they were received
+			products = {}
+			rows = GoodsReceivedLineItem.objects.filter(purchase_order_line_item__product_id__in=product_ids).order_by(
+				'purchase_order_line_item__product_id', 'date_received', 'id'
+			).values_list(
+				'id', 'purchase_order_line_item__product_id', 'purchase_order_line_item__product_name',
+				'purchase_order_line_item__delivery_store_id', 'date_received', 'quantity_received',
+				'purchase_order_line_item__unit_price'
+			)
+			for line_item_id, product_id, product_name, store_id, date_received, quantity, unit_price in rows.iterator():
+				if product_id not in products:
+					starting_quantity, starting_cost = cls.get_starting_values(metadata.get(product_id))
+					products[product_id] = {
+						'product_id': product_id, 'product_name': product_name,
+						'starting_quantity': starting_quantity, 'starting_cost': starting_cost,
+						'ids': [], 'stores': [], 'dates': [], 'quantities': [], 'unit_prices': [],
+					}
+				columns = products[product_id]
+				columns['ids'].append(line_item_id)
+				columns['stores'].append(store_id)
+				columns['dates'].append(date_received)
+				columns['quantities'].append(quantity)
+				columns['unit_prices'].append(unit_price)
+			
+			# Products that are no longer received have no ledger
+			cls.objects.filter(product_id__in=set(ledgers) - set(products)).delete()
+			WeightedAverageCostEntry.objects.filter(ledger__product_id__in=product_ids).delete()
+			WeightedAverageStoreCost.objects.filter(ledger__product_id__in=product_ids).delete()
+			
+			entries, store_costs = [], []
+			for result in valuation.revalue_products(list(products.values()), workers=workers):
+				columns, ledger = products[result['product_id']], ledgers[result['product_id']]
+				ledger.product_name = ledger.product_name or columns['product_name']
+				ledger.starting_quantity = columns['starting_quantity']
+				ledger.starting_cost = columns['starting_cost'] / columns['starting_quantity'] if columns['starting_quantity'] > 0 else 0
+				ledger.cumulative_quantity = result['cumulative_quantity']
+				ledger.cumulative_cost = result['cumulative_cost']
+				ledger.wac = result['wac']
+				ledger.last_updated = timezone.now()
+				entries.extend(
+					WeightedAverageCostEntry(
+						ledger=ledger, grn_line_item_id=line_item_id, store_id=store_id, date=date, purchase_quantity=quantity,
+						purchase_cost=cost, cumulative_quantity=cumulative_quantity, cumulative_cost=cumulative_cost, wac=wac,
+						store_cumulative_quantity=store_quantity, store_cumulative_cost=store_cost, store_wac=store_wac,
+					) for (line_item_id, store_id, date, quantity, cost, cumulative_quantity, cumulative_cost, wac,
+					       store_quantity, store_cost, store_wac) in result['entries']
+				)
+				store_costs.extend(
+					WeightedAverageStoreCost(ledger=ledger, store_id=store_id, cumulative_quantity=quantity, cumulative_cost=cost, wac=wac)
+					for store_id, (quantity, cost, wac) in result['stores'].items()
+				)
+			
+			cls.objects.bulk_update(
+				[ledgers[product_id] for product_id in products],
+				['product_name', 'starting_quantity', 'starting_cost', 'cumulative_quantity', 'cumulative_cost', 'wac',
+				 'last_updated'],
+				batch_size=500
+			)
+			WeightedAverageCostEntry.objects.bulk_create(entries, batch_size=1000)
+			WeightedAverageStoreCost.objects.bulk_create(store_costs, batch_size=1000)
+		return len(products)
+	
+	def __str__(self):
+		return f"WAC of '{self.product_name or self.product_id}'"
+
+
+class WeightedAverageStoreCost(models.Model):
+	'''
+		The running quantity, cost and WAC of a product at a store.
+	'''
+	ledger = models.ForeignKey(WeightedAverageCost, on_delete=models.CASCADE, related_name='stores')
+	store = models.ForeignKey(Store, on_delete=models.CASCADE, blank=True, null=True)
+	cumulative_quantity = models.DecimalField(max_digits=20, decimal_places=3, default=0)
+	cumulative_cost = models.DecimalField(max_digits=20, decimal_places=3, default=0)
+	wac = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+	
+	class Meta:
+		unique_together = ('ledger', 'store')
+	
+	def __str__(self):
+		return f"{self.ledger} at {self.store}"
+
+
+class WeightedAverageCostEntry(models.Model):
+	'''
+		A purchase posted to a product's weighted average cost ledger, with the running values (for the product and
+		for the store it was delivered to) after the purchase.
+	'''
+	ledger = models.ForeignKey(WeightedAverageCost, on_delete=models.CASCADE, related_name='history')
+	grn_line_item = models.OneToOneField(GoodsReceivedLineItem, on_delete=models.CASCADE, related_name='wac_entry')
+	store = models.ForeignKey(Store, on_delete=models.SET_NULL, blank=True, null=True)
+	date = models.DateField()
+	purchase_quantity = models.DecimalField(max_digits=15, decimal_places=3)
+	purchase_cost = models.DecimalField(max_digits=20, decimal_places=3)
+	cumulative_quantity = models.DecimalField(max_digits=20, decimal_places=3)
+	cumulative_cost = models.DecimalField(max_digits=20, decimal_places=3)
+	wac = models.DecimalField(max_digits=20, decimal_places=2)
+	store_cumulative_quantity = models.DecimalField(max_digits=20, decimal_places=3, default=0)
+	store_cumulative_cost = models.DecimalField(max_digits=20, decimal_places=3, default=0)
+	store_wac = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+	
+	@property
+	def purchase_price_per_unit(self):
+		return self.purchase_cost / self.purchase_quantity if self.purchase_quantity else 0
+	
+	class Meta:
+		indexes = [
+			models.Index(fields=['ledger', 'date', 'grn_line_item']),
+			models.Index(fields=['ledger', 'store', 'date', 'grn_line_item']),
+		]
+	
+	def __str__(self):
+		return f"{self.ledger} on {self.date}"
+
+
+@receiver(post_save, sender=GoodsReceivedLineItem)
+def post_wac_receipt_hook(sender, instance, created, **kwargs):
+	# New receipts are appended to the product's WAC ledger; a corrected receipt changes every later entry,
+	# so the product's ledger is replayed instead.
+	if created:
+		WeightedAverageCost.record_receipts([instance])
+	else:
+		WeightedAverageCost.rebuild([instance.purchase_order_line_item.product_id])
+
+
+@receiver(post_save, sender=ProductConfiguration)
+def revalue_wac_ledger_hook(sender, instance, **kwargs):
+	# A change to the starting quantity or cost of a product changes every point of its WAC ledger
+	ledger = WeightedAverageCost.objects.filter(product_id=instance.product_id).first()
+	if not ledger:
+		return False
+	starting_quantity, starting_cost = WeightedAverageCost.get_starting_values(instance.metadata)
+	starting_cost = starting_cost / starting_quantity if starting_quantity > 0 else 0
+	if (ledger.starting_quantity, ledger.starting_cost) != (starting_quantity, round(Decimal(starting_cost), 3)):
+		WeightedAverageCost.rebuild([instance.product_id])
+	
+	return True
+
+
+@receiver(post_delete, sender=GoodsReceivedLineItem)
+def rebuild_wac_ledger_hook(sender, instance, **kwargs):
+	# Replay the product's WAC ledger without the deleted receipt
+	try:
+		WeightedAverageCost.rebuild([instance.purchase_order_line_item.product_id])
+	except ObjectDoesNotExist:
+		# The PO line item is being deleted along with its GRN line items
+		return False
+	
+	return True
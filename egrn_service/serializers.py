@@ -1,6 +1,8 @@
 from datetime import datetime
 from rest_framework import serializers
-from .models import Surcharge, GoodsReceivedNote, GoodsReceivedLineItem, PurchaseOrder, PurchaseOrderLineItem
+from .models import Surcharge, GoodsReceivedNote, GoodsReceivedLineItem, PurchaseOrder, PurchaseOrderLineItem, \
+	WeightedAverageCost, WeightedAverageCostEntry
+from django.db.models import Prefetch
 from django.forms.models import model_to_dict
 
 
@@ -28,6 +30,16 @@ class GoodsReceivedLineItemSerializer(serializers.ModelSerializer):
 	def get_tax_value(self, obj):
 		return obj.gross_value_received - obj.net_value_received
 	
+	@staticmethod
+	def setup_eager_loading(queryset):
+		'''
+			Applies the annotations, joins and prefetches this serializer needs to the given GoodsReceivedLineItem queryset.
+		'''
+		return queryset.with_invoiced_quantity().select_related('grn').prefetch_related(
+			Prefetch('purchase_order_line_item',
+			         queryset=PurchaseOrderLineItemSerializer.setup_eager_loading(PurchaseOrderLineItem.objects.all()))
+		)
+	
 	class Meta:
 		model = GoodsReceivedLineItem
 		fields = ['id', 'grn_number', 'quantity_received', 'gross_value_received', 'net_value_received','invoiced_quantity', 'is_invoiced', 'tax_value', 'metadata', 'date_received',
@@ -38,7 +50,7 @@ class PurchaseOrderLineItemSerializer(serializers.ModelSerializer):
 	grn_line_items = GoodsReceivedLineItemSerializer(many=True, read_only=True, source="line_items")
 	extra_fields = serializers.JSONField()
 	# Delivery status code, text, outstanding quantity, delivered quantity, delivery completed
-	delivery_status_code = serializers.SerializerMethodField()
+	delivery_status_code = serializers.CharField(read_only=True)
 	delivery_status_text = serializers.SerializerMethodField()
 	delivery_outstanding_quantity = serializers.SerializerMethodField()
 	delivered_quantity = serializers.FloatField()
@@ -48,9 +60,6 @@ class PurchaseOrderLineItemSerializer(serializers.ModelSerializer):
 		# Calculate and return outstanding quantity
 		return float(obj.quantity) - float(obj.delivered_quantity)
 	
-	def get_delivery_status_code(self, obj):
-		return obj.delivery_status[0]
-	
 	def get_delivery_status_text(self, obj):
 		return obj.delivery_status[1]
 	
@@ -58,6 +67,13 @@ class PurchaseOrderLineItemSerializer(serializers.ModelSerializer):
 		# Check if outstanding quantity is equal to the quantity
 		return self.get_delivery_outstanding_quantity(obj) == 0
 	
+	@staticmethod
+	def setup_eager_loading(queryset):
+		'''
+			Applies the annotations this serializer needs to the given PurchaseOrderLineItem queryset.
+		'''
+		return queryset.with_extra_fields()
+	
 	class Meta:
 		model = PurchaseOrderLineItem
 		fields = ['object_id', 'product_name', 'unit_price', 'quantity', 'tax_rates', 'unit_of_measurement',
@@ -84,6 +100,16 @@ class PurchaseOrderSerializer(serializers.ModelSerializer):
 	def get_delivery_completed(self, obj):
 		return obj.delivery_status[0] == '3'
 	
+	@staticmethod
+	def setup_eager_loading(queryset):
+		'''
+			Applies the annotations, joins and prefetches this serializer needs to the given PurchaseOrder queryset.
+		'''
+		return queryset.with_delivery_status().select_related('vendor').prefetch_related(
+			Prefetch('line_items',
+			         queryset=PurchaseOrderLineItemSerializer.setup_eager_loading(PurchaseOrderLineItem.objects.all()))
+		)
+	
 	def to_representation(self, instance):
 		# Convert the datetime object to a date
 		instance.date = instance.date.date() if isinstance(instance.date, datetime) else instance.date
@@ -108,8 +134,80 @@ class GoodsReceivedNoteSerializer(serializers.ModelSerializer):
 		po_dict.pop('Item')
 		return po_dict
 	
+	@staticmethod
+	def setup_eager_loading(queryset):
+		'''
+			Applies the joins and prefetches this serializer (and its nested serializers) needs to the given
+			GoodsReceivedNote queryset, so that serializing a page of GRNs runs a fixed number of queries.
+		'''
+		return queryset.select_related('store').prefetch_related(
+			Prefetch('purchase_order',
+			         queryset=PurchaseOrderSerializer.setup_eager_loading(PurchaseOrder.objects.all())),
+			Prefetch('line_items',
+			         queryset=GoodsReceivedLineItemSerializer.setup_eager_loading(GoodsReceivedLineItem.objects.all())),
+		)
+	
 	class Meta:
 		model = GoodsReceivedNote
 		fields = ['grn_number', 'created', 'total_value_received', 'invoiced_quantity', 'invoice_status_code',
 		          'invoice_status_text', 'store', 'purchase_order', 'grn_line_items']
 		depth = 1
+
+
+class WeightedAverageCostEntrySerializer(serializers.ModelSerializer):
+	store = serializers.CharField(source='store.store_name', default=None)
+	purchase_quantity = serializers.FloatField()
+	purchase_price_per_unit = serializers.FloatField()
+	purchase_cost = serializers.FloatField()
+	cumulative_quantity = serializers.FloatField()
+	cumulative_cost = serializers.FloatField()
+	wac = serializers.FloatField()
+	store_cumulative_quantity = serializers.FloatField()
+	store_cumulative_cost = serializers.FloatField()
+	store_wac = serializers.FloatField()
+	grn = GoodsReceivedLineItemSerializer(source='grn_line_item')
+	
+	class Meta:
+		model = WeightedAverageCostEntry
+		fields = ['date', 'store', 'purchase_quantity', 'purchase_price_per_unit', 'purchase_cost', 'cumulative_quantity',
+		          'cumulative_cost', 'wac', 'store_cumulative_quantity', 'store_cumulative_cost', 'store_wac', 'grn']
+
+
+class WeightedAverageCostSerializer(serializers.ModelSerializer):
+	starting_quantity = serializers.FloatField()
+	starting_cost = serializers.FloatField()
+	cumulative_quantity = serializers.SerializerMethodField()
+	cumulative_cost = serializers.SerializerMethodField()
+	wac = serializers.SerializerMethodField()
+	history = WeightedAverageCostEntrySerializer(many=True, read_only=True)
+	
+	# Use the running values annotated by WeightedAverageCost.objects.as_of(), if available
+	def get_cumulative_quantity(self, obj):
+		return float(getattr(obj, 'annotated_cumulative_quantity', obj.cumulative_quantity))
+	
+	def get_cumulative_cost(self, obj):
+		return float(getattr(obj, 'annotated_cumulative_cost', obj.cumulative_cost))
+	
+	def get_wac(self, obj):
+		return round(float(getattr(obj, 'annotated_wac', obj.wac)), 2)
+	
+	@staticmethod
+	def setup_eager_loading(queryset, date=None, store=None):
+		'''
+			Prefetches the purchase history (and the GRN line items it was posted from) of the given
+			WeightedAverageCost queryset, up to the given date and for the given store, if any.
+		'''
+		history = WeightedAverageCostEntry.objects.select_related('store').prefetch_related(
+			Prefetch('grn_line_item',
+			         queryset=GoodsReceivedLineItemSerializer.setup_eager_loading(GoodsReceivedLineItem.objects.all()))
+		).order_by('date', 'grn_line_item_id')
+		if date:
+			history = history.filter(date__lte=date)
+		if store is not None:
+			history = history.filter(store=store)
+		return queryset.prefetch_related(Prefetch('history', queryset=history))
+	
+	class Meta:
+		model = WeightedAverageCost
+		fields = ['product_id', 'product_name', 'starting_quantity', 'starting_cost', 'cumulative_quantity',
+		          'cumulative_cost', 'wac', 'last_updated', 'history']
@@ -54,4 +54,51 @@ class Middleware:
 		except Exception as e:
 			logging.error(f"Error fetching store ({url}): {str(e)}")
 		
-		return None
\ No newline at end of file
+		return None
+
+
+class AsyncMiddleware(Middleware):
+	'''
+		Asyncio variant of Middleware, over the middleware client shared on the running event loop.
+		Create instances with `await AsyncMiddleware.create()`, which authenticates without blocking the loop.
+	'''
+	def __init__(self):
+		self.headers = {}
+	
+	@classmethod
+	async def create(cls):
+		middleware = cls()
+		await middleware.authenticate()
+		return middleware
+	
+	def get_client(self):
+		from core_service.helpers import get_async_client
+		return get_async_client('middleware')
+	
+	async def authenticate(self):
+		auth_url = f'{self.host}/api/v1/authenticate'
+		auth_data = {
+			"username": self.user_id,
+			"password": self.password
+		}
+		response = await self.get_client().post(auth_url, json=auth_data)
+		if response.status_code == 200:
+			self.headers = {
+				'Authorization': f'Bearer {response.json().get("data",{}).get("access")}'
+			}
+		else:
+			logging.error(f"Authentication failed: {response.text}")
+	
+	async def get_store(self, *args, **kwargs):
+		params = "&".join([f'{key}={value}' for key, value in kwargs.items()])
+		url = f'{os.getenv("MIDDLEWARE_HOST")}/api/v1/store'
+		url = f'{url}?{params}' if params else url
+		
+		try:
+			response = await self.get_client().get(url, headers=self.headers)
+			if response.status_code == 200:
+				return response.json()['data']
+		except Exception as e:
+			logging.error(f"Error fetching store ({url}): {str(e)}")
+		
+		return None
@@ -1,3 +1,452 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from core_service.models import CustomUser
+from .cache import product_conversions, store_directory, surcharge_index
+from . import converters, valuation
+from .models import Conversion, GoodsReceivedNote, GoodsReceivedLineItem, ProductConfiguration, PurchaseOrder, \
+	PurchaseOrderLineItem, Store, Surcharge, WeightedAverageCost, WeightedAverageCostEntry
 
-# Create your tests here.
+
+class PurchaseOrderTestCase(TestCase):
+	'''
+		Base test case with a delivery store and a VAT surcharge, and helpers to create purchase orders (from ByD
+		formatted data) and receive them. The ICG and email tasks are not enqueued.
+	'''
+
+	def setUp(self):
+		store_directory.invalidate()
+		self.store = Store.objects.create(store_name='HQ', icg_warehouse_name='HQ', icg_warehouse_code='W1',
+		                                  byd_cost_center_code='S1')
+		Surcharge.objects.create(code=1, description='VAT', rate=7.5)
+		async_task = mock.patch('egrn_service.models.async_task')
+		self.async_task = async_task.start()
+		self.addCleanup(async_task.stop)
+
+	def create_purchase_order(self, po_id, quantities=(10,), unit_price=100, product_ids=None, location='S1'):
+		items = [{
+			"ObjectID": f"{po_id}-{index}", "Description": f"Product {index}",
+			"ProductID": product_ids[index] if product_ids else f"P{index}", "Quantity": str(quantity),
+			"ListUnitPriceAmount": str(unit_price), "QuantityUnitCodeText": "Each", "NetUnitPriceAmount": str(unit_price),
+			"NetAmount": str(quantity * unit_price), "TaxAmount": str(quantity * unit_price * 0.075),
+			"ItemShipToLocation": {"LocationID": location},
+		} for index, quantity in enumerate(quantities)]
+		return PurchaseOrder().create_purchase_order({
+			"ID": po_id, "ObjectID": f"OBJ{po_id}", "TotalNetAmount": str(sum(quantities) * unit_price),
+			"LastChangeDateTime": "/Date(1700000000000)/", "Item": items,
+			"Supplier": {"PartyID": "V1", "SupplierName": [{}], "SupplierPostalAddress": [{}]}, "BuyerParty": {"BuyerPartyName": [{}]},
+		})
+
+	def grn_data(self, purchase_order, quantities):
+		line_items = purchase_order.line_items.order_by('id')
+		return {"po_id": purchase_order.po_id, "recievedGoods": [
+			{"itemObjectID": line_item.object_id, "quantityReceived": quantity}
+			for line_item, quantity in zip(line_items, quantities) if quantity
+		]}
+
+	def receive(self, purchase_order, quantities):
+		return GoodsReceivedNote().save(grn_data=self.grn_data(purchase_order, quantities))
+
+
+class DeliveryStatusTest(PurchaseOrderTestCase):
+
+	def test_receipts_update_the_delivery_status(self):
+		purchase_order = self.create_purchase_order(1001, quantities=(10, 5))
+		self.receive(purchase_order, (4, 5))
+		line_items = list(purchase_order.line_items.order_by('id'))
+		self.assertEqual([float(item.delivered_quantity) for item in line_items], [4, 5])
+		self.assertEqual([item.delivery_status_code for item in line_items], ['2', '3'])
+		self.assertEqual(PurchaseOrder.objects.with_delivery_status().get(pk=purchase_order.pk).delivery_status[0], '2')
+
+		self.receive(purchase_order, (6,))
+		self.assertEqual(PurchaseOrder.objects.with_delivery_status().get(pk=purchase_order.pk).delivery_status[0], '3')
+
+	def test_saving_and_deleting_a_grn_line_item_updates_the_delivery_status(self):
+		purchase_order = self.create_purchase_order(1002, quantities=(10,))
+		grn = self.receive(purchase_order, (4,))
+		line_item = purchase_order.line_items.get()
+
+		grn_line_item = GoodsReceivedLineItem(grn=grn, purchase_order_line_item=line_item, quantity_received=6)
+		grn_line_item.save()
+		line_item.refresh_from_db()
+		self.assertEqual((float(line_item.delivered_quantity), line_item.delivery_status_code), (10, '3'))
+
+		grn_line_item.delete()
+		line_item.refresh_from_db()
+		self.assertEqual((float(line_item.delivered_quantity), line_item.delivery_status_code), (4, '2'))
+
+	def test_rebuild_delivery_status_command(self):
+		first, second = self.create_purchase_order(1003, quantities=(10,)), self.create_purchase_order(1004, quantities=(10,))
+		self.receive(first, (10,))
+		self.receive(second, (3,))
+		# Clear the stored values, as if they had never been materialized
+		PurchaseOrderLineItem.objects.update(delivered_quantity=0, delivery_status_code='1')
+
+		out = StringIO()
+		call_command('rebuild_delivery_status', po_id=[1003], stdout=out)
+		self.assertIn('1 purchase order line item(s)', out.getvalue())
+		self.assertEqual(first.line_items.get().delivery_status_code, '3')
+		self.assertEqual(second.line_items.get().delivery_status_code, '1')
+
+		call_command('rebuild_delivery_status', stdout=StringIO())
+		line_item = second.line_items.get()
+		self.assertEqual((float(line_item.delivered_quantity), line_item.delivery_status_code), (3, '2'))
+
+
+class GoodsReceivedNoteTest(PurchaseOrderTestCase):
+
+	def test_line_items_are_created_in_one_batch(self):
+		purchase_order = self.create_purchase_order(2001, quantities=(10, 10, 10))
+		grn = self.receive(purchase_order, (1, 2, 3))
+		self.assertEqual(
+			[float(quantity) for quantity in grn.line_items.order_by('id').values_list('quantity_received', flat=True)], [1, 2, 3]
+		)
+		self.assertEqual([float(line_item.gross_value_received) for line_item in grn.line_items.order_by('id')],
+		                 [107.5, 215, 322.5])
+		self.async_task.assert_called()
+
+	def test_an_invalid_line_item_rejects_the_whole_grn(self):
+		purchase_order = self.create_purchase_order(2002, quantities=(10, 10))
+		with self.assertRaises(Exception):
+			self.receive(purchase_order, (5, 11))
+		self.assertFalse(GoodsReceivedNote.objects.exists())
+		self.assertFalse(GoodsReceivedLineItem.objects.exists())
+
+	def test_a_line_item_received_twice_in_one_grn_is_validated_against_the_total(self):
+		purchase_order = self.create_purchase_order(2003, quantities=(10,))
+		grn_data = self.grn_data(purchase_order, (6,))
+		grn_data["recievedGoods"] *= 2
+		with self.assertRaises(Exception):
+			GoodsReceivedNote().save(grn_data=grn_data)
+		self.assertFalse(GoodsReceivedLineItem.objects.exists())
+
+	def test_grn_numbers_follow_the_purchase_order_sequence(self):
+		purchase_order = self.create_purchase_order(2004, quantities=(10,))
+		self.assertEqual([self.receive(purchase_order, (1,)).grn_number for _ in range(3)], [20041, 20042, 20043])
+
+	def test_a_rejected_receipt_does_not_use_up_a_grn_number(self):
+		purchase_order = self.create_purchase_order(2005, quantities=(10,))
+		with self.assertRaises(Exception):
+			self.receive(purchase_order, (11,))
+		self.assertEqual(self.receive(purchase_order, (1,)).grn_number, 20051)
+
+	def test_the_sequence_starts_after_existing_grns(self):
+		purchase_order = self.create_purchase_order(2006, quantities=(10,))
+		# A GRN created before the purchase order had a sequence
+		GoodsReceivedNote.objects.bulk_create([GoodsReceivedNote(purchase_order=purchase_order, store=self.store, grn_number=20062)])
+		self.assertEqual(self.receive(purchase_order, (1,)).grn_number, 20063)
+
+
+class StoreDirectoryTest(PurchaseOrderTestCase):
+
+	def test_preload_caches_stores_and_misses(self):
+		with self.captureOnCommitCallbacks(execute=True):
+			store_directory.preload('byd_cost_center_code', ['S1', 'S404'])
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(store_directory.get('byd_cost_center_code', 'S1'), self.store)
+			self.assertIsNone(store_directory.get('byd_cost_center_code', 'S404'))
+		self.assertEqual(len(queries), 0)
+
+		# A store created after the miss was cached is found
+		store = Store.objects.create(store_name='New', icg_warehouse_code='W404', byd_cost_center_code='S404')
+		self.assertEqual(store_directory.get('byd_cost_center_code', 'S404'), store)
+
+	@mock.patch('egrn_service.services.Middleware')
+	def test_resolve_creates_the_store_from_the_middleware(self, middleware):
+		middleware.return_value.get_store.return_value = [
+			{"store_name": "Lekki", "icg_warehouse_code": "W2", "byd_cost_center_code": "S2"}
+		]
+		store = store_directory.resolve('S2')
+		self.assertEqual((store.store_name, store.icg_warehouse_code), ('Lekki', 'W2'))
+		middleware.return_value.get_store.assert_called_once_with(byd_cost_center_code='S2')
+
+	@mock.patch('egrn_service.services.Middleware')
+	def test_resolve_falls_back_to_the_default_store_once(self, middleware):
+		middleware.return_value.get_store.return_value = []
+		self.assertEqual([store_directory.resolve('S3') for _ in range(3)], [self.store] * 3)
+		self.assertEqual(middleware.return_value.get_store.call_count, 1)
+
+	def test_a_rolled_back_store_is_not_cached(self):
+		with self.captureOnCommitCallbacks(execute=True):
+			try:
+				with transaction.atomic():
+					Store.objects.create(store_name='Gone', icg_warehouse_code='W5', byd_cost_center_code='S5')
+					store_directory.get('byd_cost_center_code', 'S5')
+					raise IntegrityError
+			except IntegrityError:
+				pass
+		self.assertIsNone(store_directory.get('byd_cost_center_code', 'S5'))
+
+
+class SurchargeIndexTest(PurchaseOrderTestCase):
+
+	def test_line_item_tax_rates_come_from_the_index(self):
+		purchase_order = self.create_purchase_order(3001, quantities=(10,))
+		tax_rates = purchase_order.line_items.get().tax_rates
+		self.assertEqual([(rate['code'], rate['rate']) for rate in tax_rates], [(1, 7.5)])
+
+	def test_the_index_picks_up_changes_made_elsewhere(self):
+		self.assertEqual(len(surcharge_index.get(7.5)), 1)
+		# Changed as by another process, whose signals do not reach this one
+		Surcharge.objects.update(rate=5, last_modified=timezone.now() + timedelta(seconds=1))
+		with mock.patch.object(surcharge_index, 'check_interval', 0):
+			self.assertEqual(surcharge_index.get(7.5), [])
+			self.assertEqual(len(surcharge_index.get(5)), 1)
+
+
+class ProductConversionTest(PurchaseOrderTestCase):
+
+	def setUp(self):
+		super().setUp()
+		conversion = Conversion.objects.create(name='Chicken', conversion_method='chicken_conversion',
+		                                       conversion_field=converters.get_converter('chicken_conversion').input_schema)
+		ProductConfiguration.objects.create(product_id='P0', conversion=conversion)
+
+	def test_converters_are_registered_by_name(self):
+		self.assertIn('chicken_conversion', converters.registry)
+		self.assertIsNone(converters.get_converter('missing_conversion'))
+		self.assertEqual(product_conversions.get('P0')['conversion_method'], 'chicken_conversion')
+		self.assertIsNone(product_conversions.get('P1'))
+
+	def test_received_quantity_is_converted(self):
+		purchase_order = self.create_purchase_order(4001, quantities=(100,))
+		grn_data = self.grn_data(purchase_order, (1,))
+		grn_data["recievedGoods"][0]["extra_fields"] = {"number_of_bags": 3, "packets_per_bag": 10}
+		grn = GoodsReceivedNote().save(grn_data=grn_data)
+		self.assertEqual(float(grn.line_items.get().quantity_received), 30)
+
+	def test_invalid_conversion_inputs_are_rejected(self):
+		purchase_order = self.create_purchase_order(4002, quantities=(100,))
+		grn_data = self.grn_data(purchase_order, (1,))
+		grn_data["recievedGoods"][0]["extra_fields"] = {"number_of_bags": 0}
+		with self.assertRaises(ValidationError) as context:
+			GoodsReceivedNote().save(grn_data=grn_data)
+		self.assertEqual(len(context.exception.messages), 2)
+
+
+class BulkGoodsReceivedNoteTest(PurchaseOrderTestCase):
+
+	def setUp(self):
+		super().setUp()
+		self.client = APIClient()
+		self.client.force_authenticate(CustomUser.objects.create(username='receiver'))
+		async_task = mock.patch('egrn_service.views.async_task')
+		self.views_async_task = async_task.start()
+		self.addCleanup(async_task.stop)
+
+	def payload(self, purchase_order, quantities):
+		grn_data = self.grn_data(purchase_order, quantities)
+		return {"PONumber": grn_data["po_id"], "recievedGoods": grn_data["recievedGoods"]}
+
+	def test_each_grn_gets_a_result(self):
+		first, second = self.create_purchase_order(5001, quantities=(10,)), self.create_purchase_order(5002, quantities=(10,))
+		response = self.client.post('/egrn/v1/grns/bulk', [
+			self.payload(first, (4,)), self.payload(second, (11,)), {"PONumber": 5001}, self.payload(first, (6,)),
+		], format='json')
+		self.assertEqual(response.status_code, 201)
+		results = response.data['data']
+		self.assertEqual([result['created'] for result in results], [True, False, False, True])
+		self.assertEqual([result.get('grn_number') for result in results], [50011, None, None, 50012])
+		self.assertIn('greater than outstanding delivery quantity', results[1]['error'])
+		self.assertIn('Missing required key(s)', results[2]['error'])
+		self.assertEqual(results[0]['grn']['grn_number'], 50011)
+		# The tasks of the created GRNs are enqueued once for the batch
+		self.assertEqual(self.views_async_task.call_count, 2)
+		self.assertEqual(len(self.views_async_task.call_args_list[0].args[1]), 2)
+
+	def test_a_failed_purchase_order_lookup_only_fails_its_grns(self):
+		known = self.create_purchase_order(5003, quantities=(10,))
+		with mock.patch.object(PurchaseOrder, 'fetch_missing', side_effect=TimeoutError('ByD timed out')):
+			response = self.client.post('/egrn/v1/grns/bulk', [
+				self.payload(known, (1,)), {"PONumber": 5999, "recievedGoods": [{"itemObjectID": "5999-0", "quantityReceived": 1}]},
+			], format='json')
+		results = response.data['data']
+		self.assertEqual(response.status_code, 201)
+		self.assertEqual([result['created'] for result in results], [True, False])
+		self.assertIn('ByD timed out', results[1]['error'])
+
+	def test_a_batch_without_created_grns_fails(self):
+		purchase_order = self.create_purchase_order(5004, quantities=(10,))
+		response = self.client.post('/egrn/v1/grns/bulk', [self.payload(purchase_order, (11,))], format='json')
+		self.assertEqual(response.status_code, 400)
+		self.assertFalse(GoodsReceivedNote.objects.exists())
+		self.assertEqual(self.client.post('/egrn/v1/grns/bulk', {}, format='json').status_code, 400)
+
+
+class WeightedAverageCostTest(PurchaseOrderTestCase):
+
+	def setUp(self):
+		super().setUp()
+		# 10 units in stock at 50 each before the first receipt
+		ProductConfiguration.objects.create(product_id='P0', metadata={"inital_quantity": 10, "initial_cost": 50})
+
+	def ledger_values(self, product_id='P0'):
+		ledger = WeightedAverageCost.objects.get(product_id=product_id)
+		return float(ledger.cumulative_quantity), float(ledger.cumulative_cost), float(ledger.wac)
+
+	def history(self, product_id='P0'):
+		return [
+			(float(entry.purchase_quantity), float(entry.cumulative_quantity), float(entry.wac))
+			for entry in WeightedAverageCostEntry.objects.filter(ledger__product_id=product_id).order_by('grn_line_item_id')
+		]
+
+	def test_receipts_are_posted_to_the_ledger(self):
+		self.receive(self.create_purchase_order(6001, quantities=(100,), unit_price=100), (10,))
+		self.assertEqual(self.ledger_values(), (20, 1500, 75))
+		self.receive(self.create_purchase_order(6002, quantities=(100,), unit_price=200), (20,))
+		self.assertEqual(self.ledger_values(), (40, 5500, 137.5))
+		self.assertEqual(self.history(), [(10, 20, 75), (20, 40, 137.5)])
+
+	def test_a_product_without_starting_values_starts_empty(self):
+		self.receive(self.create_purchase_order(6003, quantities=(100, 100), product_ids=['P0', 'P9']), (0, 4))
+		self.assertEqual(self.ledger_values('P9'), (4, 400, 100))
+		self.assertFalse(WeightedAverageCost.objects.filter(product_id='P0').exists())
+
+	def test_rebuild_replays_the_receipts(self):
+		self.receive(self.create_purchase_order(6004, quantities=(100,), unit_price=100), (10,))
+		self.receive(self.create_purchase_order(6005, quantities=(100,), unit_price=200), (20,))
+		values, history = self.ledger_values(), self.history()
+
+		WeightedAverageCost.objects.all().delete()
+		self.assertEqual(WeightedAverageCost.rebuild(), 1)
+		self.assertEqual((self.ledger_values(), self.history()), (values, history))
+
+	def test_deleting_a_receipt_rebuilds_the_ledger(self):
+		self.receive(self.create_purchase_order(6006, quantities=(100,), unit_price=100), (10,))
+		grn = self.receive(self.create_purchase_order(6007, quantities=(100,), unit_price=200), (20,))
+		grn.line_items.get().delete()
+		self.assertEqual(self.ledger_values(), (20, 1500, 75))
+		self.assertEqual(len(self.history()), 1)
+
+
+class WeightedAverageCostLookupTest(PurchaseOrderTestCase):
+	'''
+		WAC at a store and as at a past date, from three receipts: 10 at 100 (S1, 1 March), 10 at 200 (S2, 2 March)
+		and 20 at 400 (S1, 3 March), on top of 10 units in stock at 50.
+	'''
+
+	def setUp(self):
+		super().setUp()
+		ProductConfiguration.objects.create(product_id='P0', metadata={"inital_quantity": 10, "initial_cost": 50})
+		self.other_store = Store.objects.create(store_name='Lekki', icg_warehouse_code='W2', byd_cost_center_code='S2')
+		receipts = [(7001, 100, 'S1', date(2024, 3, 1), 10), (7002, 200, 'S2', date(2024, 3, 2), 10),
+		            (7003, 400, 'S1', date(2024, 3, 3), 20)]
+		for po_id, unit_price, location, received_on, quantity in receipts:
+			grn = self.receive(self.create_purchase_order(po_id, quantities=(100,), unit_price=unit_price, location=location), (quantity,))
+			grn.line_items.update(date_received=received_on)
+		WeightedAverageCost.rebuild(['P0'])
+
+	def test_wac_as_of_a_date(self):
+		self.assertEqual(float(WeightedAverageCost.get_wac('P0')), 230)
+		self.assertEqual(float(WeightedAverageCost.get_wac('P0', date=date(2024, 3, 1))), 75)
+		self.assertEqual(float(WeightedAverageCost.get_wac('P0', date=date(2024, 3, 2))), 116.67)
+		self.assertIsNone(WeightedAverageCost.get_wac('P0', date=date(2024, 2, 28)))
+
+	def test_wac_at_a_store(self):
+		self.assertEqual(float(WeightedAverageCost.get_wac('P0', store=self.store)), 300)
+		self.assertEqual(float(WeightedAverageCost.get_wac('P0', store=self.other_store)), 200)
+		self.assertEqual(float(WeightedAverageCost.get_wac('P0', store=self.store, date=date(2024, 3, 2))), 100)
+		self.assertIsNone(WeightedAverageCost.get_wac('P0', store=self.other_store, date=date(2024, 3, 1)))
+
+	def test_wac_endpoint(self):
+		client = APIClient()
+		client.force_authenticate(CustomUser.objects.create(username='accountant'))
+		response = client.get('/egrn/v1/wac', {'product_id': 'P0', 'store': 'S1', 'date': '2024-03-02'})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(float(response.data['data']['results'][0]['wac']), 100)
+		self.assertEqual(client.get('/egrn/v1/wac', {'date': '02/03/2024'}).status_code, 400)
+		self.assertEqual(client.get('/egrn/v1/wac', {'store': 'S404'}).status_code, 404)
+
+
+class WeightedAverageCostRevaluationTest(PurchaseOrderTestCase):
+
+	def setUp(self):
+		super().setUp()
+		self.configuration = ProductConfiguration.objects.create(product_id='P0', metadata={"inital_quantity": 10, "initial_cost": 50})
+		self.receive(self.create_purchase_order(8001, quantities=(100, 100), unit_price=100, product_ids=['P0', 'P1']), (10, 5))
+		self.receive(self.create_purchase_order(8002, quantities=(100, 100), unit_price=200, product_ids=['P0', 'P1']), (20, 5))
+
+	def test_revalue_product(self):
+		result = valuation.revalue_product({
+			'product_id': 'P0', 'starting_quantity': 10, 'starting_cost': 500, 'ids': [1, 2], 'stores': [1, 2],
+			'dates': [None, None], 'quantities': [10, 20], 'unit_prices': [100, 200],
+		})
+		self.assertEqual((result['cumulative_quantity'], result['cumulative_cost'], result['wac']), (40, 5500, 137.5))
+		self.assertEqual(result['stores'], {1: (10, 1000, 100), 2: (20, 4000, 200)})
+		self.assertEqual([entry[7] for entry in result['entries']], [75, 137.5])
+
+	def test_changing_the_starting_values_revalues_the_ledger(self):
+		self.configuration.metadata = {"inital_quantity": 10, "initial_cost": 150}
+		self.configuration.save()
+		ledger = WeightedAverageCost.objects.get(product_id='P0')
+		self.assertEqual((float(ledger.starting_cost), float(ledger.wac)), (150, 162.5))
+		self.assertEqual(
+			list(ledger.history.order_by('grn_line_item_id').values_list('wac', flat=True)), [Decimal('125'), Decimal('162.5')]
+		)
+
+	def test_revalue_in_worker_processes_matches_the_ledger(self):
+		values = list(WeightedAverageCost.objects.order_by('product_id').values_list('product_id', 'cumulative_cost', 'wac'))
+		history = list(WeightedAverageCostEntry.objects.order_by('grn_line_item_id').values_list('grn_line_item_id', 'wac', 'store_wac'))
+		self.assertEqual(WeightedAverageCost.revalue(['P0', 'P1'], workers=2), 2)
+		self.assertEqual(list(WeightedAverageCost.objects.order_by('product_id').values_list('product_id', 'cumulative_cost', 'wac')), values)
+		self.assertEqual(list(WeightedAverageCostEntry.objects.order_by('grn_line_item_id').values_list('grn_line_item_id', 'wac', 'store_wac')), history)
+
+	def test_rebuild_wac_ledger_command(self):
+		WeightedAverageCost.objects.update(cumulative_quantity=0, cumulative_cost=0, wac=0)
+		out = StringIO()
+		call_command('rebuild_wac_ledger', product_id=['P1'], stdout=out)
+		self.assertIn('1 product(s)', out.getvalue())
+		self.assertEqual(float(WeightedAverageCost.objects.get(product_id='P1').wac), 150)
+		self.assertEqual(float(WeightedAverageCost.objects.get(product_id='P0').wac), 0)
+
+
+class KeysetPaginationTest(PurchaseOrderTestCase):
+
+	def setUp(self):
+		super().setUp()
+		self.client = APIClient()
+		self.client.force_authenticate(CustomUser.objects.create(username='auditor'))
+		purchase_order = self.create_purchase_order(9001, quantities=(100,))
+		self.grn_numbers = [self.receive(purchase_order, (1,)).grn_number for _ in range(7)][::-1]
+
+	def get_page(self, url, params=None):
+		response = self.client.get(url, params)
+		self.assertEqual(response.status_code, 200)
+		return response.data['data']
+
+	def test_cursor_round_trip(self):
+		pages, page = [], self.get_page('/egrn/v1/grns', {'size': 3, 'cursor': ''})
+		self.assertNotIn('count', page)
+		while True:
+			pages.append([grn['grn_number'] for grn in page['results']])
+			if not page['next']:
+				break
+			page = self.get_page(page['next'])
+		self.assertEqual(pages, [self.grn_numbers[0:3], self.grn_numbers[3:6], self.grn_numbers[6:]])
+
+		# and back from the last page
+		page = self.get_page(page['previous'])
+		self.assertEqual([grn['grn_number'] for grn in page['results']], self.grn_numbers[3:6])
+		page = self.get_page(page['previous'])
+		self.assertEqual([grn['grn_number'] for grn in page['results']], self.grn_numbers[0:3])
+		self.assertIsNone(page['previous'])
+
+	def test_page_number_responses_link_the_next_keyset_page(self):
+		page = self.get_page('/egrn/v1/grns', {'size': 3, 'page': 1})
+		self.assertEqual(page['count'], 7)
+		page = self.get_page(page['next_cursor'])
+		self.assertEqual([grn['grn_number'] for grn in page['results']], self.grn_numbers[3:6])
+		self.assertIsNone(self.get_page('/egrn/v1/grns', {'size': 3, 'page': 3})['next_cursor'])
+
+	def test_a_malformed_cursor_is_rejected(self):
+		response = self.client.get('/egrn/v1/grns', {'cursor': 'not-a-cursor'})
+		self.assertEqual(response.status_code, 400)
+		self.assertIn('cursor', response.data['data'])
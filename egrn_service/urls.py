@@ -4,9 +4,11 @@ from . import views
 # Create your views here.
 urlpatterns = [
 	path('vendors/search', views.search_vendor),
+	path('purchaseorders/status', views.get_purchase_orders_status),
 	path('purchaseorders/<int:po_id>', views.get_purchase_order),
 	path('purchaseorders/<int:po_id>/grns', views.get_purchase_order),
 	path('grn', views.create_grn),
+	path('grns/bulk', views.create_grns),
 	path('grn/<int:grn_number>', views.get_grn),
 	path('grns', views.get_all_grns),
 	path('wac', views.weighted_average),
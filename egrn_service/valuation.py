@@ -0,0 +1,68 @@
+import os
+from itertools import accumulate
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Number of worker processes used to revalue the WAC ledger (1 computes in-process)
+REVALUATION_WORKERS = int(os.getenv('WAC_REVALUATION_WORKERS', 1))
+
+
+def running_wac(cumulative_quantities, cumulative_costs):
+	'''
+		Returns the WAC at every point of the given running quantity and cost columns.
+	'''
+	return [
+		round(cost / quantity, 2) if quantity else 0 for quantity, cost in zip(cumulative_quantities, cumulative_costs)
+	]
+
+
+def revalue_product(product):
+	'''
+		Recomputes the running values of a product's WAC ledger from its receipts, given as columns:
+		{'product_id', 'starting_quantity', 'starting_cost' (total), 'ids', 'stores', 'dates', 'quantities', 'unit_prices'}
+		with the receipts in the order they were received. Works on plain values only, so it can run in a worker process.
+	'''
+	quantities = product['quantities']
+	costs = [quantity * unit_price for quantity, unit_price in zip(quantities, product['unit_prices'])]
+	# Running values of the product, from its starting quantity and cost
+	cumulative_quantities = list(accumulate(quantities, initial=product['starting_quantity']))[1:]
+	cumulative_costs = list(accumulate(costs, initial=product['starting_cost']))[1:]
+	wacs = running_wac(cumulative_quantities, cumulative_costs)
+
+	# Running values of every store the product was delivered to (stores carry no opening stock)
+	store_positions = {}
+	for position, store_id in enumerate(product['stores']):
+		store_positions.setdefault(store_id, []).append(position)
+	store_quantities, store_costs, store_wacs = [0] * len(quantities), [0] * len(quantities), [0] * len(quantities)
+	stores = {}
+	for store_id, positions in store_positions.items():
+		running_quantities = list(accumulate(quantities[position] for position in positions))
+		running_costs = list(accumulate(costs[position] for position in positions))
+		running_wacs = running_wac(running_quantities, running_costs)
+		for position, quantity, cost, wac in zip(positions, running_quantities, running_costs, running_wacs):
+			store_quantities[position], store_costs[position], store_wacs[position] = quantity, cost, wac
+		stores[store_id] = (running_quantities[-1], running_costs[-1], running_wacs[-1])
+
+	return {
+		'product_id': product['product_id'],
+		'cumulative_quantity': cumulative_quantities[-1] if quantities else product['starting_quantity'],
+		'cumulative_cost': cumulative_costs[-1] if quantities else product['starting_cost'],
+		'wac': wacs[-1] if quantities else 0,
+		'entries': list(zip(
+			product['ids'], product['stores'], product['dates'], quantities, costs, cumulative_quantities,
+			cumulative_costs, wacs, store_quantities, store_costs, store_wacs
+		)),
+		'stores': stores,
+	}
+
+
+def revalue_products(products, workers=None):
+	'''
+		Revalues the given products, spread across a pool of worker processes when more than one worker is requested.
+	'''
+	workers = workers or REVALUATION_WORKERS
+	if workers <= 1 or len(products) <= 1:
+		return [revalue_product(product) for product in products]
+
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		return list(executor.map(revalue_product, products, chunksize=max(1, len(products) // (workers * 4))))
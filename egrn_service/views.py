@@ -1,43 +1,72 @@
 # Import necessary modules and classes
 import os, sys
+import json
 import logging
-from rest_framework import status
+from datetime import datetime
+from rest_framework import serializers, status
 from rest_framework.decorators import api_view, authentication_classes
 from django_auth_adfs.rest_framework import AdfsAccessTokenAuthentication
 from overrides.authenticate import CombinedAuthentication
 from overrides.rest_framework import CustomPagination
-from byd_service.rest import RESTServices
+from byd_service.rest import RESTServices, AsyncRESTServices
 from django.contrib.auth import get_user_model
-from overrides.rest_framework import APIResponse
+from overrides.rest_framework import APIResponse, as_django_response, initialize_async
+from core_service.helpers import async_client_scope, is_asgi_request
+from asgiref.sync import sync_to_async
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django_q.tasks import async_task
 
-from .models import GoodsReceivedNote, GoodsReceivedLineItem, PurchaseOrder, PurchaseOrderLineItem, ProductConfiguration
-from .serializers import GoodsReceivedNoteSerializer, GoodsReceivedLineItemSerializer, PurchaseOrderSerializer
+from .models import GoodsReceivedNote, GoodsReceivedLineItem, PurchaseOrder, PurchaseOrderLineItem, ProductConfiguration, \
+	WeightedAverageCost, Store
+from .serializers import GoodsReceivedNoteSerializer, GoodsReceivedLineItemSerializer, PurchaseOrderSerializer, \
+	WeightedAverageCostSerializer
 
 
 # Initialize REST services
 byd_rest_services = RESTServices()
+async_byd_rest_services = AsyncRESTServices()
 # Get the user model
 User = get_user_model()
-# Pagination
-paginator = CustomPagination()
 
 
-def delete_items(po):
-	del po["Item"]
-	return po
+async def filter_objects(keys_to_keep, objects):
+	# Use dictionary comprehension to filter objects, lazily, so that the objects can be streamed
+	async for obj in objects:
+		yield {key: obj[key] for key in keys_to_keep if key in obj}
 
-def filter_objects(keys_to_keep, objects):
-	filtered_objects = []
-	# Use dictionary comprehension to filter objects
-	for obj in objects:
-		filtered_obj = {key: obj[key] for key in keys_to_keep if key in obj}
-		filtered_objects.append(filtered_obj)
-	
-	return filtered_objects
+def get_missing_grn_keys(grn_data, required_keys):
+	# Check that all the required keys are present in the GRN data
+	required_keys_present = [
+		any(
+			map(lambda x: r in x, list(grn_data.keys()))
+		) for r in required_keys
+	]
+	return [] if all(required_keys_present) else required_keys
+
+async def stream_vendor_search(vendor, purchase_orders):
+	'''
+		Yields the search_vendor response (in the APIResponse format) a chunk at a time, one purchase order per chunk, from
+		an async iterator of purchase orders.
+	'''
+	yield '{"message": "Vendor found.", "data": {"BusinessPartner": ' + json.dumps(vendor) + ', "PurchaseOrders": ['
+	status_text = "success"
+	try:
+		index = 0
+		async for purchase_order in purchase_orders:
+			yield (', ' if index else '') + json.dumps(purchase_order)
+			index += 1
+	except Exception as e:
+		# The response has already started, so end it as a failed (but well-formed) response
+		logging.error(f"Error streaming the purchase orders of vendor {vendor['InternalID']}: {e}")
+		status_text = "failed"
+	yield ']}, "status": "' + status_text + '"}'
 
-def get_formatted_vendor(id, id_type):
-	data = byd_rest_services.get_vendor_by_id(id, id_type=id_type)
+async def get_formatted_vendor(id, id_type):
+	data = await async_byd_rest_services.get_vendor_by_id(id, id_type=id_type)
+	if not data:
+		return None
 	vendor = {
 		"InternalID": data["BusinessPartner"]["InternalID"],
 		"CategoryCode": data["BusinessPartner"]["CategoryCode"],
@@ -48,62 +77,131 @@ def get_formatted_vendor(id, id_type):
 	return vendor
 
 
-@api_view(['GET'])
-@authentication_classes([AdfsAccessTokenAuthentication,])
-def search_vendor(request, ):
-	params = dict(request.GET)
+async def search_vendor(request, ):
+	# An async (plain Django) view, as DRF views can not be async: the DRF checks of an API view are done here
+	user, error_response = await initialize_async(request, ['GET'], [AdfsAccessTokenAuthentication])
+	if error_response:
+		return error_response
+	
+	# The vendor is searched for by email, or else by phone
+	id_type = 'email' if request.GET.get('email') else 'phone'
+	vendor_id = request.GET.get(id_type)
+	if not vendor_id:
+		return as_django_response(
+			APIResponse("Missing required query parameter 'email' or 'phone'.", status.HTTP_400_BAD_REQUEST)
+		)
 	try:
-		query_param = ('email', params['email'][0]) if params['email'] else ('phone', params['phone'][0])
-		# Fetch purchase orders for the authenticated user
-		vendor = get_formatted_vendor(query_param[1], query_param[1])
-		# Data object to hold the return data
-		data = {}
-		
-		if vendor:
-			keys_to_keep = ["ObjectID", "UUID", "ID", "CreationDateTime", "LastChangeDateTime", "CurrencyCode",
-							"CurrencyCodeText", "TotalGrossAmount", "TotalNetAmount", "TotalTaxAmount",
-							"ConsistencyStatusCode",
-							"LifeCycleStatusCode", "AcknowledgmentStatusCode", "AcknowledgmentStatusCodeText",
-							"DeliveryStatusCode", "DeliveryStatusCodeText", "InvoicingStatusCode",
-							"InvoicingStatusCodeText"]
+		async with async_client_scope(request):
+			# The purchase orders are looked up by the vendor's InternalID, so the vendor has to be fetched first
+			vendor = await get_formatted_vendor(vendor_id, id_type)
+			if vendor:
+				keys_to_keep = ["ObjectID", "UUID", "ID", "CreationDateTime", "LastChangeDateTime", "CurrencyCode",
+								"CurrencyCodeText", "TotalGrossAmount", "TotalNetAmount", "TotalTaxAmount",
+								"ConsistencyStatusCode",
+								"LifeCycleStatusCode", "AcknowledgmentStatusCode", "AcknowledgmentStatusCodeText",
+								"DeliveryStatusCode", "DeliveryStatusCodeText", "InvoicingStatusCode",
+								"InvoicingStatusCodeText"]
+				
+				# Page through the vendor's purchase orders, with only the properties we return
+				action_url = async_byd_rest_services.get_vendor_purchase_orders_url(vendor["InternalID"], select=keys_to_keep)
+				# Fetch the first page before the response starts, so that a failure to reach ByD is still an error response
+				first_page = await async_byd_rest_services.get_first_page(action_url)
+				purchase_orders = filter_objects(
+					keys_to_keep, async_byd_rest_services.iter_collection(action_url, first_page=first_page)
+				)
+				if is_asgi_request(request):
+					# Stream the purchase orders as the rest of the pages are fetched
+					return StreamingHttpResponse(stream_vendor_search(vendor, purchase_orders), status=status.HTTP_200_OK,
+					                             content_type='application/json')
+				# Under WSGI Django buffers a response streamed from an async iterator in full, so collect the pages
+				# (still fetched concurrently) and return them in one response
+				return as_django_response(APIResponse("Vendor found.", status.HTTP_200_OK, data={
+					"BusinessPartner": vendor,
+					"PurchaseOrders": [purchase_order async for purchase_order in purchase_orders],
+				}))
 			
-			purchase_orders = byd_rest_services.get_vendor_purchase_orders(vendor["InternalID"])
-			purchase_orders = filter_objects(keys_to_keep, list(map(delete_items, purchase_orders)))
-			
-			data["BusinessPartner"] = vendor
-			data["PurchaseOrders"] = purchase_orders
-			
-			return APIResponse("Vendor found.", status.HTTP_200_OK, data=data)
-		
-		return APIResponse(f"No vendor results found for {query_param[1]} {query_param[1]}.", status.HTTP_404_NOT_FOUND)
+			return as_django_response(
+				APIResponse(f"No vendor results found for {id_type} {vendor_id}.", status.HTTP_404_NOT_FOUND)
+			)
 	except Exception as e:
 		logging.error(e)
-		return APIResponse("Internal Error.", status.HTTP_500_INTERNAL_SERVER_ERROR)
+		return as_django_response(APIResponse("Internal Error.", status.HTTP_500_INTERNAL_SERVER_ERROR))
 
 
-@api_view(['GET'])
-@authentication_classes([CombinedAuthentication])
-def get_purchase_order(request, po_id):
+@sync_to_async
+def get_stored_purchase_order(po_id):
+	# Returns the serialized purchase order from the database, or None
 	try:
-		try:
-			# Fetch purchase orders from the database
-			orders = PurchaseOrder.objects.get(po_id=po_id)
-		except ObjectDoesNotExist:
+		return PurchaseOrderSerializer(
+			PurchaseOrderSerializer.setup_eager_loading(PurchaseOrder.objects.all()).get(po_id=po_id)
+		).data
+	except ObjectDoesNotExist:
+		return None
+
+
+@sync_to_async
+def create_purchase_order(byd_orders):
+	# Creates a new PurchaseOrder object from the ByD order and returns it serialized
+	return PurchaseOrderSerializer(PurchaseOrder().create_purchase_order(byd_orders)).data
+
+
+async def get_purchase_order(request, po_id):
+	# An async (plain Django) view, as DRF views can not be async: the DRF checks of an API view are done here
+	user, error_response = await initialize_async(request, ['GET'], [CombinedAuthentication])
+	if error_response:
+		return error_response
+	
+	try:
+		# Fetch purchase orders from the database
+		data = await get_stored_purchase_order(po_id)
+		if data is None:
 			# If the order does not exist in the database, fetch the order from ByD
-			byd_orders = byd_rest_services.get_purchase_order_by_id(po_id)
+			async with async_client_scope(request):
+				byd_orders = await async_byd_rest_services.get_purchase_order_by_id(po_id)
 			if byd_orders:
 				# If the order exists in ByD, create a new PurchaseOrder object
-				po = PurchaseOrder()
-				orders = po.create_purchase_order(byd_orders)
+				data = await create_purchase_order(byd_orders)
 			else:
 				# If the order does not exist in ByD, return an error
-				return APIResponse(f"Order with ID {po_id} not found.", status.HTTP_404_NOT_FOUND)
-		# Serialize the PurchaseOrder object
-		serializer = PurchaseOrderSerializer(orders)
-		return APIResponse("Purchase Orders Retrieved", status.HTTP_200_OK, data=serializer.data)
+				return as_django_response(APIResponse(f"Order with ID {po_id} not found.", status.HTTP_404_NOT_FOUND))
+		return as_django_response(APIResponse("Purchase Orders Retrieved", status.HTTP_200_OK, data=data))
 	except Exception as e:
 		# Handle any other errors
 		logging.error(f"An error occurred creating a Purchase Order: {e}")
+		return as_django_response(APIResponse(f"Internal Error: {e}", status.HTTP_500_INTERNAL_SERVER_ERROR))
+
+
+@api_view(['GET'])
+@authentication_classes([CombinedAuthentication])
+def get_purchase_orders_status(request):
+	'''
+		Get the delivery status of many purchase orders at once, given a comma separated list of PO IDs in the "po_id"
+		query parameter, e.g. ?po_id=1001,1002,1003
+	'''
+	try:
+		po_ids = [po_id.strip() for po_id in request.query_params.get('po_id', '').split(',') if po_id.strip()]
+		if not po_ids:
+			return APIResponse("Missing required query parameter 'po_id'.", status.HTTP_400_BAD_REQUEST)
+		if not all(po_id.isdigit() for po_id in po_ids):
+			return APIResponse("The 'po_id' query parameter must be a comma separated list of PO IDs.", status.HTTP_400_BAD_REQUEST)
+		# Compute the delivery status of all the requested purchase orders in a single query
+		orders = PurchaseOrder.objects.filter(po_id__in=po_ids).with_delivery_status()
+		statuses = {}
+		for order in orders.values('po_id', 'annotated_delivery_status'):
+			status_code = order['annotated_delivery_status']
+			statuses[order['po_id']] = {
+				"po_id": order['po_id'],
+				"delivery_status_code": status_code,
+				"delivery_status_text": dict(PurchaseOrder.delivery_status_code).get(status_code),
+				"delivery_completed": status_code == '3',
+			}
+		data = {
+			"purchase_orders": list(statuses.values()),
+			"not_found": [int(po_id) for po_id in po_ids if int(po_id) not in statuses],
+		}
+		return APIResponse("Purchase Order Statuses Retrieved", status.HTTP_200_OK, data=data)
+	except Exception as e:
+		logging.error(f"An error occurred retrieving Purchase Order statuses: {e}")
 		return APIResponse(f"Internal Error: {e}", status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 	
@@ -115,14 +213,8 @@ def create_grn(request, ):
 	required_keys = [identifier, "recievedGoods"]
 	# the post request
 	request_data = request.data
-	# Check that all the required keys are present in the request
-	required_keys_present = [
-		any(
-			map(lambda x: r in x, list(request_data.keys()))
-		) for r in required_keys
-	]
 	# If required keys are not present, return an error
-	if not all(required_keys_present):
+	if get_missing_grn_keys(request_data, required_keys):
 		return APIResponse(f"Missing required key(s) [{', '.join(required_keys)}]", status.HTTP_400_BAD_REQUEST)
 	# Make the PO_ID key consistent as the identifier
 	request_data["po_id"] = request_data[identifier]
@@ -137,19 +229,90 @@ def create_grn(request, ):
 		return APIResponse(str(e), status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@authentication_classes([AdfsAccessTokenAuthentication,])
+def create_grns(request, ):
+	'''
+		Create many GRNs in one request (e.g. several POs received from the same truck). Takes a list of GRN payloads,
+		each in the format accepted by create_grn, creates each GRN in its own transaction and returns a result per GRN.
+	'''
+	identifier = "PONumber"  # should be PO_ID
+	# keys we NEED to create a GRN
+	required_keys = [identifier, "recievedGoods"]
+	request_data = request.data
+	if not isinstance(request_data, list) or not request_data:
+		return APIResponse("Expected a list of GRNs.", status.HTTP_400_BAD_REQUEST)
+	# Look up all the purchase orders being received in one query
+	po_ids = [grn_data.get(identifier) for grn_data in request_data if isinstance(grn_data, dict)]
+	purchase_orders = {str(po.po_id): po for po in PurchaseOrder.objects.filter(po_id__in=[i for i in po_ids if str(i).isdigit()])}
+	# and fetch the ones that are not in the database yet from ByD in one batch
+	missing_po_ids = {str(i) for i in po_ids} - set(purchase_orders)
+	fetch_error = None
+	try:
+		purchase_orders.update(PurchaseOrder.fetch_missing(missing_po_ids))
+	except Exception as e:
+		# Fail only the GRNs of the purchase orders that could not be looked up
+		logging.error(f"Error fetching purchase orders {', '.join(sorted(missing_po_ids))}: {e}")
+		fetch_error = f"Error fetching the purchase order: {e}"
+	
+	results = []
+	created_grns = []
+	for grn_data in request_data:
+		po_id = grn_data.get(identifier) if isinstance(grn_data, dict) else None
+		if not isinstance(grn_data, dict) or get_missing_grn_keys(grn_data, required_keys):
+			results.append({"po_id": po_id, "created": False, "error": f"Missing required key(s) [{', '.join(required_keys)}]"})
+			continue
+		if fetch_error and str(po_id) in missing_po_ids:
+			results.append({"po_id": po_id, "created": False, "error": fetch_error})
+			continue
+		# Make the PO_ID key consistent as the identifier
+		grn_data["po_id"] = po_id
+		try:
+			# Create the GRN (and its line items) in its own transaction
+			with transaction.atomic():
+				created_grn = GoodsReceivedNote().save(grn_data=grn_data, purchase_order=purchase_orders.get(str(po_id)),
+				                                        enqueue_tasks=False)
+			purchase_orders[str(po_id)] = created_grn.purchase_order
+			created_grns.append(created_grn)
+			results.append({"po_id": po_id, "created": True, "grn_number": created_grn.grn_number})
+		except Exception as e:
+			results.append({"po_id": po_id, "created": False, "error": str(e)})
+	
+	if created_grns:
+		# Enqueue the ICG and email tasks once for the whole batch
+		batch_name = f'{len(created_grns)}-GRNs-From-{created_grns[0].grn_number}'
+		async_task('vimp.tasks.post_grns_to_icg', created_grns, q_options={
+			'task_name': f'Post-{batch_name}-To-ICG-Inventory',
+		})
+		async_task('vimp.tasks.send_grns_to_email', created_grns, q_options={
+			'task_name': f'Email-{batch_name}-To-Vendor',
+		})
+		# Serialize the created GRNs
+		grns = GoodsReceivedNoteSerializer.setup_eager_loading(GoodsReceivedNote.objects.filter(id__in=[grn.id for grn in created_grns]))
+		serialized = {grn['grn_number']: grn for grn in GoodsReceivedNoteSerializer(grns, many=True).data}
+		for result in results:
+			result["grn"] = serialized.get(result.get("grn_number")) if result["created"] else None
+		return APIResponse("GRNs Created.", status.HTTP_201_CREATED, data=results)
+	
+	return APIResponse("Failed to create GRNs.", status.HTTP_400_BAD_REQUEST, data=results)
+
+
 @api_view(['GET'])
 @authentication_classes([CombinedAuthentication])
 def get_all_grns(request, ):
 	try:
 		# Get all GRNs sorted by creation date in descending order
-		grns = GoodsReceivedNote.objects.all()#.order_by('-created')
-		# Paginate the results
-		paginated = paginator.paginate_queryset(grns, request, order_by='-id')
+		grns = GoodsReceivedNoteSerializer.setup_eager_loading(GoodsReceivedNote.objects.all())#.order_by('-created')
+		# Paginate the results (by keyset when a cursor is passed), with a paginator per request as it holds the page state
+		paginator = CustomPagination()
+		paginated = paginator.paginate_queryset(grns, request, order_by='-id', keyset=('-id',))
 		# Serialize the GoodsReceivedNote instance along with its related GoodsReceivedLineItem instances
 		grn_serializer = GoodsReceivedNoteSerializer(paginated, many=True, context={'request':request})
 		# Return the paginated response with the serialized GoodsReceivedNote instances
 		paginated_data = paginator.get_paginated_response(grn_serializer.data).data
 		return APIResponse("GRNs Retrieved", status.HTTP_200_OK, data=paginated_data)
+	except serializers.ValidationError as e:
+		return APIResponse("Invalid pagination parameters.", status.HTTP_400_BAD_REQUEST, data=e.detail)
 	except Exception as e:
 		return APIResponse(f"Internal Error: {e}", status.HTTP_500_INTERNAL_SERVER_ERROR)
 	
@@ -165,15 +328,19 @@ def get_vendors_grns(request, ):
 		grns = GoodsReceivedNote.objects.filter(purchase_order__vendor=request.user.vendor_profile)
 		# If the request params contain po_id, filter by po_id
 		grns = grns.filter(purchase_order__po_id=po_id) if po_id else grns
-		if grns:
-			# Paginate the results
-			paginated = paginator.paginate_queryset(grns, request, order_by='-id')
+		if grns.exists():
+			grns = GoodsReceivedNoteSerializer.setup_eager_loading(grns)
+			# Paginate the results (by keyset when a cursor is passed), with a paginator per request as it holds the page state
+			paginator = CustomPagination()
+			paginated = paginator.paginate_queryset(grns, request, order_by='-id', keyset=('-id',))
 			# Serialize the GoodsReceivedNote instance along with its related GoodsReceivedLineItem instances
 			grn_serializer = GoodsReceivedNoteSerializer(paginated, many=True, context={'request':request})
 			# Return the paginated response with the serialized GoodsReceivedNote instances
 			paginated_data = paginator.get_paginated_response(grn_serializer.data).data
 			return APIResponse("GRNs Retrieved", status.HTTP_200_OK, data=paginated_data)
 		return APIResponse(f"No GRN found.", status=status.HTTP_404_NOT_FOUND)
+	except serializers.ValidationError as e:
+		return APIResponse("Invalid pagination parameters.", status.HTTP_400_BAD_REQUEST, data=e.detail)
 	except Exception as e:
 		return APIResponse(f"Internal Error: {e}", status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -182,7 +349,7 @@ def get_vendors_grns(request, ):
 @authentication_classes([CombinedAuthentication])
 def get_grn(request, grn_number):
 	try:
-		grn = GoodsReceivedNote.objects.get(grn_number=grn_number)
+		grn = GoodsReceivedNoteSerializer.setup_eager_loading(GoodsReceivedNote.objects.all()).get(grn_number=grn_number)
 		if grn:
 			# Serialize the GoodsReceivedNote instance along with its related GoodsReceivedLineItem instances
 			grn_serializer = GoodsReceivedNoteSerializer(grn)
@@ -199,78 +366,38 @@ def get_grn(request, grn_number):
 def weighted_average(request):
 	'''
 		Get the weighted average cost for all products or for a specific product, with a history of purchases.
+		The values are read from the WAC ledger, which is kept up to date as goods are received. The WAC at a store
+		(?store=<cost center code>) and/or as at the end of a past date (?date=YYYY-MM-DD) can also be requested.
 	'''
-	def calculate_wac(product_line_items, cumulative_quantity, cumulative_cost):
-		# Dictionary to store results grouped by product_id
-		product_data = {
-			"product_id": product_line_items[0].purchase_order_line_item.product_id,
-			"product_name": product_line_items[0].purchase_order_line_item.product_name,
-			"starting_quantity": cumulative_quantity,
-			"starting_cost": cumulative_cost / cumulative_quantity if cumulative_quantity > 0 else 0,
-			"cumulative_quantity": cumulative_quantity,
-			"cumulative_cost": cumulative_cost,
-			"wac": 0,
-			"history": [],
-		}
-
-		for line_item in product_line_items:
-			purchase_quantity = line_item.quantity_received
-			purchase_cost = purchase_quantity * line_item.purchase_order_line_item.unit_price
-			
-			cumulative_quantity = product_data["cumulative_quantity"]
-			cumulative_cost = product_data["cumulative_cost"]
-
-			# Update cumulative values with new purchase
-			cumulative_quantity += purchase_quantity
-			cumulative_cost += purchase_cost
-
-			# Calculate new WAC for the product
-			new_wac = cumulative_cost / cumulative_quantity
-
-			# Update product's current data
-			product_data.update({
-				"cumulative_quantity": cumulative_quantity,
-				"cumulative_cost": cumulative_cost,
-				"wac": round(new_wac, 2),
-			})
-
-			# Add history entry
-			product_data["history"].append({
-				"date": line_item.date_received,
-				"store": line_item.purchase_order_line_item.delivery_store.store_name,
-				"purchase_quantity": purchase_quantity,
-				"purchase_price_per_unit": purchase_cost / purchase_quantity,
-				"purchase_cost": purchase_cost,
-				"cumulative_quantity": cumulative_quantity,
-				"cumulative_cost": cumulative_cost,
-				"wac": round(new_wac, 2),
-				"grn": GoodsReceivedLineItemSerializer(line_item).data,
-			})
-
-		# Convert defaultdict to a regular dict before returning
-		return product_data
-	
-	products_wac = []
-	
 	try:
+		ledgers = WeightedAverageCost.objects.all()
 		if request.query_params.get('product_id'):
-			products = map(lambda x: x.strip(), request.query_params.get('product_id').split(','))
-		else:
-			products = GoodsReceivedLineItem.objects.order_by('purchase_order_line_item__product_id').values_list('purchase_order_line_item__product_id', flat=True).distinct()
-			
-		for product_id in products:
-			product_config = ProductConfiguration.objects.filter(product_id=product_id).first()
-			cumulative_quantity, cumulative_cost = 0, 0
-			if hasattr(product_config, 'metadata') and product_config.metadata:
-				cumulative_quantity = product_config.metadata.get('inital_quantity', 0)
-				cumulative_cost = product_config.metadata.get('initial_cost', 0) * cumulative_quantity
-	
-			orders_for_product = GoodsReceivedLineItem.objects.filter(purchase_order_line_item__product_id=product_id).order_by('date_received')
-			products_wac.append(calculate_wac(orders_for_product, cumulative_quantity, cumulative_cost)) if orders_for_product else None
-			
-		# # Paginate the results
-		paginated = paginator.paginate_queryset(products_wac, request)
-		paginated_data = paginator.get_paginated_response(paginated).data
+			products = [product_id.strip() for product_id in request.query_params.get('product_id').split(',')]
+			ledgers = ledgers.filter(product_id__in=products)
+		
+		date, store = None, None
+		if request.query_params.get('date'):
+			try:
+				date = datetime.strptime(request.query_params.get('date'), '%Y-%m-%d').date()
+			except ValueError:
+				return APIResponse("Invalid date, expected the format YYYY-MM-DD", status.HTTP_400_BAD_REQUEST)
+		if request.query_params.get('store'):
+			store = Store.objects.filter(byd_cost_center_code=request.query_params.get('store')).first()
+			if not store:
+				return APIResponse("Store not found", status.HTTP_404_NOT_FOUND)
+		if date or store:
+			ledgers = ledgers.as_of(date=date, store=store)
+		
+		# Paginate the ledgers in the database; the history is only loaded for the products on the page
+		# (with a paginator per request, as it holds the page state)
+		paginator = CustomPagination()
+		paginated = paginator.paginate_queryset(
+			WeightedAverageCostSerializer.setup_eager_loading(ledgers, date=date, store=store), request, order_by='product_id'
+		)
+		serializer = WeightedAverageCostSerializer(paginated, many=True)
+		paginated_data = paginator.get_paginated_response(serializer.data).data
 		return APIResponse("Weighted Averages Calculated", status.HTTP_200_OK, data=paginated_data)
+	except serializers.ValidationError as e:
+		return APIResponse("Invalid pagination parameters.", status.HTTP_400_BAD_REQUEST, data=e.detail)
 	except Exception as e:
 		return APIResponse(f"Internal Error: {e}", status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
@@ -24,4 +24,23 @@ def JWTAuth(username=os.getenv('ICG_USER'), password=os.getenv('ICG_PASS')):
 	response = post(url, data=data, headers=headers)
 	if response.status_code == 200:
 		return response.json()['access_token']
-	return None
\ No newline at end of file
+	return None
+
+async def AsyncJWTAuth(username=os.getenv('ICG_USER'), password=os.getenv('ICG_PASS')):
+	'''
+		Async variant of JWTAuth, over the ICG client shared on the running event loop
+	'''
+	from core_service.helpers import get_async_client
+	url = f'{base_url}/token'
+	headers = {
+        'Content-Type': 'application/x-www-form-urlencoded'
+    }
+	data = {
+		'username': username,
+		'password': password,
+		'grant_type': 'password'
+	}
+	response = await get_async_client('icg').post(url, data=data, headers=headers)
+	if response.status_code == 200:
+		return response.json()['access_token']
+	return None
@@ -48,4 +48,42 @@ class StockManagement:
 			logging.error(f"An error occurred while creating the purchase order: {e}")
 			return False
 		# If the request is successful, return True
-		return True
\ No newline at end of file
+		return True
+
+
+class AsyncStockManagement(StockManagement):
+	'''
+		Asyncio variant of StockManagement, over the ICG client shared on the running event loop.
+		Create instances with `await AsyncStockManagement.create()`, which authenticates without blocking the loop.
+	'''
+	def __init__(self, auth_token=None):
+		self.auth_token = auth_token
+		self.auth_headers = {
+			'Authorization': f'Bearer {self.auth_token}',
+			'Content-Type': 'application/json'
+		}
+	
+	@classmethod
+	async def create(cls):
+		from icg_service.authenticate import AsyncJWTAuth
+		return cls(await AsyncJWTAuth())
+	
+	async def create_purchase_order(self, order_details: object, order_items: list) -> bool:
+		'''
+			Async variant of StockManagement.create_purchase_order.
+			Returns: True if the purchase order request is successful, False otherwise.
+		'''
+		from core_service.helpers import get_async_client
+		create_po_endpoint = f'{self.api_url}/PurchaseOrder'
+		po_data = {
+			"order": order_details,
+			"itemDetails": order_items
+		}
+		try:
+			response = await get_async_client('icg').post(create_po_endpoint, json=po_data, headers=self.auth_headers)
+			if response.status_code != 200:
+				raise Exception(f"The purchase order request failed with status code {response.status_code}")
+		except Exception as e:
+			logging.error(f"An error occurred while creating the purchase order: {e}")
+			return False
+		return True
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 02:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice_service', '0011_alter_invoice_options'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['date_created', 'id'], name='invoice_ser_date_cr_5f92ae_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2 on 2026-10-18 02:47
+
+from django.db import migrations, models
+
+
+def backfill_workflow_state(apps, schema_editor):
+    Invoice = apps.get_model('invoice_service', 'Invoice')
+    Signature = apps.get_model('approval_service', 'Signature')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    content_type = ContentType.objects.filter(app_label='invoice_service', model='invoice').first()
+    if not content_type:
+        return
+    # The number of signatures and the verdict of the last signature of every invoice
+    state = {}
+    for signable_id, accepted in Signature.objects.filter(signable_type=content_type).order_by('id').values_list('signable_id', 'accepted'):
+        count, _ = state.get(signable_id, (0, None))
+        state[signable_id] = (count + 1, accepted)
+    invoices = []
+    for invoice in Invoice.objects.only('id', 'signatories').iterator():
+        invoice.signature_count, invoice.last_verdict = state.get(invoice.id, (0, None))
+        invoice.rejected = invoice.last_verdict is False
+        invoice.completed = invoice.rejected or invoice.signature_count == len(invoice.signatories or [])
+        invoices.append(invoice)
+    Invoice.objects.bulk_update(invoices, ['signature_count', 'last_verdict', 'completed', 'rejected'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('approval_service', '0005_signature_approval_se_signabl_40c8f7_idx'),
+        ('invoice_service', '0012_invoice_invoice_ser_date_cr_5f92ae_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='completed',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='last_verdict',
+            field=models.BooleanField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='rejected',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='signature_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_workflow_state, migrations.RunPython.noop),
+    ]
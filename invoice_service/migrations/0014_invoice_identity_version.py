@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 02:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice_service', '0013_invoice_workflow_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='identity_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-18 02:52
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+
+
+def backfill_invoice_totals(apps, schema_editor):
+    Invoice = apps.get_model('invoice_service', 'Invoice')
+    InvoiceLineItem = apps.get_model('invoice_service', 'InvoiceLineItem')
+    totals = {
+        field: Subquery(
+            InvoiceLineItem.objects.filter(invoice=OuterRef('pk')).order_by().values('invoice').annotate(
+                total=Sum(line_item_field)
+            ).values('total')
+        ) for field, line_item_field in (('gross_total', 'gross_total'), ('total_tax_amount', 'tax_amount'), ('net_total', 'net_total'))
+    }
+    Invoice.objects.update(**totals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice_service', '0014_invoice_identity_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='gross_total',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='net_total',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='total_tax_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True),
+        ),
+        migrations.RunPython(backfill_invoice_totals, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,11 @@
+from decimal import Decimal
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Sum
+from django.db import models, transaction
+from django.db.models import Sum, F, Prefetch, OuterRef, Subquery, prefetch_related_objects
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from egrn_service.models import PurchaseOrder, PurchaseOrderLineItem, GoodsReceivedLineItem, GoodsReceivedNote
+from egrn_service.cache import surcharge_index
 from approval_service.models import Signable, Workflow
 
 
@@ -66,29 +70,47 @@ class Invoice(Signable):
 	payment_terms = models.CharField(max_length=255, blank=True, null=True)
 	payment_reason = models.CharField(max_length=255, blank=True, null=True)
 	date_created = models.DateTimeField(auto_now_add=True)
+	# Incremented whenever a line item of the invoice changes, to key the cached hash verification of the invoice
+	identity_version = models.PositiveIntegerField(default=0)
+	# The totals of the invoice line items, kept up to date by Invoice.update_totals() whenever a line item is saved or
+	# deleted. They are null while the invoice has no line items, as the sums they replace were.
+	gross_total = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
+	total_tax_amount = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
+	net_total = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
 	
-	# Computed property gross_total that returns the sum of the gross total of the invoice line items
-	@property
-	def gross_total(self):
-		return self.invoice_line_items.aggregate(gross_total=Sum('gross_total'))['gross_total']
+	# The stored totals and the line item fields they sum
+	total_fields = {
+		'gross_total': 'gross_total',
+		'total_tax_amount': 'tax_amount',
+		'net_total': 'net_total',
+	}
 	
 	@property
 	def total_discount_amount(self):
-		return self.invoice_line_items.aggregate(discount=Sum('discount_amount'))['discount']
+		# Discounts are no longer recorded on the invoice line items
+		return Decimal(0)
 	
 	@property
 	def discounted_gross_total(self):
 		return self.gross_total - self.total_discount_amount
 	
-	@property
-	def total_tax_amount(self):
-		return self.invoice_line_items.aggregate(tax=Sum('tax_amount'))['tax']
-	
-	@property
-	def net_total(self):
-		return self.invoice_line_items.aggregate(net_total=Sum('net_total'))['net_total']
+	@classmethod
+	def update_totals(cls, invoice_ids):
+		'''
+			Recomputes the stored totals of the given invoices from their line items in a single UPDATE, and bumps their
+			identity version, since the line items and totals are part of the sealed identity of an invoice.
+		'''
+		totals = {
+			field: Subquery(
+				InvoiceLineItem.objects.filter(invoice=OuterRef('pk')).order_by().values('invoice').annotate(
+					total=Sum(line_item_field)
+				).values('total')
+			) for field, line_item_field in cls.total_fields.items()
+		}
+		return cls.objects.filter(pk__in=invoice_ids).update(**totals, identity_version=F('identity_version') + 1)
 	
 	class Meta:
+		indexes = [models.Index(fields=['date_created', 'id'])]
 		permissions = [
 			('accounts_payable', 'The accounts payable role.'),
 			('line_manager', 'The line manager role.'),
@@ -108,6 +130,20 @@ class Invoice(Signable):
 		return [[(lambda x, y: getattr(x, y))(line_item, field.name) for field in line_item_fields] for line_item in
 				self.invoice_line_items.all()]
 	
+	def get_identity_version(self):
+		return self.identity_version
+	
+	@staticmethod
+	def get_identity_prefetch():
+		# The line items, with the records they reference in the identity data
+		return Prefetch('invoice_line_items', queryset=InvoiceLineItem.objects.select_related(
+			'po_line_item', 'grn_line_item__purchase_order_line_item'
+		).order_by('pk'))
+	
+	@classmethod
+	def prefetch_identity(cls, queryset):
+		return queryset.prefetch_related(cls.get_identity_prefetch())
+	
 	def set_identity(self):
 		invoice_values = {
 			'id': self.id,
@@ -137,7 +173,49 @@ class Invoice(Signable):
 		self.signatories = list(workflow.get_signatories())
 		self.current_pending_signatory = self.signatories[0] if self.signatories else None
 	
+	def create_line_items(self, line_items):
+		'''
+			Creates the invoice line items in a single batch: the referenced GRN line items are loaded with the quantity
+			already invoiced against them in one query, every line is validated and the line items are written with
+			bulk_create, all inside one transaction. Raises an ObjectDoesNotExist or ValidationError for an invalid line.
+		'''
+		if not line_items:
+			raise ValidationError("An invoice must have at least one line item.")
+		with transaction.atomic():
+			grn_line_item_ids = [str(line_item.get('grn_line_item_id')) for line_item in line_items]
+			# Load the GRN line items being invoiced (only from the GRN of this invoice) and the quantity invoiced so far
+			grn_line_items = {
+				str(item.id): item for item in GoodsReceivedLineItem.objects.with_invoiced_quantity().select_related(
+					'purchase_order_line_item'
+				).filter(grn=self.grn_id, id__in=[i for i in grn_line_item_ids if i.isdigit()])
+			}
+			
+			invoice_line_items = []
+			invoiced_quantity = {}
+			for grn_line_item_id in grn_line_item_ids:
+				grn_line_item = grn_line_items.get(grn_line_item_id)
+				if not grn_line_item:
+					raise GoodsReceivedLineItem.DoesNotExist(f"A GRN Line Item with ID {grn_line_item_id} was not found for this GRN.")
+				invoice_line_item = InvoiceLineItem(
+					invoice=self, grn_line_item=grn_line_item, po_line_item=grn_line_item.purchase_order_line_item
+				)
+				invoice_line_item.set_calculated_values()
+				invoiced = invoiced_quantity.get(grn_line_item.id, grn_line_item.annotated_invoiced_quantity)
+				invoice_line_item.clean(invoiced_quantity=invoiced)
+				# Account for the same GRN line item being invoiced more than once in this invoice
+				invoiced_quantity[grn_line_item.id] = float(invoiced) + float(invoice_line_item.quantity)
+				invoice_line_items.append(invoice_line_item)
+			
+			InvoiceLineItem.objects.bulk_create(invoice_line_items)
+			# bulk_create does not send post_save signals, so update the totals of the invoice here
+			Invoice.update_totals([self.id])
+		return invoice_line_items
+	
 	def seal_class(self, ):
+		# The line items were saved through other instances, load the totals they updated and the line items themselves
+		self.refresh_from_db(fields=[*self.total_fields, 'identity_version'])
+		getattr(self, '_prefetched_objects_cache', {}).pop('invoice_line_items', None)
+		prefetch_related_objects([self], self.get_identity_prefetch())
 		# Set the signatories based on the workflow
 		self.set_signatories()
 		# Set the identity data
@@ -162,7 +240,7 @@ class InvoiceLineItem(models.Model):
 	tax_amount = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
 	
 	def calculate_tax_amount(self, ):
-		tax_rates = sum([rate['rate'] for rate in self.po_line_item.tax_rates])
+		tax_rates = surcharge_index.total_rate(self.po_line_item.tax_rates)
 		tax_amount = self.calculate_net_total() * (tax_rates / 100)
 		return round(tax_amount, 3)
 	
@@ -181,28 +259,40 @@ class InvoiceLineItem(models.Model):
 		invoiced_quantity = invoiced_quantity or 0.00
 		return float(invoiced_quantity)
 	
-	def get_invoiceable_quantity(self):
+	def get_invoiceable_quantity(self, invoiced_quantity=None):
 		'''
-			Return the quantity that can be invoiced for this line item.
+			Return the quantity that can be invoiced for this line item (unless it is given by the caller, the quantity
+			already invoiced is looked up).
 		'''
-		invoiced = self.get_invoiced_quantity()
+		invoiced = self.get_invoiced_quantity() if invoiced_quantity is None else float(invoiced_quantity)
 		return float(self.po_line_item.delivered_quantity) - invoiced
 		
-	def clean(self, ):
+	def clean(self, invoiced_quantity=None):
+		invoiceable_quantity = self.get_invoiceable_quantity(invoiced_quantity)
 		if self.quantity < 1:
 			raise ValidationError("Invoice quantity must be greater than 0")
-		if self.quantity > self.get_invoiceable_quantity():
-			raise ValidationError(f"Invoice quantity exceeds the outstanding invoiceable quantity ({self.get_invoiceable_quantity()})")
+		if self.quantity > invoiceable_quantity:
+			raise ValidationError(f"Invoice quantity exceeds the outstanding invoiceable quantity ({invoiceable_quantity})")
 	
-	def save(self, *args, **kwargs):
-		# Save the instance with the calculated fields updated
+	def set_calculated_values(self):
 		self.quantity = self.grn_line_item.quantity_received
 		self.gross_total = self.calculate_gross_total()
 		self.net_total = self.calculate_net_total()
 		self.tax_amount = self.calculate_tax_amount()
+	
+	def save(self, *args, **kwargs):
+		# Save the instance with the calculated fields updated
+		self.set_calculated_values()
 		self.clean()
 		# self.po_line_item = self.grn_line_item.purchase_order_line_item
 		super(InvoiceLineItem, self).save(*args, **kwargs)
 	
 	def __str__(self):
 		return f"{self.po_line_item.product_name} ({self.quantity})"
+
+
+@receiver(post_save, sender=InvoiceLineItem)
+@receiver(post_delete, sender=InvoiceLineItem)
+def update_invoice_totals_hook(sender, instance, **kwargs):
+	# Keep the stored totals of the invoice in step with its line items (and invalidate its cached hash verification)
+	Invoice.update_totals([instance.invoice_id])
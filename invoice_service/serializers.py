@@ -1,6 +1,8 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
 from .models import Invoice, InvoiceLineItem
 from core_service.serializers import VendorProfileSerializer
+from egrn_service.models import GoodsReceivedNote, GoodsReceivedLineItem
 from egrn_service.serializers import GoodsReceivedNoteSerializer, GoodsReceivedLineItemSerializer, PurchaseOrderSerializer, PurchaseOrderLineItemSerializer
 from approval_service.serializers import SignatureSerializer
 
@@ -62,6 +64,21 @@ class InvoiceSerializer(serializers.ModelSerializer):
 			"signatures": signatures,
 		}
 	
+	@staticmethod
+	def setup_eager_loading(queryset):
+		'''
+			Applies the joins and prefetches this serializer (and its nested serializers) needs to the given Invoice
+			queryset, so that serializing many invoices runs a fixed number of queries (plus one per invoice for the
+			signatures).
+		'''
+		return queryset.prefetch_related(
+			Prefetch('grn', queryset=GoodsReceivedNoteSerializer.setup_eager_loading(GoodsReceivedNote.objects.all())),
+			Prefetch('invoice_line_items', queryset=InvoiceLineItem.objects.prefetch_related(
+				Prefetch('grn_line_item',
+				         queryset=GoodsReceivedLineItemSerializer.setup_eager_loading(GoodsReceivedLineItem.objects.all()))
+			)),
+		)
+	
 	def to_representation(self, instance):
 		serialized = super().to_representation(instance)
 		grn = GoodsReceivedNoteSerializer(instance.grn).data
@@ -74,4 +91,48 @@ class InvoiceSerializer(serializers.ModelSerializer):
 		model = Invoice
 		fields = ['id', 'external_document_id','description', 'date_created', 'due_date', 'payment_terms',
 				  'payment_reason', 'gross_total', 'total_tax_amount', 'net_total', 'invoice_line_items', 'workflow', 'grn', 'vendor', 'purchase_order']
-		read_only_fields = ['id', 'gross_total', 'total_tax_amount', 'net_total']
\ No newline at end of file
+		read_only_fields = ['id', 'gross_total', 'total_tax_amount', 'net_total']
+
+
+class InvoiceListSerializer(serializers.ModelSerializer):
+	'''
+		Compact representation of an invoice for listings: the invoice header with its stored totals and workflow state,
+		and the numbers of the GRN and purchase order it was raised against. See InvoiceSerializer for the full graph.
+	'''
+	gross_total = serializers.DecimalField(max_digits=15, decimal_places=2, coerce_to_string=False, read_only=True)
+	total_tax_amount = serializers.DecimalField(max_digits=15, decimal_places=2, coerce_to_string=False, read_only=True)
+	net_total = serializers.DecimalField(max_digits=15, decimal_places=2, coerce_to_string=False, read_only=True)
+	grn_number = serializers.IntegerField(source='grn.grn_number', read_only=True, default=None)
+	po_id = serializers.IntegerField(source='purchase_order.po_id', read_only=True)
+	vendor = serializers.SerializerMethodField()
+	workflow = serializers.SerializerMethodField()
+	
+	def get_vendor(self, obj):
+		vendor = obj.purchase_order.vendor
+		return {
+			"byd_internal_id": vendor.byd_internal_id,
+			"vendor_name": vendor.user.first_name if vendor.user else None,
+		}
+	
+	def get_workflow(self, obj):
+		# The stored workflow state only, the signatures are returned by the full representation
+		return {
+			"signatories": obj.signatories,
+			"pending_approval_from": obj.current_pending_signatory,
+			"completed": obj.is_completely_signed,
+			"approved": obj.is_accepted,
+		}
+	
+	@staticmethod
+	def setup_eager_loading(queryset):
+		'''
+			Applies the joins this serializer needs to the given Invoice queryset, so that a page is a single query.
+		'''
+		return queryset.select_related('grn', 'purchase_order__vendor__user')
+	
+	class Meta:
+		model = Invoice
+		fields = ['id', 'external_document_id', 'description', 'date_created', 'due_date', 'payment_terms',
+				  'payment_reason', 'gross_total', 'total_tax_amount', 'net_total', 'workflow', 'grn_number', 'po_id',
+				  'vendor']
+
@@ -1,3 +1,141 @@
-from django.test import TestCase
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+from django.core.cache import cache
+from rest_framework.test import APIClient
+from core_service.models import CustomUser, VendorProfile
+from egrn_service.tests import PurchaseOrderTestCase
+from .models import Invoice, InvoiceLineItem
 
-# Create your tests here.
+
+class InvoiceTestCase(PurchaseOrderTestCase):
+	'''
+		Base test case with a vendor user and a GRN of 10 and 4 units at 100 (7.5% VAT) to raise invoices against.
+	'''
+
+	def setUp(self):
+		super().setUp()
+		cache.clear()
+		self.vendor_user = CustomUser.objects.create(username='vendor')
+		self.purchase_order = self.create_purchase_order(1001, quantities=(10, 10))
+		VendorProfile.objects.filter(byd_internal_id='V1').update(user=self.vendor_user)
+		self.grn = self.receive(self.purchase_order, (10, 4))
+		self.grn_line_items = list(self.grn.line_items.order_by('id'))
+
+	def create_invoice(self, grn_line_items=None, **kwargs):
+		invoice = Invoice.objects.create(purchase_order=self.purchase_order, grn=self.grn, due_date=date(2024, 4, 1), **kwargs)
+		invoice.create_line_items([
+			{"grn_line_item_id": grn_line_item.id} for grn_line_item in (grn_line_items or self.grn_line_items)
+		])
+		invoice.seal_class()
+		return invoice
+
+
+class InvoiceTotalsTest(InvoiceTestCase):
+
+	def totals(self, invoice):
+		invoice.refresh_from_db()
+		return invoice.gross_total, invoice.total_tax_amount, invoice.net_total
+
+	def test_totals_are_stored_with_the_line_items(self):
+		invoice = self.create_invoice()
+		self.assertEqual(self.totals(invoice), (Decimal('1505'), Decimal('105'), Decimal('1400')))
+		self.assertEqual(list(Invoice.objects.filter(gross_total__gt=1500)), [invoice])
+
+	def test_an_invoice_without_line_items_has_no_totals(self):
+		invoice = Invoice.objects.create(purchase_order=self.purchase_order, grn=self.grn, due_date=date(2024, 4, 1))
+		self.assertEqual(self.totals(invoice), (None, None, None))
+
+	def test_deleting_a_line_item_updates_the_totals_and_identity_version(self):
+		invoice = self.create_invoice()
+		identity_version = invoice.identity_version
+		invoice.invoice_line_items.get(grn_line_item=self.grn_line_items[1]).delete()
+		self.assertEqual(self.totals(invoice), (Decimal('1075'), Decimal('75'), Decimal('1000')))
+		self.assertEqual(invoice.identity_version, identity_version + 1)
+
+	def test_a_line_item_change_invalidates_the_cached_verification(self):
+		invoice = self.create_invoice()
+		self.assertTrue(Invoice.objects.get(pk=invoice.pk).verify_hash())
+		# The cached result is used while the invoice is unchanged, without loading the line items
+		invoice = Invoice.objects.get(pk=invoice.pk)
+		with self.assertNumQueries(0):
+			self.assertTrue(invoice.verify_hash())
+
+		InvoiceLineItem.objects.filter(invoice=invoice).first().delete()
+		self.assertFalse(Invoice.objects.get(pk=invoice.pk).verify_hash())
+
+
+class InvoiceSubmissionTest(InvoiceTestCase):
+
+	def setUp(self):
+		super().setUp()
+		self.client = APIClient()
+		self.client.force_authenticate(self.vendor_user)
+		async_task = mock.patch('invoice_service.views.async_task')
+		self.views_async_task = async_task.start()
+		self.addCleanup(async_task.stop)
+
+	def payload(self, grn_line_item_ids, **kwargs):
+		return {
+			"grn_number": self.grn.grn_number, "vendor_document_id": "INV-1", "due_date": "2024-04-01",
+			"payment_terms": "30 days", "payment_reason": "Supplies",
+			"invoice_line_items": [{"grn_line_item_id": grn_line_item_id} for grn_line_item_id in grn_line_item_ids],
+			**kwargs
+		}
+
+	def test_invoices_are_created_sealed(self):
+		response = self.client.post('/api/v1/vendor/invoices', [self.payload([item.id for item in self.grn_line_items])],
+		                            format='json')
+		self.assertEqual(response.status_code, 201)
+		invoice = Invoice.objects.get()
+		self.assertTrue(invoice.digest)
+		self.assertTrue(invoice.verify_hash(use_cache=False))
+		self.assertEqual(invoice.current_pending_signatory, 'accounts_payable')
+		self.assertEqual(response.data['data'][0]['gross_total'], Decimal('1505'))
+		self.views_async_task.assert_called_once()
+
+	def test_an_invalid_line_item_rolls_back_the_whole_invoice(self):
+		response = self.client.post('/api/v1/vendor/invoices', [
+			self.payload([self.grn_line_items[0].id]),
+			self.payload([self.grn_line_items[1].id, 0], vendor_document_id="INV-2"),
+		], format='json')
+		self.assertEqual(response.status_code, 201)
+		self.assertEqual(list(Invoice.objects.values_list('external_document_id', flat=True)), ['INV-1'])
+		self.assertEqual(InvoiceLineItem.objects.count(), 1)
+
+	def test_a_line_item_is_not_invoiced_twice(self):
+		grn_line_item_id = self.grn_line_items[1].id
+		response = self.client.post('/api/v1/vendor/invoices', [self.payload([grn_line_item_id, grn_line_item_id])],
+		                            format='json')
+		self.assertEqual(response.status_code, 400)
+		self.assertIn('exceeds the outstanding invoiceable quantity', response.data['data'][self.grn.grn_number])
+		self.assertFalse(Invoice.objects.exists())
+
+
+class InvoiceListTest(InvoiceTestCase):
+
+	def setUp(self):
+		super().setUp()
+		self.invoices = [self.create_invoice([grn_line_item]) for grn_line_item in self.grn_line_items]
+		self.client = APIClient()
+		self.client.force_authenticate(self.vendor_user)
+
+	def test_invoices_are_listed_compactly(self):
+		response = self.client.get('/api/v1/vendor/invoices')
+		self.assertEqual(response.status_code, 200)
+		results = response.data['data']['results']
+		self.assertEqual([invoice['id'] for invoice in results], [invoice.id for invoice in self.invoices[::-1]])
+		self.assertNotIn('invoice_line_items', results[0])
+		self.assertEqual((results[0]['grn_number'], results[0]['po_id'], results[0]['gross_total']),
+		                 (self.grn.grn_number, 1001, Decimal('430')))
+		self.assertEqual(results[0]['workflow']['pending_approval_from'], 'accounts_payable')
+
+	def test_the_full_representation_can_be_requested(self):
+		results = self.client.get('/api/v1/vendor/invoices', {'expand': 'true'}).data['data']['results']
+		self.assertEqual(len(results[0]['invoice_line_items']), 1)
+		self.assertIn('signatures', results[0]['workflow'])
+
+	def test_listing_does_not_query_per_invoice(self):
+		# The vendor profile and the page of invoices
+		with self.assertNumQueries(2):
+			self.client.get('/api/v1/vendor/invoices', {'size': 10, 'cursor': ''})
@@ -1,18 +1,18 @@
+from decimal import Decimal, InvalidOperation
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from rest_framework import status
+from django.db import transaction
+from rest_framework import serializers, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 
-from egrn_service.models import GoodsReceivedNote, GoodsReceivedLineItem
-from overrides.rest_framework import APIResponse
+from egrn_service.models import GoodsReceivedNote
+from overrides.rest_framework import APIResponse, expand_requested
 from overrides.rest_framework import CustomPagination
 from .models import Invoice
-from .serializers import InvoiceSerializer, InvoiceLineItemSerializer
+from .serializers import InvoiceSerializer, InvoiceListSerializer
 
 from django_q.tasks import async_task
 
-# Pagination
-paginator = CustomPagination()
 
 class VendorInvoiceView(APIView):
 	"""
@@ -21,12 +21,34 @@ class VendorInvoiceView(APIView):
 	serializer_class = InvoiceSerializer
 	permission_classes = (IsAuthenticated,)
 	
-	def get(self, request):
+	def get(self, request, invoice_id=None):
 		# Get all invoices for the authenticated vendor
 		invoices = Invoice.objects.filter(purchase_order__vendor=request.user.vendor_profile)
-		paginated = paginator.paginate_queryset(invoices, request, order_by='-date_created')
-		invoices_serializer = InvoiceSerializer(paginated, many=True, context={'request':request})
-		# Return the paginated response with the serialized GoodsReceivedNote instances
+		# Return the full representation of a single invoice, if requested
+		if invoice_id is not None:
+			invoice = InvoiceSerializer.setup_eager_loading(invoices.filter(id=invoice_id)).first()
+			if not invoice:
+				return APIResponse(f"No invoice found with ID {invoice_id}.", status.HTTP_404_NOT_FOUND)
+			return APIResponse("Invoice Retrieved", status.HTTP_200_OK, data=InvoiceSerializer(invoice, context={'request':request}).data)
+		# Filter by the (stored) gross total of the invoices, if requested
+		try:
+			if request.query_params.get('min_total'):
+				invoices = invoices.filter(gross_total__gte=Decimal(request.query_params.get('min_total')))
+			if request.query_params.get('max_total'):
+				invoices = invoices.filter(gross_total__lte=Decimal(request.query_params.get('max_total')))
+		except InvalidOperation:
+			return APIResponse("Invalid total, expected a number", status.HTTP_400_BAD_REQUEST)
+		# List the compact representation of the invoices, unless the full representation is requested
+		serializer_class = InvoiceSerializer if expand_requested(request) else InvoiceListSerializer
+		invoices = serializer_class.setup_eager_loading(invoices)
+		# Paginate the invoices, with a paginator per request as it holds the page state
+		paginator = CustomPagination()
+		try:
+			paginated = paginator.paginate_queryset(invoices, request, order_by='-date_created', keyset=('-date_created', '-id'))
+		except serializers.ValidationError as e:
+			return APIResponse("Invalid pagination parameters.", status.HTTP_400_BAD_REQUEST, data=e.detail)
+		invoices_serializer = serializer_class(paginated, many=True, context={'request':request})
+		# Return the paginated response with the serialized Invoice instances
 		paginated_data = paginator.get_paginated_response(invoices_serializer.data).data
 		return APIResponse("Invoices Retrieved", status.HTTP_200_OK, data=paginated_data)
 	
@@ -59,7 +81,7 @@ class VendorInvoiceView(APIView):
 			# Create the Invoice object
 			invoice_data = {
 				'grn': grn.id,
-				'purchase_order': grn.purchase_order.id,
+				'purchase_order': grn.purchase_order_id,
 				'external_document_id': data.get('vendor_document_id'),
 				'description': data.get('description', ''),
 				'due_date': data['due_date'],
@@ -67,58 +89,34 @@ class VendorInvoiceView(APIView):
 				'payment_reason': data['payment_reason']
 			}
 			invoice_serializer = InvoiceSerializer(data=invoice_data)
-			if invoice_serializer.is_valid():
-				invoice = invoice_serializer.save()
-			else:
+			if not invoice_serializer.is_valid():
 				# Record an error for this entry and continue to the next entry
 				failed[grn_number] = ", ".join([i for i in invoice_serializer.errors])
 				continue
-			# Create InvoiceLineItem objects
-			for line_item in data.get('invoice_line_items', []):
-				
-				try:
-					grn_line_item_id = line_item['grn_line_item_id']
-					# Retrieve PurchaseOrderLineItem object
-					grn_line_item = GoodsReceivedLineItem.objects.get(id=grn_line_item_id,
-					                                                 grn=grn.id)
-					# Create InvoiceLineItem object
-					line_item['invoice'] = invoice.id  # Associate with the created invoice
-					line_item['grn_line_item'] = grn_line_item.id  # Associate with the corresponding PO line item
-					line_item['po_line_item'] = grn_line_item.purchase_order_line_item.id  # Associate with the corresponding PO line item
-					line_item_serializer = InvoiceLineItemSerializer(data=line_item)
-					
-					if line_item_serializer.is_valid():
-						line_item_serializer.save()
-						# Seal the created invoice (i.e. generates a unique fingerprint of the invoice)
-						invoice.seal_class()
-						# Serialize and return the created invoice
-						created.append(InvoiceSerializer(invoice).data)
-					else:
-						# Rollback the created invoice and record and error for this entry if line item creation fails
-						raise ValidationError(line_item_serializer.errors)
-				except ObjectDoesNotExist:
-					# Rollback the created invoice and record an error for this entry if line item creation fails
-					invoice.delete()
-					failed[grn_number] = f"A GRN Line Item with ID {grn_line_item_id} was not found for this GRN."
-					continue
-				except ValidationError as e:
-					invoice.delete()
-					e = ', '.join([i for i in e])
-					failed[grn_number] = e
-					continue
-				except Exception as e:
-					invoice.delete()
-					failed[grn_number] = e
-					continue
+			try:
+				# Create the invoice and its line items and seal it in one transaction, so that a failed line rolls back
+				# the whole invoice
+				with transaction.atomic():
+					invoice = invoice_serializer.save()
+					invoice.create_line_items(data.get('invoice_line_items', []))
+					# Seal the created invoice (i.e. generates a unique fingerprint of the invoice)
+					invoice.seal_class()
+				created.append(invoice.id)
+			except ObjectDoesNotExist as e:
+				failed[grn_number] = str(e)
+			except ValidationError as e:
+				failed[grn_number] = ', '.join(e.messages)
+			except Exception as e:
+				failed[grn_number] = str(e)
 		
-		# If any of the invoices were created, return the created invoices
+		# If any of the invoices were created, serialize them and notify their first signatories
 		if created:
-			for item in created:
-				item = dict(item)
-				async_task('vimp.tasks.notify_approval_required', item, q_options={
-					'task_name': f'Notify-Next-Signatory-For-Invoice-{item.get("id")}',
-				})
-			return APIResponse("Invoices Created", status.HTTP_201_CREATED, data=created)
+			invoices = InvoiceSerializer.setup_eager_loading(Invoice.objects.filter(id__in=created).order_by('id'))
+			serialized = [dict(item) for item in InvoiceSerializer(invoices, many=True).data]
+			async_task('vimp.tasks.notify_approvals_required', serialized, q_options={
+				'task_name': f'Notify-Next-Signatory-For-{len(serialized)}-Invoices-From-{serialized[0].get("id")}',
+			})
+			return APIResponse("Invoices Created", status.HTTP_201_CREATED, data=serialized)
 		
 		# If none of the invoices were created, return the errors
 		return APIResponse("Failed to create invoices", status.HTTP_400_BAD_REQUEST, data=failed)
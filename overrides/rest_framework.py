@@ -1,6 +1,18 @@
+import json
+from asgiref.sync import sync_to_async
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from django.db.models import Q
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
+from rest_framework import status
+from rest_framework.exceptions import APIException, AuthenticationFailed, MethodNotAllowed, NotAuthenticated, \
+	PermissionDenied, Throttled
+from rest_framework.settings import api_settings
 from rest_framework import pagination, serializers
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 class APIResponse(Response):
 	def __init__(self, message: object, status: object, **kwargs: object) -> object:
@@ -19,12 +31,98 @@ class APIResponse(Response):
 		super().__init__(response_data, status=status)
 
 
+def as_django_response(response):
+	'''
+		Prepares a DRF response (e.g. an APIResponse) to be returned by a plain Django view, such as an async view (DRF
+		views can not be async), which does not negotiate a renderer: the response is rendered as JSON.
+	'''
+	response.accepted_renderer = JSONRenderer()
+	response.accepted_media_type = response.accepted_renderer.media_type
+	response.renderer_context = {}
+	return response
+
+
+def drf_error_response(exc, request, authenticators=()):
+	'''
+		Returns the response an API view gives to the given APIException (through the configured EXCEPTION_HANDLER),
+		prepared for a plain Django view.
+	'''
+	if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+		# As APIView.handle_exception: a 401 challenged by the first authenticator, or a 403 if it has no challenge
+		auth_header = authenticators[0].authenticate_header(request) if authenticators else None
+		if auth_header:
+			exc.auth_header = auth_header
+		else:
+			exc.status_code = status.HTTP_403_FORBIDDEN
+	response = api_settings.EXCEPTION_HANDLER(exc, {'view': None, 'args': (), 'kwargs': {}, 'request': request})
+	return as_django_response(response)
+
+
+async def initialize_async(request, methods, authentication_classes, permission_classes=None, throttle_classes=None):
+	'''
+		Does for a plain (async) Django view what @api_view and APIView.initial do for an API view: authenticates the
+		request with the given DRF authentication classes, checks the permission classes (DEFAULT_PERMISSION_CLASSES by
+		default), the throttle classes (DEFAULT_THROTTLE_CLASSES by default) and the request method. Returns (user, None),
+		or (None, the DRF error response) for the view to return. The checks run in a thread, as the authentication and
+		throttles may query the database or the cache.
+	'''
+	def initialize():
+		authenticators = [authentication() for authentication in authentication_classes]
+		drf_request = Request(request, authenticators=authenticators)
+		try:
+			for permission in [permission() for permission in (permission_classes or api_settings.DEFAULT_PERMISSION_CLASSES)]:
+				if not permission.has_permission(drf_request, None):
+					if drf_request.authenticators and not drf_request.successful_authenticator:
+						raise NotAuthenticated()
+					raise PermissionDenied(getattr(permission, 'message', None))
+			# As APIView.check_throttles: every throttle is checked, and the longest wait is reported
+			durations = [
+				throttle.wait() for throttle in [throttle() for throttle in (throttle_classes or api_settings.DEFAULT_THROTTLE_CLASSES)]
+				if not throttle.allow_request(drf_request, None)
+			]
+			if durations:
+				durations = [duration for duration in durations if duration is not None]
+				raise Throttled(max(durations, default=None))
+			if request.method not in methods:
+				raise MethodNotAllowed(request.method)
+		except APIException as exc:
+			response = drf_error_response(exc, drf_request, authenticators)
+			if isinstance(exc, MethodNotAllowed):
+				response['Allow'] = ', '.join(methods)
+			return None, response
+		return drf_request.user, None
+	return await sync_to_async(initialize)()
+
+
+def expand_requested(request) -> bool:
+	'''
+		Whether the full (nested) representation of the listed objects is requested, with ?expand=true (or 1).
+	'''
+	return str(request.query_params.get('expand', '')).lower() in ('1', 'true', 'yes')
+
+
 class CustomPagination(PageNumberPagination):
 	page_query_param = "page"
 	page_size_query_param = "size"
+	cursor_query_param = "cursor"
 	max_page_size  = 30
-
-	def paginate_queryset(self, queryset, request, view=None, order_by=None):
+	# Bounds of the 'limit' and 'offset' query parameters
+	min_limit = 1
+	max_limit = max_page_size
+	min_offset = 0
+	max_offset = 10000
+	
+	def paginate_queryset(self, queryset, request, view=None, order_by=None, keyset=None):
+		'''
+			Paginates the queryset by page number or, when the view passes its keyset ordering (e.g. ('-date_created', '-id'),
+			ending in a unique field) and the request has a 'cursor' parameter (empty for the first page), by keyset.
+			Keyset pagination is opt-in: page number responses of a view with a keyset carry a 'next_cursor' link, which
+			continues from the last record of the page by keyset, so that clients can move over from page numbers.
+		'''
+		self.request, self.keyset, self.by_keyset = request, keyset, False
+		if keyset and self.cursor_query_param in request.query_params:
+			return self.paginate_queryset_by_keyset(queryset, request, keyset)
+		
 		# Sort the queryset based on the 'order_by' query parameter, always show latest records first
 		queryset = queryset.order_by(order_by) if order_by else queryset
 		# Get 'limit' and 'offset' from request query parameters
@@ -47,4 +145,86 @@ class CustomPagination(PageNumberPagination):
 			elif offset < self.min_offset:
 				raise serializers.ValidationError({"offset": ["Offset should be greater than or equal to {0}".format(self.min_offset)]})
 
-		return super(CustomPagination, self).paginate_queryset(queryset, request, view)
\ No newline at end of file
+		return super(CustomPagination, self).paginate_queryset(queryset, request, view)
+	
+	def paginate_queryset_by_keyset(self, queryset, request, keyset):
+		'''
+			Returns the page of the queryset after (or, for a previous page, before) the position in the cursor. The page is
+			selected with a WHERE on the keyset values, so deep pages cost the same as the first page and no COUNT is run.
+		'''
+		self.request, self.keyset, self.by_keyset = request, keyset, True
+		page_size = self.get_page_size(request)
+		position, reverse = self.decode_cursor(request.query_params.get(self.cursor_query_param), queryset.model)
+		# A previous page is read backwards from the cursor position
+		ordering = [self.flip(field) for field in keyset] if reverse else list(keyset)
+		queryset = queryset.order_by(*ordering)
+		if position is not None:
+			queryset = queryset.filter(self.after(ordering, position))
+		
+		results = list(queryset[:page_size + 1])
+		has_more = len(results) > page_size
+		results = results[:page_size]
+		if reverse:
+			results.reverse()
+		
+		# Cursors are only emitted for the directions that have records
+		has_next, has_previous = (True, has_more) if reverse else (has_more, position is not None)
+		self.next_cursor = self.encode_cursor(results[-1], reverse=False) if has_next and results else None
+		self.previous_cursor = self.encode_cursor(results[0], reverse=True) if has_previous and results else None
+		return results
+	
+	def get_paginated_response(self, data):
+		if not self.by_keyset:
+			response = super().get_paginated_response(data)
+			if self.keyset:
+				# Link the keyset page following this page
+				last = self.page.object_list[len(self.page.object_list) - 1] if self.page.has_next() else None
+				response.data['next_cursor'] = self.get_cursor_link(self.encode_cursor(last, reverse=False) if last else None)
+			return response
+		return Response(OrderedDict([
+			('next', self.get_cursor_link(self.next_cursor)),
+			('previous', self.get_cursor_link(self.previous_cursor)),
+			('results', data),
+		]))
+	
+	def get_cursor_link(self, cursor):
+		if cursor is None:
+			return None
+		url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+		return replace_query_param(url, self.cursor_query_param, cursor)
+	
+	@staticmethod
+	def flip(field):
+		return field[1:] if field.startswith('-') else f'-{field}'
+	
+	@staticmethod
+	def after(ordering, position):
+		'''
+			Builds the condition for the rows that come after the given position in the given ordering, i.e.
+			(a < x) OR (a = x AND b < y) ... for descending fields.
+		'''
+		condition, equal = Q(), Q()
+		for field, value in zip(ordering, position):
+			name = field.lstrip('-')
+			condition |= equal & Q(**{f'{name}__lt' if field.startswith('-') else f'{name}__gt': value})
+			equal &= Q(**{name: value})
+		return condition
+	
+	def encode_cursor(self, instance, reverse):
+		values = [getattr(instance, field.lstrip('-')) for field in self.keyset]
+		payload = {'p': [value.isoformat() if hasattr(value, 'isoformat') else value for value in values], 'r': reverse}
+		return urlsafe_b64encode(json.dumps(payload).encode()).decode()
+	
+	def decode_cursor(self, cursor, model):
+		if not cursor:
+			return None, False
+		try:
+			payload = json.loads(urlsafe_b64decode(cursor.encode()).decode())
+			position = [
+				model._meta.get_field(field.lstrip('-')).to_python(value) for field, value in zip(self.keyset, payload['p'])
+			]
+			if len(position) != len(self.keyset):
+				raise ValueError
+		except Exception:
+			raise serializers.ValidationError({self.cursor_query_param: ["Invalid cursor."]})
+		return position, bool(payload.get('r'))
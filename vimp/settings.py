@@ -242,6 +242,9 @@ MEDIA_URL = 'media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, MEDIA_URL)
 STATIC_ROOT = os.path.join(BASE_DIR, STATIC_URL)
 
+# Reports and checkpoints of the signable integrity audit (see approval_service.audit)
+SIGNABLE_AUDIT_DIR = os.getenv('SIGNABLE_AUDIT_DIR', os.path.join(BASE_DIR, 'audit'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
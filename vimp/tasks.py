@@ -61,6 +61,20 @@ def post_to_icg(instance, ):
 	return order_details, order_items, instance.posted_to_icg
 
 
+def post_grns_to_icg(instances, ):
+	'''
+		Post a batch of GRNs to ICG, see post_to_icg. A failure to post one GRN does not stop the rest of the batch.
+	'''
+	results = []
+	for instance in instances:
+		try:
+			results.append(post_to_icg(instance))
+		except Exception as e:
+			logger.error(f"Error posting GRN {instance.grn_number} to ICG: {e}")
+			results.append(None)
+	return results
+
+
 def send_grn_to_email(created_grn, ):
 	# Serialize the GoodsReceivedNote instance along with its related GoodsReceivedLineItem instances
 	goods_received_note = GoodsReceivedNoteSerializer(created_grn).data
@@ -82,6 +96,20 @@ def send_grn_to_email(created_grn, ):
 	return email.send()
 
 
+def send_grns_to_email(created_grns, ):
+	'''
+		Email a batch of GRNs, see send_grn_to_email. A failure to email one GRN does not stop the rest of the batch.
+	'''
+	results = []
+	for created_grn in created_grns:
+		try:
+			results.append(send_grn_to_email(created_grn))
+		except Exception as e:
+			logger.error(f"Error emailing GRN {created_grn.grn_number}: {e}")
+			results.append(None)
+	return results
+
+
 def notify_approval_required(signable):
 	'''
 		Send an email notification to the users in the pending role who need to approve the given
@@ -129,6 +157,21 @@ def notify_approval_required(signable):
 		return email.send()
 	
 
+def notify_approvals_required(signables):
+	'''
+		Send the approval notifications of a batch of signable objects, see notify_approval_required. A failure to notify
+		the signatories of one object does not stop the rest of the batch.
+	'''
+	results = []
+	for signable in signables:
+		try:
+			results.append(notify_approval_required(signable))
+		except Exception as e:
+			logger.error(f"Error notifying the signatories of signable {signable.get('id')}: {e}")
+			results.append(None)
+	return results
+
+
 def send_otp_to_user(args):
 	from core_service.models import VendorProfile
 	otp = args.get('otp')
@@ -181,6 +224,15 @@ def send_reset_link_to_user(args):
 		return True
 
 
+def audit_signables(model='invoice_service.Invoice', ):
+	'''
+		Audits the sealed digests and signature chains of signable objects, resuming an interrupted pass from its
+		checkpoint, or starting a new pass over all the objects once the last one has completed.
+	'''
+	from django.core.management import call_command
+	return call_command('audit_signables', model=model, resume=True)
+
+
 if __name__ == "__main__":
 	# from invoice_service.models import Invoice
 	# from invoice_service.serializers import InvoiceSerializer